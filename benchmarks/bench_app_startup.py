@@ -0,0 +1,102 @@
+"""Cold-start and rerun latency of the Streamlit app
+
+Cold start is measured as a fresh interpreter executing the app script once, reruns as
+further executions of the script within the same process, which is what Streamlit
+does on every widget interaction. W&B runs in offline mode.
+
+To compare against an older revision, check it out next to this one and point --app
+at its script, e.g.
+
+    git worktree add /tmp/before <commit>
+    python benchmarks/bench_app_startup.py --app /tmp/before/src/app.py
+    python benchmarks/bench_app_startup.py
+
+Before and after the app stopped importing langchain, wandb and the ingest pipeline
+and creating a W&B run on every script execution (5 starts, 20 reruns each,
+streamlit 1.30.0, langchain 0.0.240, openai 0.28.1, wandb 0.26.1 offline, Python 3.11):
+
+    revision   cold start p50   rerun p50   rerun p95
+    before          5937 ms       366 ms      416 ms
+    after           1736 ms        35 ms       41 ms
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+import numpy as np
+
+APP = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src", "app.py")
+
+_CHILD = """
+import sys, time, json
+start = time.perf_counter()
+from streamlit.testing.v1 import AppTest
+app = AppTest.from_file({app!r}, default_timeout=120)
+app.run()
+cold = time.perf_counter() - start
+reruns = []
+for _ in range({reruns}):
+    start = time.perf_counter()
+    app.run()
+    reruns.append(time.perf_counter() - start)
+# AppTest records a script error instead of raising it, a failed run would look fast
+if app.exception:
+    sys.exit(f"The app raised: {{app.exception[0].value}}")
+print(json.dumps({{"cold_start": cold, "reruns": reruns}}))
+"""
+
+
+def get_parser():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--app", type=str, default=APP, help="The app script to measure")
+    parser.add_argument("--starts", type=int, default=5, help="Cold starts to measure")
+    parser.add_argument("--reruns", type=int, default=20, help="Reruns to measure per start")
+    return parser
+
+
+def main():
+    args = get_parser().parse_args()
+    app_dir = os.path.dirname(os.path.abspath(args.app))
+    env = dict(
+        os.environ,
+        WANDB_MODE="offline",
+        OPENAI_API_KEY=os.environ.get("OPENAI_API_KEY", "stub"),
+        # the app imports its sibling modules, which `streamlit run` finds next to the script
+        PYTHONPATH=os.pathsep.join(filter(None, [app_dir, os.environ.get("PYTHONPATH")])),
+    )
+    cold, reruns = [], []
+    for _ in range(args.starts):
+        # the app's sqlite files and the offline W&B run are written below the working directory
+        with tempfile.TemporaryDirectory() as workdir:
+            child = subprocess.run(
+                [sys.executable, "-c", _CHILD.format(app=os.path.abspath(args.app), reruns=args.reruns)],
+                cwd=workdir,
+                env=env,
+                capture_output=True,
+                text=True,
+            )
+        if child.returncode:
+            sys.exit(child.stderr.strip().splitlines()[-1] if child.stderr.strip() else "The app run failed")
+        result = json.loads(child.stdout.strip().splitlines()[-1])
+        cold.append(result["cold_start"])
+        reruns.extend(result["reruns"])
+    cold_ms, reruns_ms = np.array(cold) * 1000, np.array(reruns) * 1000
+    print(
+        json.dumps(
+            {
+                "app": args.app,
+                "cold_start_ms_p50": round(float(np.percentile(cold_ms, 50)), 1),
+                "cold_start_ms_max": round(float(cold_ms.max()), 1),
+                "rerun_ms_p50": round(float(np.percentile(reruns_ms, 50)), 2),
+                "rerun_ms_p95": round(float(np.percentile(reruns_ms, 95)), 2),
+            },
+            indent=2,
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
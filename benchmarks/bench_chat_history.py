@@ -0,0 +1,78 @@
+"""Cost of opening and paging a chat window as conversations grow
+
+For each conversation length a session is filled with that many turns, next to other
+sessions' turns, and the timings of what a rerun touches are reported: opening the
+window (once per session or video switch), loading an older page, the deepest page,
+and persisting a new turn. The rendered window stays at most --max_turns turns long
+whatever the length.
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
+
+from chat_history import ChatHistoryStore, ChatWindow
+
+
+def get_parser():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--lengths", type=int, nargs="+", default=[100, 10000, 100000], help="Turns per conversation")
+    parser.add_argument("--other_sessions", type=int, default=20, help="Other conversations of the same length")
+    parser.add_argument("--page_size", type=int, default=20, help="Turns per page")
+    parser.add_argument("--max_turns", type=int, default=100, help="Turns held by a window")
+    return parser
+
+
+def ms(seconds: float) -> float:
+    return round(seconds * 1000, 3)
+
+
+def main():
+    args = get_parser().parse_args()
+    report = []
+    for length in args.lengths:
+        with tempfile.TemporaryDirectory() as workdir:
+            store = ChatHistoryStore(os.path.join(workdir, "chat_history.sqlite"))
+            rows = [
+                (f"session-{s}", "dQw4w9WgXcQ", f"question {i}", f"answer {i} " * 20, float(i))
+                for i in range(length)
+                for s in range(args.other_sessions + 1)
+            ]
+            with store._conn:
+                store._conn.executemany(
+                    "INSERT INTO turns (session_id, video_id, question, answer, created) VALUES (?, ?, ?, ?, ?)", rows
+                )
+
+            start = time.perf_counter()
+            window = ChatWindow(store, "session-0", "dQw4w9WgXcQ", args.page_size, args.max_turns)
+            open_seconds = time.perf_counter() - start
+            start = time.perf_counter()
+            window.load_older()
+            older_seconds = time.perf_counter() - start
+            start = time.perf_counter()
+            store.page("session-0", "dQw4w9WgXcQ", args.page_size, before_id=args.other_sessions + 2)
+            deepest_seconds = time.perf_counter() - start
+            start = time.perf_counter()
+            window.add("one more question", "one more answer")
+            add_seconds = time.perf_counter() - start
+            report.append(
+                {
+                    "turns": length,
+                    "rows_in_store": len(rows),
+                    "open_window_ms": ms(open_seconds),
+                    "load_older_ms": ms(older_seconds),
+                    "deepest_page_ms": ms(deepest_seconds),
+                    "add_turn_ms": ms(add_seconds),
+                    "rendered_turns": len(window.turns),
+                }
+            )
+            store.close()
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,159 @@
+"""Scaling of sharded corpus search over corpus size and shard count
+
+A synthetic corpus stands in for a channel of many videos: every video's chunks are
+spread around the video's own direction, and videos share a limited number of topics.
+For every corpus size the chunks are split into segments as ingest would write them,
+exact brute-force search over all of them is the baseline, and for every shard count
+the corpus is sharded with `shards.build_corpus` and served by `shards.ShardedSearcher`.
+Shards only search in parallel with as many cores as shards, see "cpus".
+Reported: build and worker start-up time, latency percentiles and recall@k of
+unfiltered queries, and latency, recall and shards reached by queries filtered to the
+video the query was drawn from.
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
+
+import numpy as np
+
+from numpy_store import NumpyVectorStore, _normalize
+from shards import ShardedSearcher, build_corpus
+
+
+def synthetic_corpus(n_chunks: int, dim: int, chunks_per_video: int, n_topics: int, seed: int = 0):
+    """(normalised vectors, video id per chunk)"""
+    rng = np.random.default_rng(seed)
+    n_videos = max(1, n_chunks // chunks_per_video)
+    topics = rng.standard_normal((n_topics, dim)).astype(np.float32)
+    videos = topics[rng.integers(0, n_topics, n_videos)] + 0.6 * rng.standard_normal((n_videos, dim)).astype(np.float32)
+    video_of_chunk = np.sort(rng.integers(0, n_videos, n_chunks))
+    vectors = videos[video_of_chunk] + 0.6 * rng.standard_normal((n_chunks, dim)).astype(np.float32)
+    return _normalize(vectors), [f"video{v:06d}" for v in video_of_chunk]
+
+
+def segment_stores(vectors: np.ndarray, video_ids: list, n_segments: int) -> list:
+    bounds = np.linspace(0, len(vectors), n_segments + 1).astype(int)
+    return [
+        NumpyVectorStore(
+            None,
+            None,
+            vectors[start:end],
+            [str(i) for i in range(start, end)],
+            [{"source": video_ids[i]} for i in range(start, end)],
+        )
+        for start, end in zip(bounds[:-1], bounds[1:])
+    ]
+
+
+def exact_top_k(vectors: np.ndarray, query: np.ndarray, k: int, rows: np.ndarray = None) -> set:
+    if rows is None:
+        rows = np.arange(len(vectors))
+    scores = vectors[rows] @ query
+    return {str(rows[i]) for i in np.argsort(-scores)[:k]}
+
+
+def ms(seconds: float) -> float:
+    return round(seconds * 1000, 3)
+
+
+def percentile_ms(timings: list, q: float) -> float:
+    return ms(float(np.percentile(timings, q)))
+
+
+def get_parser():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[20000, 100000, 300000], help="Chunks in the corpus")
+    parser.add_argument("--shards", type=int, nargs="+", default=[1, 2, 4, 8], help="Shard counts")
+    parser.add_argument("--sharding", type=str, default="video", choices=["video", "hash"], help="Shard placement")
+    parser.add_argument("--dim", type=int, default=256, help="Embedding dimension")
+    parser.add_argument("--chunks_per_video", type=int, default=100, help="Average chunks of a video")
+    parser.add_argument("--topics", type=int, default=200, help="Topics the videos are drawn around")
+    parser.add_argument("--segments", type=int, default=4, help="Segments the corpus is ingested in")
+    parser.add_argument("--queries", type=int, default=200, help="Queries per configuration")
+    parser.add_argument("--k", type=int, default=10, help="Results per query")
+    parser.add_argument("--nprobe", type=int, default=16, help="IVF lists scanned by one shard of the whole corpus")
+    parser.add_argument("--threads", action="store_true", help="Serve shards from threads instead of processes")
+    return parser
+
+
+def main():
+    args = get_parser().parse_args()
+    for size in args.sizes:
+        vectors, video_ids = synthetic_corpus(size, args.dim, args.chunks_per_video, args.topics)
+        stores = segment_stores(vectors, video_ids, args.segments)
+        rng = np.random.default_rng(1)
+        sources = rng.integers(0, size, args.queries)
+        queries = _normalize(vectors[sources] + 0.05 * rng.standard_normal((args.queries, args.dim)).astype(np.float32))
+        video_rows = {}
+        for row, video_id in enumerate(video_ids):
+            video_rows.setdefault(video_id, []).append(row)
+
+        exact_timings, truth = [], []
+        for query in queries:
+            start = time.perf_counter()
+            truth.append(exact_top_k(vectors, query, args.k))
+            exact_timings.append(time.perf_counter() - start)
+        filtered_truth = [
+            exact_top_k(vectors, query, args.k, np.asarray(video_rows[video_ids[source]]))
+            for query, source in zip(queries, sources)
+        ]
+        entry = {
+            "cpus": os.cpu_count(),
+            "chunks": size,
+            "videos": len(video_rows),
+            "exact_p50_ms": percentile_ms(exact_timings, 50),
+            "exact_p95_ms": percentile_ms(exact_timings, 95),
+            "sharded": [],
+        }
+
+        for n_shards in args.shards:
+            with tempfile.TemporaryDirectory() as corpus_dir:
+                start = time.perf_counter()
+                build_corpus(stores, corpus_dir, n_shards, args.sharding)
+                build_seconds = time.perf_counter() - start
+                start = time.perf_counter()
+                searcher = ShardedSearcher(corpus_dir, nprobe=args.nprobe, processes=not args.threads)
+                start_seconds = time.perf_counter() - start
+                searcher.search(queries[0], args.k)
+
+                timings, recalls = [], []
+                for query, expected in zip(queries, truth):
+                    start = time.perf_counter()
+                    hits = searcher.search(query, args.k)
+                    timings.append(time.perf_counter() - start)
+                    recalls.append(len({doc.page_content for doc, _ in hits} & expected) / len(expected))
+
+                requests_before = searcher.shard_requests
+                filtered_timings, filtered_recalls = [], []
+                for query, source, expected in zip(queries, sources, filtered_truth):
+                    start = time.perf_counter()
+                    hits = searcher.search(query, args.k, video_ids=[video_ids[source]])
+                    filtered_timings.append(time.perf_counter() - start)
+                    filtered_recalls.append(len({doc.page_content for doc, _ in hits} & expected) / len(expected))
+                searcher.close()
+
+            entry["sharded"].append(
+                {
+                    "shards": n_shards,
+                    "shard_sizes": searcher.sizes,
+                    "build_s": round(build_seconds, 3),
+                    "start_s": round(start_seconds, 3),
+                    "p50_ms": percentile_ms(timings, 50),
+                    "p95_ms": percentile_ms(timings, 95),
+                    f"recall@{args.k}": round(float(np.mean(recalls)), 4),
+                    "filtered_p50_ms": percentile_ms(filtered_timings, 50),
+                    "filtered_p95_ms": percentile_ms(filtered_timings, 95),
+                    f"filtered_recall@{args.k}": round(float(np.mean(filtered_recalls)), 4),
+                    "filtered_shards_per_query": (searcher.shard_requests - requests_before) / len(queries),
+                }
+            )
+        print(json.dumps(entry, indent=2), flush=True)
+
+
+if __name__ == "__main__":
+    main()
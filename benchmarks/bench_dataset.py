@@ -0,0 +1,75 @@
+"""Size, write and read time of the Parquet and JSON-lines transcript datasets
+
+The fixture transcript is chunked like an ingest run and repeated under --videos video
+ids to stand in for a multi-video dataset. Reported per format: bytes on disk, write
+time, time to read back every document, and for Parquet the time to read only the
+token counts and only the chunks of one video.
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
+
+from langchain.docstore.document import Document
+
+from chunking import stream_chunks
+from dataset import TranscriptDataset, write_jsonl, write_parquet
+
+FIXTURE = os.path.join(os.path.dirname(os.path.abspath(__file__)), "fixtures", "transcript.txt")
+
+
+def get_parser():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--videos", type=int, default=50, help="Copies of the fixture transcript")
+    parser.add_argument("--chunk_size", type=int, default=500, help="Chunk size in characters")
+    parser.add_argument("--chunk_overlap", type=int, default=100, help="Chunk overlap in characters")
+    parser.add_argument("--batch_rows", type=int, default=1024, help="Rows per Parquet row group")
+    return parser
+
+
+def timed(fn) -> float:
+    start = time.perf_counter()
+    fn()
+    return round(time.perf_counter() - start, 4)
+
+
+def main():
+    args = get_parser().parse_args()
+    with open(FIXTURE, "r") as f:
+        text = f.read()
+    chunks = []
+    for i in range(args.videos):
+        transcript = Document(page_content=text, metadata={"source": f"video{i:06d}", "start": 0.0, "end": 0.0})
+        chunks.extend(stream_chunks([transcript], args.chunk_size, args.chunk_overlap))
+
+    report = {"chunks": len(chunks), "formats": {}}
+    with tempfile.TemporaryDirectory() as workdir:
+        parquet_path = os.path.join(workdir, "documents.parquet")
+        jsonl_path = os.path.join(workdir, "documents.json")
+
+        def write_json_lines():
+            with open(jsonl_path, "w") as f:
+                write_jsonl(chunks, f)
+
+        report["formats"]["jsonl"] = {"write_s": timed(write_json_lines)}
+        report["formats"]["parquet"] = {
+            "write_s": timed(lambda: write_parquet(chunks, parquet_path, batch_rows=args.batch_rows))
+        }
+        for name, path in (("jsonl", jsonl_path), ("parquet", parquet_path)):
+            stats = report["formats"][name]
+            stats["bytes"] = os.path.getsize(path)
+            stats["read_all_s"] = timed(lambda: sum(1 for _ in TranscriptDataset(path)))
+            stats["read_one_video_s"] = timed(lambda: sum(1 for _ in TranscriptDataset(path).documents(["video000007"])))
+        report["formats"]["parquet"]["read_token_counts_s"] = timed(
+            lambda: sum(batch.num_rows for batch in TranscriptDataset(parquet_path).batches(["n_tokens"]))
+        )
+        report["size_ratio"] = round(report["formats"]["parquet"]["bytes"] / report["formats"]["jsonl"]["bytes"], 3)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,61 @@
+"""Measure the batched embedding pipeline against the local stub OpenAI server"""
+import argparse
+import json
+import os
+import sys
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
+
+from langchain.docstore.document import Document
+from langchain.embeddings import OpenAIEmbeddings
+
+from embedding_pipeline import EmbeddingPipeline
+from stub_openai import start_stub_server
+
+
+def synthetic_chunks(n_chunks: int, words_per_chunk: int = 90):
+    for i in range(n_chunks):
+        text = " ".join(f"word{(i * 7 + j) % 5000}" for j in range(words_per_chunk))
+        yield Document(page_content=text, metadata={"chunk": i})
+
+
+def get_parser():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--chunks", default=2000, type=int, help="The number of chunks to embed")
+    parser.add_argument("--workers", default=4, type=int, help="Concurrent embedding requests")
+    parser.add_argument("--batch_tokens", default=8000, type=int, help="Token budget per batch")
+    parser.add_argument("--latency", default=0.05, type=float, help="Stub latency per request")
+    parser.add_argument("--rate_limit_prob", default=0.0, type=float, help="Stub 429 probability")
+    return parser
+
+
+def main():
+    args = get_parser().parse_args()
+    server = start_stub_server(latency=args.latency, rate_limit_prob=args.rate_limit_prob)
+    embeddings = OpenAIEmbeddings(
+        openai_api_key="stub",
+        openai_api_base=f"http://127.0.0.1:{server.server_port}/v1",
+        max_retries=0,
+    )
+    pipeline = EmbeddingPipeline(
+        embeddings, max_batch_tokens=args.batch_tokens, max_workers=args.workers, base_delay=0.05
+    )
+    stats = pipeline.run(synthetic_chunks(args.chunks), lambda documents, vectors: None)
+    server.shutdown()
+    print(
+        json.dumps(
+            {
+                "chunks": stats.chunks,
+                "tokens": stats.tokens,
+                "batches": stats.batches,
+                "retries": stats.retries,
+                "seconds": round(stats.seconds, 3),
+                "chunks_per_sec": round(stats.chunks_per_sec, 1),
+                "tokens_per_sec": round(stats.tokens_per_sec, 1),
+            }
+        )
+    )
+
+
+if __name__ == "__main__":
+    main()
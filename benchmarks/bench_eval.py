@@ -0,0 +1,91 @@
+"""Run the evaluation fully offline and measure how much the response cache saves
+
+Fixture videos are ingested against the stub OpenAI server and served as local
+artifacts (see `run_benchmarks`), questions are generated from the fixture
+transcript with its sentences as reference answers, and `evaluate.Evaluator` runs
+two configurations twice: the first pass answers and grades every question, the
+second is served from the response cache. Wall time and the number of stub requests
+of both passes are reported next to the evaluation summaries.
+"""
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(os.path.dirname(BENCHMARKS_DIR), "src"))
+
+from run_benchmarks import FIXTURE, LocalRun, fixture_transcript, register_artifacts
+from stub_openai import start_stub_server
+
+
+def get_parser():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--videos", type=int, default=5, help="Fixture videos in the index")
+    parser.add_argument("--questions", type=int, default=40, help="Questions in the evaluation set")
+    parser.add_argument("--concurrency", type=int, default=8, help="Questions answered at once")
+    parser.add_argument("--latency", type=float, default=0.02, help="Stub latency per request")
+    parser.add_argument("--latency_per_token", type=float, default=0.0005, help="Stub latency per token")
+    return parser
+
+
+def main():
+    args = get_parser().parse_args()
+    server = start_stub_server(latency=args.latency, latency_per_token=args.latency_per_token)
+    workdir = tempfile.mkdtemp(prefix="ytchat-eval-")
+    os.chdir(workdir)
+    os.environ.update(
+        OPENAI_API_BASE=f"http://127.0.0.1:{server.server_port}/v1", OPENAI_API_KEY="stub", WANDB_MODE="offline"
+    )
+
+    import ingest
+    from config import default_config
+    from evaluate import EvalConfig, Evaluator, Example, ResponseCache
+
+    ingest.load_documents = fixture_transcript
+    vector_store_path = os.path.join(workdir, "vector_store")
+    for i in range(args.videos):
+        ingest.ingest_data(
+            video_url=f"fixture-{i:05d}",
+            chunk_size=default_config.chunk_size,
+            chunk_overlap=default_config.chunk_overlap,
+            vector_store_path=vector_store_path,
+        )
+    run = LocalRun(register_artifacts(workdir, vector_store_path), vars(default_config))
+
+    with open(FIXTURE, "r") as f:
+        sentences = [line.strip() for line in f if line.strip()]
+    examples = [
+        Example(f"what did he say about {' '.join(sentence.split()[3:9])}", sentence)
+        for sentence in (sentences * (args.questions // len(sentences) + 1))[: args.questions]
+    ]
+    configs = [
+        EvalConfig(name="default"),
+        EvalConfig(name="small_context", retrieval_fetch_k=4, context_token_budget=500),
+    ]
+
+    cache = ResponseCache(os.path.join(workdir, "eval.sqlite"))
+    evaluator = Evaluator(run, openai_api_key="stub", concurrency=args.concurrency, cache=cache)
+    report = {"questions": len(examples), "passes": []}
+    for name in ("cold", "cached"):
+        requests = server.RequestHandlerClass.config.requests
+        start = time.perf_counter()
+        summaries = evaluator.run_all(configs, examples)
+        report["passes"].append(
+            {
+                "pass": name,
+                "seconds": round(time.perf_counter() - start, 3),
+                "stub_requests": server.RequestHandlerClass.config.requests - requests,
+                "summaries": summaries,
+            }
+        )
+    server.shutdown()
+    shutil.rmtree(workdir, ignore_errors=True)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,84 @@
+"""Per-question overhead of a fresh ChatOpenAI + LLMChain against the pooled chain
+
+Both variants answer the same questions from --threads concurrent threads against
+the stub model server, so the difference in latency is client construction and
+connection setup. A new thread per question mimics Streamlit reruns.
+"""
+import argparse
+import json
+import os
+import sys
+import threading
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
+
+from stub_openai import start_stub_server
+
+
+def get_parser():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--questions", type=int, default=200, help="Questions per variant")
+    parser.add_argument("--threads", type=int, default=8, help="Questions asked concurrently")
+    parser.add_argument("--latency", type=float, default=0.01, help="Stub latency per request")
+    return parser
+
+
+def measure(answer, n_questions: int, n_threads: int) -> dict:
+    from run_benchmarks import percentiles
+
+    latencies = []
+    lock = threading.Lock()
+    limit = threading.Semaphore(n_threads)
+
+    def ask(i: int):
+        start = time.perf_counter()
+        answer(f"question number {i}")
+        with lock:
+            latencies.append(time.perf_counter() - start)
+        limit.release()
+
+    start = time.perf_counter()
+    threads = []
+    for i in range(n_questions):
+        limit.acquire()
+        thread = threading.Thread(target=ask, args=(i,))
+        thread.start()
+        threads.append(thread)
+    for thread in threads:
+        thread.join()
+    seconds = time.perf_counter() - start
+    return {"questions_per_sec": round(n_questions / seconds, 1), "latency": percentiles(latencies)}
+
+
+def main():
+    args = get_parser().parse_args()
+    server = start_stub_server(latency=args.latency, latency_per_token=0.0)
+    os.environ.update(OPENAI_API_BASE=f"http://127.0.0.1:{server.server_port}/v1", OPENAI_API_KEY="stub")
+
+    from langchain.chains import LLMChain
+    from langchain.chat_models import ChatOpenAI
+    from langchain.prompts import PromptTemplate
+
+    from llm_pool import llm_pool
+
+    prompt = PromptTemplate.from_template("Answer the following question: {question}")
+
+    def fresh(question: str):
+        llm = ChatOpenAI(model_name="gpt-3.5-turbo", temperature=0.3, max_tokens=64)
+        LLMChain(llm=llm, prompt=prompt).run(question=question)
+
+    def pooled(question: str):
+        llm_pool.chain(prompt, model_name="gpt-3.5-turbo", temperature=0.3, max_tokens=64).run(question=question)
+
+    results = {
+        "fresh": measure(fresh, args.questions, args.threads),
+        "pooled": measure(pooled, args.questions, args.threads),
+        "pool": llm_pool.stats(),
+    }
+    print(json.dumps(results, indent=2))
+    server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,107 @@
+"""Recall, latency and size of quantized NumPy stores against the float32 store
+
+Every encoding in `quantization.QUANTIZATIONS` is persisted from the same vectors and
+reopened from disk. Reported per encoding: bytes on disk (what an artifact upload or
+download moves), persist and open time, query latency percentiles and recall@k of the
+float32 results. Quantized encodings are measured twice: ranked on their quantized
+vectors alone, and as "<encoding>+rerank" with a float32 sidecar whose exact scores
+re-rank `--rerank_factor * k` candidates, recorded as "exact_scores". Pass --chroma_dir to use an existing store such as
+artifacts/vector_store-latest, otherwise a clustered synthetic corpus stands in for
+real embeddings, with queries drawn near corpus vectors.
+"""
+import argparse
+import json
+import os
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
+
+import numpy as np
+from langchain.docstore.document import Document
+
+from numpy_store import NumpyVectorStore, convert_chroma
+from quantization import QUANTIZATIONS
+
+
+def synthetic_embeddings(n_chunks: int, dim: int, n_clusters: int = 100, seed: int = 0) -> np.ndarray:
+    rng = np.random.default_rng(seed)
+    centers = rng.standard_normal((n_clusters, dim))
+    return (centers[rng.integers(0, n_clusters, n_chunks)] + 0.5 * rng.standard_normal((n_chunks, dim))).astype(
+        np.float32
+    )
+
+
+def dir_size(path: str) -> int:
+    return sum(os.path.getsize(os.path.join(path, name)) for name in os.listdir(path))
+
+
+def get_parser():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--chroma_dir", type=str, default=None, help="An existing Chroma store to quantize")
+    parser.add_argument("--chunks", type=int, default=20000, help="Chunks in the synthetic corpus")
+    parser.add_argument("--dim", type=int, default=1536, help="Embedding dimension of the synthetic corpus")
+    parser.add_argument("--queries", type=int, default=200, help="Number of queries")
+    parser.add_argument("--k", type=int, default=10, help="Results per query")
+    parser.add_argument("--rerank_factor", type=int, default=4, help="Candidates per result re-ranked exactly")
+    return parser
+
+
+def main():
+    args = get_parser().parse_args()
+    rng = np.random.default_rng(1)
+    with tempfile.TemporaryDirectory() as workdir:
+        if args.chroma_dir:
+            embeddings = convert_chroma(args.chroma_dir, os.path.join(workdir, "converted")).embeddings
+        else:
+            embeddings = synthetic_embeddings(args.chunks, args.dim)
+        documents = [Document(page_content=str(i), metadata={"row": i}) for i in range(len(embeddings))]
+        noise = 0.3 * rng.standard_normal((args.queries, embeddings.shape[1])).astype(np.float32)
+        queries = embeddings[rng.integers(0, len(embeddings), args.queries)] + noise
+
+        report = {"chunks": len(embeddings), "dim": int(embeddings.shape[1]), "k": args.k, "encodings": {}}
+        exact = None
+        variants = [(quantization, 0) for quantization in QUANTIZATIONS]
+        variants += [(quantization, args.rerank_factor) for quantization in QUANTIZATIONS if quantization != "float32"]
+        for quantization, rerank_factor in variants:
+            name = f"{quantization}+rerank" if rerank_factor else quantization
+            store_dir = os.path.join(workdir, name)
+            store = NumpyVectorStore(None, store_dir, quantization=quantization, rerank_factor=rerank_factor)
+            store.add_embeddings(documents, embeddings)
+            start = time.perf_counter()
+            store.persist()
+            persist_seconds = time.perf_counter() - start
+
+            start = time.perf_counter()
+            store = NumpyVectorStore.load(store_dir, None)
+            open_seconds = time.perf_counter() - start
+
+            results, latencies = [], []
+            for query in queries:
+                start = time.perf_counter()
+                hits = store.similarity_search_by_vector_with_score(query, k=args.k)
+                latencies.append(time.perf_counter() - start)
+                results.append({document.metadata["row"] for document, _ in hits})
+            if exact is None:
+                exact = results
+            latencies_ms = np.array(latencies) * 1000
+            report["encodings"][name] = {
+                "bytes": dir_size(store_dir),
+                "exact_scores": quantization == "float32" or bool(rerank_factor),
+                "persist_ms": round(persist_seconds * 1000, 1),
+                "open_ms": round(open_seconds * 1000, 2),
+                "query_p50_ms": round(float(np.percentile(latencies_ms, 50)), 3),
+                "query_p95_ms": round(float(np.percentile(latencies_ms, 95)), 3),
+                f"recall@{args.k}": round(
+                    float(np.mean([len(got & want) / len(want) for got, want in zip(results, exact)])), 4
+                ),
+            }
+        float32_bytes = report["encodings"]["float32"]["bytes"]
+        for stats in report["encodings"].values():
+            stats["size_ratio"] = round(stats["bytes"] / float32_bytes, 3)
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
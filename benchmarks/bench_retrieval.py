@@ -0,0 +1,96 @@
+"""Per-mode retrieval latency and recall on a fixed synthetic question set
+
+The corpus and questions are generated from a fixed seed: every question is a handful
+of words sampled from one chunk, which is the chunk it should retrieve. Query
+embeddings come from the stub's hashed bag-of-words model with --embed_latency
+seconds added per call to stand in for the OpenAI round-trip.
+"""
+import argparse
+import json
+import os
+import sys
+import time
+from typing import List
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
+
+import numpy as np
+from langchain.docstore.document import Document
+from langchain.embeddings.base import Embeddings
+
+from bm25 import BM25Index
+from numpy_store import NumpyVectorStore
+from segments import RETRIEVAL_MODES, SegmentedVectorStore
+from stub_openai import stub_embedding
+
+
+class StubEmbeddings(Embeddings):
+    def __init__(self, dim: int, latency: float):
+        self.dim = dim
+        self.latency = latency
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return [stub_embedding(text, self.dim) for text in texts]
+
+    def embed_query(self, text: str) -> List[float]:
+        time.sleep(self.latency)
+        return stub_embedding(text, self.dim)
+
+
+def synthetic_corpus(n_chunks: int, n_questions: int, words_per_chunk: int = 80, seed: int = 0):
+    rng = np.random.default_rng(seed)
+    vocab = [f"term{i}" for i in range(5000)]
+    # zipf-like word frequencies so that some words are common and others distinctive
+    weights = 1.0 / np.arange(1, len(vocab) + 1)
+    weights /= weights.sum()
+    documents = [
+        Document(
+            page_content=" ".join(rng.choice(vocab, size=words_per_chunk, p=weights)),
+            metadata={"chunk_index": i},
+        )
+        for i in range(n_chunks)
+    ]
+    questions = []
+    for target in rng.choice(n_chunks, size=n_questions, replace=False):
+        words = documents[target].page_content.split()
+        questions.append((" ".join(rng.choice(words, size=6, replace=False)), int(target)))
+    return documents, questions
+
+
+def get_parser():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--chunks", type=int, default=2000, help="Chunks in the corpus")
+    parser.add_argument("--questions", type=int, default=200, help="Questions to ask")
+    parser.add_argument("--k", type=int, default=5, help="Results per question")
+    parser.add_argument("--dim", type=int, default=512, help="Stub embedding dimension")
+    parser.add_argument("--embed_latency", type=float, default=0.05, help="Seconds per query embedding")
+    return parser
+
+
+def main():
+    args = get_parser().parse_args()
+    documents, questions = synthetic_corpus(args.chunks, args.questions)
+    embeddings = StubEmbeddings(args.dim, args.embed_latency)
+    store = NumpyVectorStore(embeddings)
+    store.add_embeddings(documents, embeddings.embed_documents([d.page_content for d in documents]))
+    segmented = SegmentedVectorStore({"corpus": store}, embeddings, lexical={"corpus": BM25Index.build(documents)})
+
+    report = {}
+    for mode in RETRIEVAL_MODES:
+        latencies, hits = [], 0
+        for question, target in questions:
+            start = time.perf_counter()
+            results = segmented.similarity_search(question, k=args.k, mode=mode)
+            latencies.append(time.perf_counter() - start)
+            hits += any(document.metadata["chunk_index"] == target for document in results)
+        latencies_ms = np.array(latencies) * 1000
+        report[mode] = {
+            f"recall@{args.k}": round(hits / len(questions), 3),
+            "p50_ms": round(float(np.percentile(latencies_ms, 50)), 2),
+            "p95_ms": round(float(np.percentile(latencies_ms, 95)), 2),
+        }
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,166 @@
+"""Load test of the HTTP API against the stub model server
+
+A server process ingests --videos fixture videos, then serves them through
+`server.create_app` with a `LocalRun` in place of the W&B run. The client fires
+--requests questions at --concurrency from as many client ids as the per-client
+limit requires, drawing from --distinct different questions so that identical
+questions overlap and get coalesced. Reported are throughput, latency percentiles,
+answered vs coalesced requests and throughput per server CPU second, read from the
+server's /health counters before and after the run.
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import random
+import socket
+import sys
+import tempfile
+import time
+from multiprocessing import Process
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.append(os.path.join(os.path.dirname(BENCHMARKS_DIR), "src"))
+
+import aiohttp
+
+from run_benchmarks import FIXTURE, LocalRun, fixture_transcript, percentiles, register_artifacts
+from stub_openai import start_stub_server
+
+
+def free_port() -> int:
+    with socket.socket() as s:
+        s.bind(("127.0.0.1", 0))
+        return s.getsockname()[1]
+
+
+def serve_fixture(port: int, n_videos: int, stub_url: str, client_concurrency: int):
+    workdir = tempfile.mkdtemp(prefix="ytchat-bench-server-")
+    os.chdir(workdir)
+    os.environ.update(OPENAI_API_BASE=stub_url, OPENAI_API_KEY="stub", WANDB_MODE="offline")
+
+    from aiohttp import web
+
+    import ingest
+    from config import default_config
+    from server import create_app
+
+    ingest.load_documents = fixture_transcript
+    vector_store_path = os.path.join(workdir, "vector_store")
+    for i in range(n_videos):
+        ingest.ingest_data(
+            video_url=f"fixture-{i:05d}",
+            chunk_size=default_config.chunk_size,
+            chunk_overlap=default_config.chunk_overlap,
+            vector_store_path=vector_store_path,
+        )
+    run = LocalRun(register_artifacts(workdir, vector_store_path), vars(default_config))
+    web.run_app(create_app(run, "stub", client_concurrency), host="127.0.0.1", port=port, print=None)
+
+
+async def wait_healthy(session: aiohttp.ClientSession, url: str, timeout: float = 300.0) -> dict:
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            async with session.get(f"{url}/health") as response:
+                return await response.json()
+        except aiohttp.ClientConnectionError:
+            if time.monotonic() > deadline:
+                raise
+            await asyncio.sleep(0.5)
+
+
+async def load_test(url: str, questions, concurrency: int, client_concurrency: int, bypass_cache: bool) -> dict:
+    n_clients = math.ceil(concurrency / client_concurrency)
+    limit = asyncio.Semaphore(concurrency)
+    latencies = []
+    statuses = {}
+
+    async with aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=600)) as session:
+        before = await wait_healthy(session, url)
+        # one unmeasured request opens the store and warms the artifact cache
+        await session.post(f"{url}/ask", json={"question": "warm up"}, headers={"X-Client-Id": "warmup"})
+
+        async def ask(i: int, question: str):
+            async with limit:
+                start = time.perf_counter()
+                async with session.post(
+                    f"{url}/ask",
+                    json={"question": question, "bypass_cache": bypass_cache},
+                    headers={"X-Client-Id": f"client-{i % n_clients}"},
+                ) as response:
+                    await response.read()
+                    statuses[response.status] = statuses.get(response.status, 0) + 1
+                    if response.status == 200:
+                        latencies.append(time.perf_counter() - start)
+
+        start = time.perf_counter()
+        await asyncio.gather(*(ask(i, question) for i, question in enumerate(questions)))
+        seconds = time.perf_counter() - start
+        after = await wait_healthy(session, url)
+
+    cpu_seconds = after["cpu_seconds"] - before["cpu_seconds"]
+    return {
+        "requests": len(questions),
+        "concurrency": concurrency,
+        "seconds": round(seconds, 3),
+        "requests_per_sec": round(len(latencies) / seconds, 1),
+        "requests_per_cpu_sec": round(len(latencies) / cpu_seconds, 1) if cpu_seconds else None,
+        "latency": percentiles(latencies) if latencies else None,
+        "statuses": statuses,
+        "answered": after["answered"] - before["answered"],
+        "coalesced": after["coalesced"] - before["coalesced"],
+    }
+
+
+def get_parser():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--videos", type=int, default=10, help="Fixture videos in the served index")
+    parser.add_argument("--requests", type=int, default=500, help="Questions asked in total")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32, 128], help="Requests in flight")
+    parser.add_argument("--distinct", type=int, default=50, help="Different questions among the requests")
+    parser.add_argument("--client_concurrency", type=int, default=4, help="Per-client limit of the server")
+    parser.add_argument("--bypass_cache", action="store_true", help="Skip the answer cache on every request")
+    parser.add_argument("--latency", type=float, default=0.02, help="Stub latency per request")
+    parser.add_argument("--latency_per_token", type=float, default=0.0005, help="Stub latency per token")
+    parser.add_argument("--output", type=str, default=None, help="Also write the results to this JSON file")
+    return parser
+
+
+def main():
+    args = get_parser().parse_args()
+    stub = start_stub_server(latency=args.latency, latency_per_token=args.latency_per_token)
+    port = free_port()
+    server = Process(
+        target=serve_fixture,
+        args=(port, args.videos, f"http://127.0.0.1:{stub.server_port}/v1", args.client_concurrency),
+        daemon=True,
+    )
+    server.start()
+
+    with open(FIXTURE, "r") as f:
+        sentences = [line.strip() for line in f if line.strip()]
+    rng = random.Random(0)
+    pool = [f"what did he say about {' '.join(rng.choice(sentences).split()[3:9])}" for _ in range(args.distinct)]
+
+    results = []
+    try:
+        for concurrency in args.concurrency:
+            questions = [rng.choice(pool) for _ in range(args.requests)]
+            result = asyncio.run(
+                load_test(f"http://127.0.0.1:{port}", questions, concurrency, args.client_concurrency, args.bypass_cache)
+            )
+            print(json.dumps(result))
+            results.append(result)
+    finally:
+        server.terminate()
+        stub.shutdown()
+
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump({"videos": args.videos, "bypass_cache": args.bypass_cache, "runs": results}, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
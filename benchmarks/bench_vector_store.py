@@ -0,0 +1,93 @@
+"""Compare open time, query latency and peak RSS of the Chroma and NumPy vector stores
+
+Each backend is measured in a fresh process so their memory footprints do not mix.
+Pass --chroma_dir to measure an existing store such as artifacts/vector_store-latest,
+otherwise a synthetic store of --chunks random embeddings is built first.
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import resource
+import sys
+import tempfile
+import time
+
+sys.path.append(os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "src"))
+
+import numpy as np
+from langchain.vectorstores import Chroma
+
+from numpy_store import NumpyVectorStore, convert_chroma
+from segments import search_segment
+
+
+def build_synthetic_chroma(path: str, n_chunks: int, dim: int):
+    rng = np.random.default_rng(0)
+    collection = Chroma(persist_directory=path)._collection
+    for start in range(0, n_chunks, 1000):
+        stop = min(start + 1000, n_chunks)
+        collection.add(
+            ids=[str(i) for i in range(start, stop)],
+            embeddings=rng.standard_normal((stop - start, dim)).astype(np.float32).tolist(),
+            documents=[f"chunk {i}" for i in range(start, stop)],
+            metadatas=[{"chunk_index": i} for i in range(start, stop)],
+        )
+    Chroma(persist_directory=path).persist()
+
+
+def measure(backend: str, path: str, dim: int, n_queries: int, k: int, results):
+    start = time.perf_counter()
+    if backend == "numpy":
+        store = NumpyVectorStore.load(path, None)
+    else:
+        store = Chroma(persist_directory=path)
+    open_seconds = time.perf_counter() - start
+
+    queries = np.random.default_rng(1).standard_normal((n_queries, dim)).astype(np.float32)
+    latencies = []
+    for query in queries:
+        start = time.perf_counter()
+        search_segment(store, query.tolist(), k)
+        latencies.append(time.perf_counter() - start)
+    latencies_ms = np.array(latencies) * 1000
+    results[backend] = {
+        "open_ms": round(open_seconds * 1000, 2),
+        "query_p50_ms": round(float(np.percentile(latencies_ms, 50)), 3),
+        "query_p95_ms": round(float(np.percentile(latencies_ms, 95)), 3),
+        # ru_maxrss is in KiB on Linux
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    }
+
+
+def get_parser():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--chroma_dir", type=str, default=None, help="An existing Chroma store to compare")
+    parser.add_argument("--chunks", type=int, default=500, help="Chunks in the synthetic store")
+    parser.add_argument("--dim", type=int, default=1536, help="Embedding dimension of the synthetic store")
+    parser.add_argument("--queries", type=int, default=200, help="Number of queries to time")
+    parser.add_argument("--k", type=int, default=5, help="Results per query")
+    return parser
+
+
+def main():
+    args = get_parser().parse_args()
+    with tempfile.TemporaryDirectory() as workdir:
+        chroma_dir = args.chroma_dir or os.path.join(workdir, "chroma")
+        if args.chroma_dir is None:
+            build_synthetic_chroma(chroma_dir, args.chunks, args.dim)
+        numpy_dir = os.path.join(workdir, "numpy")
+        dim = convert_chroma(chroma_dir, numpy_dir).embeddings.shape[1]
+
+        results = multiprocessing.Manager().dict()
+        for backend, path in [("chroma", chroma_dir), ("numpy", numpy_dir)]:
+            process = multiprocessing.Process(
+                target=measure, args=(backend, path, dim, args.queries, args.k, results)
+            )
+            process.start()
+            process.join()
+        print(json.dumps(dict(results), indent=2))
+
+
+if __name__ == "__main__":
+    main()
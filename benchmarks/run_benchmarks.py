@@ -0,0 +1,231 @@
+"""Offline end-to-end benchmarks of ingest, retrieval and the question answering path
+
+Everything runs against local stand-ins: the stub OpenAI server for embeddings and
+chat completions, a fixture transcript in place of YouTube, and a `LocalRun` in place
+of the W&B run that serves artifacts from the local ingest output (any real wandb call
+runs with WANDB_MODE=offline). For each corpus size a fresh process ingests that many
+fixture videos and measures
+
+- ingest throughput of `ingest.ingest_data` in chunks/s
+- cold and warm `chains.load_vector_store` time
+- retrieval latency of `similarity_search` (p50/p95/p99)
+- end-to-end latency of load_vector_store + load_chain + chain.run (p50/p95/p99)
+- peak RSS
+
+Results are written to benchmarks/results/<timestamp>-<git commit>.json.
+"""
+import argparse
+import hashlib
+import json
+import multiprocessing
+import os
+import random
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from types import SimpleNamespace
+from typing import Dict, List
+
+BENCHMARKS_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(BENCHMARKS_DIR)
+sys.path.append(os.path.join(REPO_DIR, "src"))
+
+import numpy as np
+from langchain.docstore.document import Document
+
+from stub_openai import start_stub_server
+
+FIXTURE = os.path.join(BENCHMARKS_DIR, "fixtures", "transcript.txt")
+TOPICS = ["kubernetes", "quantization", "caching", "monitoring", "batching", "rollbacks", "drift", "gpus"]
+
+
+def fixture_transcript(video_id: str) -> List[Document]:
+    """A deterministic variation of the fixture transcript for a fake video id"""
+    with open(FIXTURE, "r") as f:
+        sentences = [line.strip() for line in f if line.strip()]
+    rng = random.Random(video_id)
+    rng.shuffle(sentences)
+    topic = TOPICS[int(hashlib.md5(video_id.encode()).hexdigest(), 16) % len(TOPICS)]
+    text = " ".join(f"{sentence} {topic}" if i % 3 == 0 else sentence for i, sentence in enumerate(sentences))
+    return [Document(page_content=text, metadata={"source": video_id})]
+
+
+class LocalArtifact:
+    def __init__(self, path: str):
+        self.path = path
+        self.version = "v0"
+        digest = hashlib.sha1()
+        for root, _, files in sorted(os.walk(path)):
+            for name in sorted(files):
+                digest.update(os.path.join(root, name).encode())
+        self.digest = digest.hexdigest()
+
+    def download(self, root: str = None) -> str:
+        if root is None:
+            return self.path
+        shutil.copytree(self.path, root, dirs_exist_ok=True)
+        return root
+
+
+class LocalRun:
+    """Stands in for a wandb run: artifacts resolve to local directories, logs are kept in memory"""
+
+    def __init__(self, artifacts: Dict[str, str], config: dict):
+        self.artifacts = artifacts
+        self.config = SimpleNamespace(**config)
+        self.logged: List[dict] = []
+
+    def use_artifact(self, name: str, type: str = None) -> LocalArtifact:
+        return LocalArtifact(self.artifacts[name])
+
+    def log(self, data: dict):
+        self.logged.append(data)
+
+
+def register_artifacts(workdir: str, vector_store_path: str) -> Dict[str, str]:
+    from segments import MANIFEST_FILE, SEGMENTS_DIR, local_segments
+
+    artifacts = {}
+    manifest = {"segments": []}
+    for segment_id in local_segments(vector_store_path):
+        name = f"vector_store_segment-{segment_id}:latest"
+        artifacts[name] = os.path.join(vector_store_path, SEGMENTS_DIR, segment_id)
+        manifest["segments"].append({"id": segment_id, "artifact": name})
+    index_dir = os.path.join(workdir, "index_artifact")
+    os.makedirs(index_dir, exist_ok=True)
+    with open(os.path.join(index_dir, MANIFEST_FILE), "w") as f:
+        json.dump(manifest, f)
+    artifacts["vector_store_artifact:latest"] = index_dir
+    prompt_dir = os.path.join(workdir, "prompt_artifact")
+    os.makedirs(prompt_dir, exist_ok=True)
+    shutil.copy(os.path.join(REPO_DIR, "chat_prompt.json"), os.path.join(prompt_dir, "prompt.json"))
+    artifacts["chat_prompt_artifact:latest"] = prompt_dir
+    return artifacts
+
+
+def percentiles(seconds: List[float]) -> dict:
+    ms = np.array(seconds) * 1000
+    return {f"p{p}_ms": round(float(np.percentile(ms, p)), 2) for p in (50, 95, 99)}
+
+
+def bench_corpus(n_videos: int, n_questions: int, stub_url: str, results):
+    workdir = tempfile.mkdtemp(prefix="ytchat-bench-")
+    os.chdir(workdir)
+    os.environ.update(OPENAI_API_BASE=stub_url, OPENAI_API_KEY="stub", WANDB_MODE="offline")
+
+    import chains
+    import ingest
+    from config import default_config
+
+    ingest.load_documents = fixture_transcript
+    vector_store_path = os.path.join(workdir, "vector_store")
+
+    start = time.perf_counter()
+    n_chunks = 0
+    for i in range(n_videos):
+        documents, _ = ingest.ingest_data(
+            video_url=f"fixture-{i:05d}",
+            chunk_size=default_config.chunk_size,
+            chunk_overlap=default_config.chunk_overlap,
+            vector_store_path=vector_store_path,
+        )
+        n_chunks += len(documents)
+    ingest_seconds = time.perf_counter() - start
+
+    run = LocalRun(register_artifacts(workdir, vector_store_path), vars(default_config))
+    start = time.perf_counter()
+    vector_store = chains.load_vector_store(wandb_run=run, openai_api_key="stub")
+    load_cold = time.perf_counter() - start
+    start = time.perf_counter()
+    chains.load_vector_store(wandb_run=run, openai_api_key="stub")
+    load_warm = time.perf_counter() - start
+
+    with open(FIXTURE, "r") as f:
+        sentences = [line.strip() for line in f if line.strip()]
+    questions = [f"what did he say about {' '.join(sentence.split()[3:9])}" for sentence in sentences]
+    questions = (questions * (n_questions // len(questions) + 1))[:n_questions]
+
+    retrieval = []
+    for question in questions:
+        start = time.perf_counter()
+        vector_store.similarity_search(question, k=default_config.retrieval_fetch_k)
+        retrieval.append(time.perf_counter() - start)
+
+    end_to_end = []
+    for question in questions:
+        start = time.perf_counter()
+        db = chains.load_vector_store(wandb_run=run, openai_api_key="stub")
+        chain, docs_pages = chains.load_chain(
+            question=question, db=db, wandb_run=run, vector_store=db, openai_api_key="stub"
+        )
+        chain.run(question=question, docs=docs_pages)
+        end_to_end.append(time.perf_counter() - start)
+
+    results[n_videos] = {
+        "videos": n_videos,
+        "chunks": n_chunks,
+        "ingest_seconds": round(ingest_seconds, 3),
+        "ingest_chunks_per_sec": round(n_chunks / ingest_seconds, 1),
+        "load_vector_store_cold_ms": round(load_cold * 1000, 2),
+        "load_vector_store_warm_ms": round(load_warm * 1000, 3),
+        "retrieval": percentiles(retrieval),
+        "end_to_end": percentiles(end_to_end),
+        # ru_maxrss is in KiB on Linux
+        "peak_rss_mb": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    }
+    shutil.rmtree(workdir, ignore_errors=True)
+
+
+def git_commit() -> str:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=REPO_DIR, capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return "unknown"
+
+
+def get_parser():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[1, 10, 50], help="Corpus sizes in videos")
+    parser.add_argument("--questions", type=int, default=50, help="Questions per corpus size")
+    parser.add_argument("--latency", type=float, default=0.02, help="Stub latency per request")
+    parser.add_argument("--latency_per_token", type=float, default=0.0005, help="Stub latency per token")
+    parser.add_argument("--output_dir", type=str, default=os.path.join(BENCHMARKS_DIR, "results"))
+    return parser
+
+
+def main():
+    args = get_parser().parse_args()
+    server = start_stub_server(latency=args.latency, latency_per_token=args.latency_per_token)
+    stub_url = f"http://127.0.0.1:{server.server_port}/v1"
+
+    results = multiprocessing.Manager().dict()
+    for n_videos in args.sizes:
+        # a process per size keeps caches and peak RSS of one size out of the next
+        process = multiprocessing.Process(target=bench_corpus, args=(n_videos, args.questions, stub_url, results))
+        process.start()
+        process.join()
+        if process.exitcode != 0:
+            raise RuntimeError(f"Benchmark for {n_videos} videos failed with exit code {process.exitcode}")
+    server.shutdown()
+
+    report = {
+        "commit": git_commit(),
+        "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "stub": {"latency": args.latency, "latency_per_token": args.latency_per_token},
+        "sizes": [results[n] for n in args.sizes],
+    }
+    os.makedirs(args.output_dir, exist_ok=True)
+    output_path = os.path.join(args.output_dir, f"{time.strftime('%Y%m%d-%H%M%S')}-{report['commit']}.json")
+    with open(output_path, "w") as f:
+        json.dump(report, f, indent=2)
+    print(json.dumps(report, indent=2))
+    print(f"Wrote {output_path}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,205 @@
+"""A local stand-in for the OpenAI embeddings and chat completions endpoints
+
+Embeddings are deterministic hashed bag-of-words vectors, so similar texts get similar
+vectors and retrieval behaves sensibly without a real model. Point the OpenAI client at
+it with `OPENAI_API_BASE=http://127.0.0.1:<port>/v1` and any `OPENAI_API_KEY`.
+"""
+import argparse
+import hashlib
+import json
+import math
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import List, Union
+
+_WORD_RE = re.compile(r"\w+")
+
+
+def stub_embedding(text: Union[str, List[int]], dim: int) -> List[float]:
+    """Hashed bag-of-words embedding of a text or a list of token ids"""
+    tokens = _WORD_RE.findall(text.lower()) if isinstance(text, str) else [str(t) for t in text]
+    vector = [0.0] * dim
+    for token in tokens:
+        digest = hashlib.md5(token.encode("utf-8")).digest()
+        index = int.from_bytes(digest[:4], "little") % dim
+        vector[index] += 1.0 if digest[4] & 1 else -1.0
+    norm = math.sqrt(sum(v * v for v in vector)) or 1.0
+    return [v / norm for v in vector]
+
+
+class StubConfig:
+    def __init__(self, dim=1536, latency=0.0, latency_per_token=0.0, rate_limit_prob=0.0, answer_words=64):
+        self.dim = dim
+        self.latency = latency
+        self.latency_per_token = latency_per_token
+        self.rate_limit_prob = rate_limit_prob
+        self.answer_words = answer_words
+        self.requests = 0
+        self.lock = threading.Lock()
+
+
+class StubHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    # headers and body are separate writes, with Nagle the body of a response on a
+    # kept-alive connection waits for the client's delayed ACK of the headers
+    disable_nagle_algorithm = True
+    config: StubConfig = None
+
+    def log_message(self, format, *args):
+        pass
+
+    def _send_json(self, status: int, payload: dict):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        if self.path.rstrip("/").endswith("/health"):
+            self._send_json(200, {"status": "ok", "requests": self.config.requests})
+        else:
+            self._send_json(404, {"error": {"message": "not found"}})
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        request = json.loads(self.rfile.read(length) or b"{}")
+        with self.config.lock:
+            self.config.requests += 1
+        if random.random() < self.config.rate_limit_prob:
+            self._send_json(429, {"error": {"message": "Rate limit reached", "type": "requests"}})
+            return
+        time.sleep(self.config.latency)
+        if self.path.endswith("/embeddings"):
+            self._embeddings(request)
+        elif self.path.endswith("/chat/completions"):
+            self._chat(request)
+        else:
+            self._send_json(404, {"error": {"message": "not found"}})
+
+    def _embeddings(self, request: dict):
+        inputs = request["input"]
+        if isinstance(inputs, str) or (inputs and isinstance(inputs[0], int)):
+            inputs = [inputs]
+        n_tokens = sum(len(i) if isinstance(i, list) else len(i.split()) for i in inputs)
+        time.sleep(self.config.latency_per_token * n_tokens)
+        data = [
+            {"object": "embedding", "index": i, "embedding": stub_embedding(text, self.config.dim)}
+            for i, text in enumerate(inputs)
+        ]
+        self._send_json(
+            200,
+            {
+                "object": "list",
+                "data": data,
+                "model": request.get("model", "text-embedding-ada-002"),
+                "usage": {"prompt_tokens": n_tokens, "total_tokens": n_tokens},
+            },
+        )
+
+    def _answer_words(self, request: dict) -> List[str]:
+        prompt = " ".join(m.get("content", "") for m in request.get("messages", []))
+        words = _WORD_RE.findall(prompt) or ["ok"]
+        n_words = min(self.config.answer_words, request.get("max_tokens") or self.config.answer_words)
+        return [words[i % len(words)] for i in range(n_words)]
+
+    def _chat(self, request: dict):
+        words = self._answer_words(request)
+        prompt_tokens = sum(len(m.get("content", "").split()) for m in request.get("messages", []))
+        model = request.get("model", "gpt-3.5-turbo")
+        if request.get("stream"):
+            self._stream_chat(words, model)
+            return
+        time.sleep(self.config.latency_per_token * len(words))
+        self._send_json(
+            200,
+            {
+                "id": "chatcmpl-stub",
+                "object": "chat.completion",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [
+                    {
+                        "index": 0,
+                        "message": {"role": "assistant", "content": " ".join(words)},
+                        "finish_reason": "stop",
+                    }
+                ],
+                "usage": {
+                    "prompt_tokens": prompt_tokens,
+                    "completion_tokens": len(words),
+                    "total_tokens": prompt_tokens + len(words),
+                },
+            },
+        )
+
+    def _stream_chat(self, words: List[str], model: str):
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        self.close_connection = True
+
+        def event(delta: dict, finish_reason=None):
+            chunk = {
+                "id": "chatcmpl-stub",
+                "object": "chat.completion.chunk",
+                "created": int(time.time()),
+                "model": model,
+                "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}],
+            }
+            self.wfile.write(f"data: {json.dumps(chunk)}\n\n".encode("utf-8"))
+            self.wfile.flush()
+
+        event({"role": "assistant"})
+        for i, word in enumerate(words):
+            time.sleep(self.config.latency_per_token)
+            event({"content": word if i == 0 else " " + word})
+        event({}, finish_reason="stop")
+        self.wfile.write(b"data: [DONE]\n\n")
+        self.wfile.flush()
+
+
+def start_stub_server(host: str = "127.0.0.1", port: int = 0, **config) -> ThreadingHTTPServer:
+    """Start the stub server on a daemon thread and return it; `server.server_port` has the port"""
+    handler = type("ConfiguredStubHandler", (StubHandler,), {"config": StubConfig(**config)})
+    server = ThreadingHTTPServer((host, port), handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def get_parser():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", default="127.0.0.1", type=str, help="The interface to bind")
+    parser.add_argument("--port", default=8011, type=int, help="The port to listen on")
+    parser.add_argument("--dim", default=1536, type=int, help="The embedding dimension")
+    parser.add_argument("--latency", default=0.0, type=float, help="Fixed seconds added per request")
+    parser.add_argument(
+        "--latency_per_token", default=0.0, type=float, help="Seconds added per input or output token"
+    )
+    parser.add_argument(
+        "--rate_limit_prob", default=0.0, type=float, help="Probability of answering with a 429"
+    )
+    return parser
+
+
+if __name__ == "__main__":
+    args = get_parser().parse_args()
+    server = start_stub_server(
+        args.host,
+        args.port,
+        dim=args.dim,
+        latency=args.latency,
+        latency_per_token=args.latency_per_token,
+        rate_limit_prob=args.rate_limit_prob,
+    )
+    print(f"Stub OpenAI server listening on http://{args.host}:{server.server_port}/v1")
+    try:
+        threading.Event().wait()
+    except KeyboardInterrupt:
+        server.shutdown()
@@ -0,0 +1,128 @@
+"""Semantic cache of answers for repeated and near-duplicate questions"""
+import logging
+import threading
+import time
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, Hashable, List, Optional, Tuple
+
+import numpy as np
+from langchain.embeddings.base import Embeddings
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_question(question: str) -> str:
+    return " ".join(question.lower().split()).strip(" ?!.")
+
+
+@dataclass
+class _Entry:
+    question: str
+    embedding: np.ndarray
+    answer: str
+    created: float
+
+
+class AnswerCache:
+    """Answers keyed by a namespace and the question asked
+
+    The namespace should pin everything that changes the answer, e.g. the vector store
+    and prompt artifact digests, the model name and the temperature. Exact matches of
+    the normalized question are returned without an embedding call; otherwise the
+    question embedding is compared against cached questions of the namespace and the
+    closest answer is returned if its cosine similarity reaches `similarity_threshold`.
+
+    Args:
+        embeddings (Embeddings): Embeds questions for near-duplicate lookups
+        similarity_threshold (float, optional): Minimum cosine similarity of a near-duplicate. Defaults to 0.95.
+        ttl (float, optional): Seconds an answer stays valid. Defaults to one hour.
+        max_entries (int, optional): Answers kept across all namespaces before LRU eviction. Defaults to 2048.
+    """
+
+    def __init__(
+        self,
+        embeddings: Embeddings,
+        similarity_threshold: float = 0.95,
+        ttl: float = 3600.0,
+        max_entries: int = 2048,
+    ):
+        self.embeddings = embeddings
+        self.similarity_threshold = similarity_threshold
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[Tuple[Hashable, str], _Entry]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.near_hits = 0
+        self.misses = 0
+
+    def _expired(self, entry: _Entry, now: float) -> bool:
+        return now - entry.created > self.ttl
+
+    def _embed(self, question: str) -> np.ndarray:
+        embedding = np.asarray(self.embeddings.embed_query(question), dtype=np.float32)
+        return embedding / (np.linalg.norm(embedding) or 1.0)
+
+    def get(self, namespace: Hashable, question: str, bypass: bool = False) -> Optional[str]:
+        """Return a cached answer for `question` in `namespace`, or None on a miss
+
+        Args:
+            namespace (Hashable): Identifies the index, prompt and model settings
+            question (str): The question asked
+            bypass (bool, optional): Skip the cache entirely. Defaults to False.
+
+        Returns:
+            Optional[str]: The cached answer
+        """
+        if bypass:
+            return None
+        normalized = normalize_question(question)
+        now = time.time()
+        with self._lock:
+            entry = self._entries.get((namespace, normalized))
+            if entry is not None and not self._expired(entry, now):
+                self._entries.move_to_end((namespace, normalized))
+                self.hits += 1
+                return entry.answer
+            candidates: List[Tuple[Tuple[Hashable, str], _Entry]] = [
+                (key, entry)
+                for key, entry in self._entries.items()
+                if key[0] == namespace and not self._expired(entry, now)
+            ]
+
+        if candidates:
+            query = self._embed(normalized)
+            similarities = np.stack([entry.embedding for _, entry in candidates]) @ query
+            best = int(np.argmax(similarities))
+            if similarities[best] >= self.similarity_threshold:
+                key, entry = candidates[best]
+                with self._lock:
+                    if key in self._entries:
+                        self._entries.move_to_end(key)
+                    self.near_hits += 1
+                logger.info(f"Near-duplicate answer cache hit ({similarities[best]:.3f}): {key[1]!r}")
+                return entry.answer
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, namespace: Hashable, question: str, answer: str):
+        """Cache `answer` for `question` in `namespace`"""
+        normalized = normalize_question(question)
+        entry = _Entry(normalized, self._embed(normalized), answer, time.time())
+        with self._lock:
+            self._entries[(namespace, normalized)] = entry
+            self._entries.move_to_end((namespace, normalized))
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "near_hits": self.near_hits,
+                "misses": self.misses,
+                "entries": len(self._entries),
+            }
@@ -1,23 +1,22 @@
 """A Simple chatbot that uses the LangChain and Streamlit to answer questions Youtube videos"""
+import hashlib
 import os
-from types import SimpleNamespace
+from collections import deque
 
 import streamlit as st
 from streamlit_chat import message
 from streamlit_extras.colored_header import colored_header
-from streamlit_extras.add_vertical_space import add_vertical_space
 
-import wandb
-from chains import load_chain, load_vector_store
 from config import default_config
-from ingest import main,get_parser
 
 from dotenv import find_dotenv, load_dotenv
 
+# Streamlit re-executes this script on every interaction, so langchain, wandb and the
+# ingest pipeline are only imported when first needed and the clients built from them
+# are created once per process in the st.cache_resource functions below.
+
 load_dotenv(find_dotenv())
 
-# Initialize a new W&B run to track this job
-run = wandb.init(project="ytchat", job_type="production", entity= "TEAM",reinit=True)
 openai_key = os.getenv("OPENAI_API_KEY")
 
 st.title('🎈 AI YOUTUBE CHAT')
@@ -25,18 +24,176 @@ st.title('🎈 AI YOUTUBE CHAT')
 st.write('USE THE SIDE BAR ON TOP LEFT TO INPUT THE YOUTUBE VIDEO YOU WANT TO CHAT WITH')
 
 
-## generated stores AI generated responses
-if 'generated' not in st.session_state:
-    st.session_state['generated'] = ["I am AI YOUTUBE CHAT, How may I help you?"]
-## past stores User's questions
-if 'past' not in st.session_state:
-    st.session_state['past'] = ['Hi!']
+GREETING = "I am AI YOUTUBE CHAT, How may I help you?"
+
+## the conversation itself lives in the chat history store, see get_chat_window
+## timings stores time-to-first-token and generation time of the latest questions
+if 'timings' not in st.session_state:
+    st.session_state['timings'] = deque(maxlen=default_config.chat_history_max_turns)
+## jobs stores the ids of the ingest jobs submitted from this session
+if 'jobs' not in st.session_state:
+    st.session_state['jobs'] = []
 
 # Layout of input/response containers
 input_container = st.container()
 colored_header(label='', description='', color_name='red-30')
 response_container = st.container()
 
+@st.cache_resource
+def get_run():
+    """One W&B run per process to track this job, shared by all sessions"""
+    import wandb
+    from tracing import tracer
+
+    run = wandb.init(
+        project="ytchat", job_type="production", entity="TEAM", config=vars(default_config), reinit=True
+    )
+    tracer.configure(
+        run=run, enabled=default_config.tracing_enabled, sample_rate=default_config.trace_sample_rate
+    )
+    return run
+
+@st.cache_resource
+def get_embeddings():
+    """One embeddings client per process, shared by all sessions"""
+    from embedding_cache import cached_openai_embeddings
+
+    return cached_openai_embeddings(openai_api_key=openai_key)
+
+@st.cache_resource
+def get_answer_cache():
+    """One answer cache per process, shared by all sessions"""
+    from answer_cache import AnswerCache
+
+    return AnswerCache(
+        get_embeddings(),
+        similarity_threshold=default_config.answer_cache_threshold,
+        ttl=default_config.answer_cache_ttl,
+        max_entries=default_config.answer_cache_max_entries,
+    )
+
+@st.cache_resource
+def get_job_queue():
+    """One ingest worker pool per process, shared by all sessions"""
+    from jobs import JobQueue
+
+    return JobQueue(
+        max_workers=default_config.ingest_max_concurrency, max_history=default_config.ingest_job_history
+    )
+
+@st.cache_resource
+def get_chat_history():
+    """One chat history store per process, shared by all sessions"""
+    from chat_history import ChatHistoryStore
+
+    return ChatHistoryStore(default_config.chat_history_path)
+
+def get_session_id() -> str:
+    """This session's id, kept in the page url so a reload or restart continues the conversation
+
+    The `?session=` url is the only credential of a persisted chat: whoever opens it
+    reads and continues that conversation.
+    """
+    if 'session_id' not in st.session_state:
+        session_id = st.query_params.get('session')
+        if not session_id:
+            from chat_history import new_session_id
+
+            session_id = new_session_id()
+            st.query_params['session'] = session_id
+        st.session_state['session_id'] = session_id
+    return st.session_state['session_id']
+
+def get_chat_window(video_id: str):
+    """The latest turns of this session's conversation about `video_id`
+
+    Only this window is kept in session state and rendered; it is read from the chat
+    history store when the session starts or switches videos, and the memory is
+    re-seeded with its last turns so follow-ups keep working after a restart.
+    """
+    window = st.session_state.get('chat_window')
+    if window is None or window.video_id != video_id:
+        from chat_history import ChatWindow
+
+        window = ChatWindow(
+            get_chat_history(),
+            get_session_id(),
+            video_id,
+            page_size=default_config.chat_history_page_size,
+            max_turns=default_config.chat_history_max_turns,
+        )
+        st.session_state['chat_window'] = window
+        if window.turns:
+            memory = get_memory()
+            memory.clear()
+            for turn in list(window.turns)[-default_config.memory_turns:]:
+                memory.add_turn(turn.question, turn.answer)
+        elif 'memory' in st.session_state:
+            st.session_state['memory'].clear()
+    return window
+
+def show_chat(window):
+    """Render the window of the conversation, older turns are only read on request"""
+    if window.can_load_older:
+        if st.button("Load older messages"):
+            window.load_older()
+    elif window.has_older:
+        st.caption(f"Showing the latest {len(window.turns)} questions")
+    if not window.has_older:
+        message('Hi!', is_user=True, key='greeting_user')
+        message(GREETING, key='greeting')
+    # keys are row ids, so a message keeps its widget across reruns and pages
+    for turn in window.turns:
+        message(turn.question, is_user=True, key=f"{turn.id}_user")
+        message(turn.answer, key=str(turn.id))
+
+def get_memory():
+    """This session's conversation memory, created with its first question"""
+    ## memory stores recent turns and a running summary of older ones for follow-up questions
+    if 'memory' not in st.session_state:
+        from memory import RollingSummaryMemory
+
+        st.session_state['memory'] = RollingSummaryMemory(
+            default_config.model_name,
+            max_turns=default_config.memory_turns,
+            token_budget=default_config.memory_token_budget,
+            summary_tokens=default_config.memory_summary_tokens,
+        )
+    return st.session_state['memory']
+
+def show_jobs():
+    """Status of this session's ingest jobs, refreshed on every rerun"""
+    from jobs import DONE, FAILED
+
+    job_queue = get_job_queue()
+    active = False
+    for job_id in st.session_state.jobs:
+        job = job_queue.get(job_id)
+        if job is None:
+            continue
+        if job.status == FAILED:
+            st.error(f"Processing {job.video_id} failed")
+            st.image('YouTube-Logo.wine.png')
+        elif job.status == DONE:
+            st.success(f"{job.video_id} is ready, {job.chunks} chunks")
+        else:
+            active = True
+            detail = f", {job.chunks} chunks" if job.chunks else ""
+            st.progress(job.progress, text=f"{job.video_id}: {job.stage}{detail}")
+    if active:
+        st.button("Refresh status")
+
+def get_video_id(video_url: str) -> str:
+    """The id of the video entered in the sidebar, "" while none is"""
+    if not video_url.strip():
+        return ""
+    from transcripts import canonical_video_id
+
+    try:
+        return canonical_video_id(video_url)
+    except ValueError:
+        return ""
+
 # User input
 ## Function for taking user provided prompt as input
 def get_text():
@@ -49,18 +206,26 @@ def youtube_chat():
         st.title('💬 Chat with a youtube video')
         st.header('ENTER YOUTUBE VIDEO YOU WANT TO CHAT WITH')
         video_url = st.text_input('Enter VIDEO LINK and click Process:')
+        video_id = get_video_id(video_url)
 
         if video_url[0:24]=='https://www.youtube.com/':
             video_url=video_url
         else:
             video_url = "https://www.youtube.com/watch?v=" + video_url.split('youtu.be/')[-1]
     
+        bypass_answer_cache = st.checkbox("Always generate a fresh answer")
+
         if st.button("Process"):
+            # runs in the background, the same video submitted twice shares one job
             try:
-                with st.spinner("Processing"):
-                    main(video_url)
-            except Exception as e:
-                st.image('YouTube-Logo.wine.png')
+                job = get_job_queue().submit(video_url)
+            except ValueError as e:
+                st.error(str(e))
+            else:
+                if job.id not in st.session_state.jobs:
+                    st.session_state.jobs.append(job.id)
+        if st.session_state.jobs:
+            show_jobs()
 
         st.markdown('''
         ## About
@@ -75,30 +240,66 @@ def youtube_chat():
         user_input = get_text()
         if not user_input:
             st.warning('Please begin conversation by entering your video related Query')
+    window = get_chat_window(video_id)
     ## Conditional display of AI generated responses as a function of user provided prompts
     with response_container:
-        if user_input:
+        # the input keeps its value across reruns, only a new question or the same one
+        # about another video is answered
+        question_key = (video_id, user_input)
+        if user_input and question_key != st.session_state.get('answered_input'):
+            st.session_state['answered_input'] = question_key
+            from chains import answer_cache_namespace, load_chain, load_vector_store
+            from streaming import StreamlitTokenHandler
+            from tracing import increment, record, span, tracer
+
+            run = get_run()
             user_input = user_input.lower()
-         
-            vector_store = load_vector_store(
-                    wandb_run=run, openai_api_key=openai_key
-                )
-            chain,docs_pages = load_chain(question=user_input,db = vector_store,
-                    wandb_run=run, vector_store=vector_store, openai_api_key=openai_key
-                )
-            
-            response = chain.run(question=user_input, docs=docs_pages)
-            response = response.replace("\n", "")
-            st.session_state.past.append(user_input)
-            st.session_state.generated.append(response)
-            
-        if st.session_state['generated']:
-            for i in range(len(st.session_state['generated'])):
-                message(st.session_state['past'][i], is_user=True, key=str(i) + '_user')
-                message(st.session_state["generated"][i], key=str(i))
+
+            with tracer.trace("question"):
+                # queries are embedded by the same client as the answer cache's
+                vector_store = load_vector_store(
+                        wandb_run=run, openai_api_key=openai_key, embeddings=get_embeddings()
+                    )
+                answer_cache = get_answer_cache()
+                memory = get_memory()
+                history = memory.history()
+                namespace = answer_cache_namespace(run, video_id=video_id)
+                if history:
+                    # a follow-up can mean something else in another conversation
+                    namespace += (hashlib.sha1(history.encode("utf-8")).hexdigest(),)
+                with span("answer_cache"):
+                    response = answer_cache.get(namespace, user_input, bypass=bypass_answer_cache)
+                increment("answer_cache_hits", response is not None)
+                if response is None:
+                    # the answer streams into this placeholder and is replaced by the history below
+                    answer_placeholder = st.empty()
+                    token_handler = StreamlitTokenHandler(answer_placeholder)
+                    chain,docs_pages = load_chain(question=user_input,db = vector_store,
+                            wandb_run=run, vector_store=vector_store, openai_api_key=openai_key,
+                            streaming=True, history=history,
+                            filter={"source": video_id} if video_id else None,
+                        )
+
+                    with span("generation"):
+                        response = chain.run(question=user_input, docs=docs_pages, callbacks=[token_handler])
+                    answer_placeholder.empty()
+                    response = response.replace("\n", "")
+                    answer_cache.put(namespace, user_input, response)
+                    st.session_state.timings.append(token_handler.metrics())
+                    for key, value in token_handler.metrics().items():
+                        if value is not None:
+                            record(key, value)
+                memory.add_turn(user_input, response)
+            window.add(user_input, response)
+
+        show_chat(window)
 
         if st.button("New Video"):
-                run.finish()
+                # the W&B run is shared by all sessions, only this session's chat is reset
+                # the stored conversation stays, it is only hidden behind "Load older messages"
+                window.reset()
+                get_memory().clear()
+                st.session_state.pop('answered_input', None)
                 
 
 
@@ -0,0 +1,85 @@
+"""Process-level cache of resources loaded from Weights & Biases artifacts"""
+import logging
+import threading
+import time
+from typing import Any, Callable, Dict, Optional
+
+import wandb
+
+logger = logging.getLogger(__name__)
+
+
+class _Entry:
+    def __init__(self, digest: str, resource: Any, checked_at: float):
+        self.digest = digest
+        self.resource = resource
+        self.checked_at = checked_at
+
+
+class ArtifactCache:
+    """Resolve each artifact alias once and keep the resource built from it in memory
+
+    The artifact behind an alias such as `:latest` is re-resolved at most every
+    `refresh_interval` seconds; it is only downloaded and the resource rebuilt when
+    the digest behind the alias has changed.
+    """
+
+    def __init__(self, refresh_interval: float = 300.0):
+        self.refresh_interval = refresh_interval
+        self._entries: Dict[str, _Entry] = {}
+        self._locks: Dict[str, threading.Lock] = {}
+        self._lock = threading.Lock()
+
+    def _key_lock(self, name: str) -> threading.Lock:
+        with self._lock:
+            return self._locks.setdefault(name, threading.Lock())
+
+    def get(
+        self,
+        wandb_run: wandb.run,
+        name: str,
+        loader: Callable[[str], Any],
+        type: Optional[str] = None,
+    ) -> Any:
+        """Return the resource for an artifact, downloading it only when its digest changed
+
+        Args:
+            wandb_run (wandb.run): An active Weights & Biases run
+            name (str): The artifact name including alias, e.g. "vector_store_artifact:latest"
+            loader (Callable[[str], Any]): Builds the resource from the downloaded artifact directory
+            type (str, optional): The artifact type passed on to `use_artifact`
+
+        Returns:
+            Any: The resource returned by `loader`
+        """
+        entry = self._entries.get(name)
+        if entry is not None and time.monotonic() - entry.checked_at < self.refresh_interval:
+            return entry.resource
+
+        with self._key_lock(name):
+            entry = self._entries.get(name)
+            if entry is not None and time.monotonic() - entry.checked_at < self.refresh_interval:
+                return entry.resource
+
+            artifact = wandb_run.use_artifact(name, type=type) if type else wandb_run.use_artifact(name)
+            if entry is not None and entry.digest == artifact.digest:
+                entry.checked_at = time.monotonic()
+                return entry.resource
+
+            logger.info(f"Downloading {name} ({artifact.digest})")
+            resource = loader(artifact.download())
+            self._entries[name] = _Entry(artifact.digest, resource, time.monotonic())
+            return resource
+
+    def digest(self, name: str) -> Optional[str]:
+        """The digest of the artifact version currently cached for `name`"""
+        entry = self._entries.get(name)
+        return entry.digest if entry is not None else None
+
+    def invalidate(self, name: Optional[str] = None):
+        """Drop one cached artifact, or all of them, forcing a re-resolve on next use"""
+        with self._lock:
+            if name is None:
+                self._entries.clear()
+            else:
+                self._entries.pop(name, None)
@@ -0,0 +1,185 @@
+"""Compact BM25 inverted index over transcript chunks
+
+The index is stored next to a segment's vector store as `bm25.npz` holding the
+postings in CSR form (`indptr`, `doc_ids`, `term_freqs`) plus document lengths, and
+`bm25.jsonl` holding the vocabulary and the chunk texts and metadata.
+"""
+import json
+import logging
+import math
+import os
+import re
+from collections import Counter, defaultdict
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from langchain.docstore.document import Document
+
+logger = logging.getLogger(__name__)
+
+INDEX_FILE = "bm25.npz"
+DOCUMENTS_FILE = "bm25.jsonl"
+
+_TOKEN_RE = re.compile(r"[a-z0-9]+")
+
+STOPWORDS = frozenset(
+    "a an and are as at be but by did do does for from had has have he her his how i if in is it its "
+    "me my not of on or our she so that the their them then there they this to was we were what when "
+    "where which who why will with you your about said say".split()
+)
+
+
+def tokenize(text: str) -> List[str]:
+    return [token for token in _TOKEN_RE.findall(text.lower()) if token not in STOPWORDS]
+
+
+class BM25Index:
+    """Okapi BM25 over a fixed set of chunks
+
+    Build one with `BM25Index.build` (or incrementally with `add` before the first
+    search), persist it with `save` and reopen it with `load`.
+    """
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75):
+        self.k1 = k1
+        self.b = b
+        self.texts: List[str] = []
+        self.metadatas: List[dict] = []
+        self._counts: List[Counter] = []
+        self.vocab: Dict[str, int] = {}
+        self.indptr = np.zeros(1, dtype=np.int64)
+        self.doc_ids = np.zeros(0, dtype=np.int32)
+        self.term_freqs = np.zeros(0, dtype=np.float32)
+        self.doc_lengths = np.zeros(0, dtype=np.float32)
+
+    def __len__(self) -> int:
+        return len(self.texts)
+
+    @classmethod
+    def build(cls, documents: List[Document], **kwargs) -> "BM25Index":
+        index = cls(**kwargs)
+        index.add(documents)
+        index.finalize()
+        return index
+
+    def add(self, documents: List[Document]):
+        """Add documents, call `finalize` before searching"""
+        for document in documents:
+            self.texts.append(document.page_content)
+            self.metadatas.append(document.metadata or {})
+            self._counts.append(Counter(tokenize(document.page_content)))
+
+    def finalize(self):
+        """Compile the added documents into CSR postings"""
+        postings: Dict[str, List[Tuple[int, int]]] = defaultdict(list)
+        for doc_id, counts in enumerate(self._counts):
+            for term, count in counts.items():
+                postings[term].append((doc_id, count))
+        self.vocab = {term: i for i, term in enumerate(sorted(postings))}
+        indptr = [0]
+        doc_ids, term_freqs = [], []
+        for term in sorted(postings):
+            for doc_id, count in postings[term]:
+                doc_ids.append(doc_id)
+                term_freqs.append(count)
+            indptr.append(len(doc_ids))
+        self.indptr = np.asarray(indptr, dtype=np.int64)
+        self.doc_ids = np.asarray(doc_ids, dtype=np.int32)
+        self.term_freqs = np.asarray(term_freqs, dtype=np.float32)
+        self.doc_lengths = np.asarray([sum(counts.values()) for counts in self._counts], dtype=np.float32)
+
+    def save(self, directory: str):
+        os.makedirs(directory, exist_ok=True)
+        np.savez(
+            os.path.join(directory, INDEX_FILE),
+            indptr=self.indptr,
+            doc_ids=self.doc_ids,
+            term_freqs=self.term_freqs,
+            doc_lengths=self.doc_lengths,
+        )
+        with open(os.path.join(directory, DOCUMENTS_FILE), "w") as f:
+            f.write(json.dumps({"k1": self.k1, "b": self.b, "vocab": sorted(self.vocab, key=self.vocab.get)}) + "\n")
+            for text, metadata in zip(self.texts, self.metadatas):
+                f.write(json.dumps({"text": text, "metadata": metadata}) + "\n")
+
+    @classmethod
+    def load(cls, directory: str) -> Optional["BM25Index"]:
+        """Open a saved index, None if `directory` holds none"""
+        if not os.path.exists(os.path.join(directory, INDEX_FILE)):
+            return None
+        arrays = np.load(os.path.join(directory, INDEX_FILE))
+        with open(os.path.join(directory, DOCUMENTS_FILE), "r") as f:
+            header = json.loads(f.readline())
+            rows = [json.loads(line) for line in f]
+        index = cls(k1=header["k1"], b=header["b"])
+        index.vocab = {term: i for i, term in enumerate(header["vocab"])}
+        index.indptr = arrays["indptr"]
+        index.doc_ids = arrays["doc_ids"]
+        index.term_freqs = arrays["term_freqs"]
+        index.doc_lengths = arrays["doc_lengths"]
+        index.texts = [row["text"] for row in rows]
+        index.metadatas = [row["metadata"] for row in rows]
+        return index
+
+    def _idf(self, n_docs_with_term: int) -> float:
+        n_docs = len(self.texts)
+        return math.log(1 + (n_docs - n_docs_with_term + 0.5) / (n_docs_with_term + 0.5))
+
+    def scores(self, query: str) -> Tuple[np.ndarray, float]:
+        """BM25 score of every document for `query` and the highest score any document could reach"""
+        scores = np.zeros(len(self.texts), dtype=np.float32)
+        if not len(self.texts):
+            return scores, 0.0
+        avg_length = float(self.doc_lengths.mean()) or 1.0
+        max_score = 0.0
+        for term in set(tokenize(query)):
+            term_id = self.vocab.get(term)
+            if term_id is None:
+                continue
+            start, stop = self.indptr[term_id], self.indptr[term_id + 1]
+            doc_ids = self.doc_ids[start:stop]
+            tf = self.term_freqs[start:stop]
+            idf = self._idf(stop - start)
+            norm = self.k1 * (1 - self.b + self.b * self.doc_lengths[doc_ids] / avg_length)
+            scores[doc_ids] += idf * tf * (self.k1 + 1) / (tf + norm)
+            max_score += idf * (self.k1 + 1)
+        return scores, max_score
+
+    def search(self, query: str, k: int = 4, filter: Optional[dict] = None) -> List[Tuple[Document, float, float]]:
+        """Top-k (document, score, confidence) triples for `query`
+
+        The confidence is the score divided by the best score reachable for the query,
+        a rough 0-1 measure of how well the query terms are covered by the document.
+        """
+        scores, max_score = self.scores(query)
+        if filter:
+            mask = np.fromiter(
+                (all(metadata.get(key) == value for key, value in filter.items()) for metadata in self.metadatas),
+                dtype=bool,
+                count=len(self.metadatas),
+            )
+            scores = np.where(mask, scores, 0.0)
+        k = min(k, int(np.count_nonzero(scores)))
+        if k == 0:
+            return []
+        top = np.argpartition(-scores, k - 1)[:k]
+        top = top[np.argsort(-scores[top])]
+        return [
+            (
+                Document(page_content=self.texts[i], metadata=self.metadatas[i]),
+                float(scores[i]),
+                float(scores[i]) / max_score if max_score else 0.0,
+            )
+            for i in top
+        ]
+
+
+def reciprocal_rank_fusion(rankings: List[List[Document]], k: int = 60) -> List[Document]:
+    """Merge several rankings of documents, identified by their text, by reciprocal rank"""
+    fused: Dict[str, float] = defaultdict(float)
+    documents: Dict[str, Document] = {}
+    for ranking in rankings:
+        for rank, document in enumerate(ranking):
+            fused[document.page_content] += 1.0 / (k + rank + 1)
+            documents.setdefault(document.page_content, document)
+    return [documents[text] for text in sorted(fused, key=fused.get, reverse=True)]
@@ -1,70 +1,206 @@
 """This module contains functions for loading a ConversationalRetrievalChain"""
 
 import logging
+import threading
 
 import wandb
 #from langchain.chains import ConversationalRetrievalChain
-from langchain.chains import LLMChain
-from langchain.memory import ConversationBufferMemory
-from langchain.chat_models import ChatOpenAI
-from langchain.embeddings import OpenAIEmbeddings
+from langchain.embeddings.base import Embeddings
 from langchain.vectorstores import Chroma
+from langchain.vectorstores.base import VectorStore
+from artifact_cache import ArtifactCache
+from config import default_config
+from context import pack_context
+from embedding_cache import cached_openai_embeddings
+from llm_pool import llm_pool
 from prompts import load_chat_prompt
+from segments import SegmentLoader
+from shards import ShardedSearcher, ShardedVectorStore, corpus_version
+from tracing import record, span, timed
 
-from typing import List,Tuple
+from typing import Dict, Optional, Tuple
 
 
 logger = logging.getLogger(__name__)
 
+VECTOR_STORE_ARTIFACT = "vector_store_artifact:latest"
+CHAT_PROMPT_ARTIFACT = "chat_prompt_artifact:latest"
 
-def load_vector_store(wandb_run: wandb.run, openai_api_key: str) -> Chroma:
+artifact_cache = ArtifactCache(refresh_interval=default_config.artifact_refresh_interval)
+segment_loader = SegmentLoader(
+    default_config.segment_cache_dir,
+    backend=default_config.vector_store_backend,
+    retrieval_mode=default_config.retrieval_mode,
+    bm25_confidence=default_config.bm25_confidence,
+)
+_corpus_stores: Dict[str, ShardedVectorStore] = {}
+_corpus_lock = threading.Lock()
+
+
+@timed("load_vector_store")
+def load_vector_store(
+    wandb_run: wandb.run,
+    openai_api_key: str,
+    artifact_name: str = VECTOR_STORE_ARTIFACT,
+    embeddings: Optional[Embeddings] = None,
+) -> VectorStore:
     """Load a vector store from a Weights & Biases artifact
     Args:
         run (wandb.run): An active Weights & Biases run
         openai_api_key (str): The OpenAI API key to use for embedding
+        artifact_name (str, optional): The index artifact. Defaults to the latest vector_store_artifact.
+        embeddings (Embeddings, optional): The caller's shared embeddings client. Defaults to a new cached one.
+    Returns:
+        VectorStore: A vector store searching all segments of the index
+    """
+
+    def open_vector_store(vector_store_artifact_dir: str) -> VectorStore:
+        embedding_fn = embeddings or cached_openai_embeddings(openai_api_key=openai_api_key)
+        # only segments missing from the local segment cache are downloaded
+        return segment_loader.load(wandb_run, vector_store_artifact_dir, embedding_fn)
+
+    # the store is only re-downloaded and reopened when the artifact behind :latest changes
+    return artifact_cache.get(wandb_run, artifact_name, open_vector_store)
+
+
+def load_corpus_store(
+    openai_api_key: str, corpus_dir: str = default_config.corpus_dir, embeddings: Optional[Embeddings] = None
+) -> ShardedVectorStore:
+    """The sharded corpus of all videos written by `shards.py build`, its shard workers started once per process
+
+    The shard workers are restarted when a rebuild made a new corpus version current
+    or one of them failed; the old ones are stopped.
+
+    Args:
+        openai_api_key (str): The OpenAI API key to use for embedding
+        corpus_dir (str, optional): The corpus directory. Defaults to config.corpus_dir.
+        embeddings (Embeddings, optional): The caller's shared embeddings client. Defaults to a new cached one.
+    Returns:
+        ShardedVectorStore: A store searching every video, or the videos of a `{"source": video_id}` filter
+    """
+    with _corpus_lock:
+        store = _corpus_stores.get(corpus_dir)
+        if store is None or store.searcher.broken is not None or store.searcher.version != corpus_version(corpus_dir):
+            _corpus_stores[corpus_dir] = ShardedVectorStore(
+                ShardedSearcher(corpus_dir, nprobe=default_config.corpus_nprobe),
+                embeddings or cached_openai_embeddings(openai_api_key=openai_api_key),
+            )
+            if store is not None:
+                logger.info(f"Reopened the corpus at version {_corpus_stores[corpus_dir].searcher.version}")
+                store.searcher.close()
+        return _corpus_stores[corpus_dir]
+
+
+def load_prompt(wandb_run: wandb.run):
+    """Load the chat prompt from its Weights & Biases artifact, cached per process"""
+    return artifact_cache.get(
+        wandb_run,
+        CHAT_PROMPT_ARTIFACT,
+        lambda chat_prompt_dir: load_chat_prompt(None, f_name=f"{chat_prompt_dir}/prompt.json"),
+        type="prompt",
+    )
+
+
+def answer_cache_namespace(
+    wandb_run: wandb.run, corpus: Optional[ShardedVectorStore] = None, video_id: Optional[str] = None
+) -> Tuple:
+    """Everything an answer depends on besides the question, for keying cached answers
+
+    Args:
+        wandb_run (wandb.run): An active Weights & Biases run that already loaded the vector store
+        corpus (ShardedVectorStore, optional): The corpus store answering instead of the vector store
+        video_id (str, optional): The video retrieval is restricted to
     Returns:
-        Chroma: A chroma vector store object
+        Tuple: (vector store digest or corpus version, prompt digest, model name, temperature)
     """
-    # load vector store artifact
-    vector_store_artifact_dir = wandb_run.use_artifact("vector_store_artifact:latest").download()
-    embedding_fn = OpenAIEmbeddings(openai_api_key=openai_api_key)
-    # load vector store
-    vector_store = Chroma(
-        embedding_function=embedding_fn, persist_directory=vector_store_artifact_dir
+    load_prompt(wandb_run)
+    if corpus is not None:
+        index = ("corpus", corpus.searcher.version or corpus.searcher.meta["created"], video_id)
+    elif video_id:
+        index = (artifact_cache.digest(VECTOR_STORE_ARTIFACT), video_id)
+    else:
+        index = artifact_cache.digest(VECTOR_STORE_ARTIFACT)
+    return (
+        index,
+        artifact_cache.digest(CHAT_PROMPT_ARTIFACT),
+        wandb_run.config.model_name,
+        wandb_run.config.chat_temperature,
     )
 
-    return vector_store
+
+def build_context(
+    question: str,
+    db: VectorStore,
+    model_name: str,
+    fetch_k: int,
+    token_budget: int,
+    history: str = "",
+    filter: Optional[dict] = None,
+) -> str:
+    """Retrieve the chunks for a question and pack them into the {docs} of the chat prompt
+
+    Args:
+        question (str): The question asked
+        db (VectorStore): The store to retrieve from
+        model_name (str): The chat model, whose tokenizer measures the budget
+        fetch_k (int): Chunks retrieved before packing
+        token_budget (int): Tokens the packed chunks may take up
+        history (str, optional): The conversation so far, appended after the chunks
+        filter (dict, optional): Metadata the retrieved chunks must match, e.g. `{"source": video_id}`
+    Returns:
+        str: The context passed to the prompt as {docs}
+    """
+    with span("retrieval"):
+        docs = db.similarity_search(question, k=fetch_k, filter=filter)
+    # stitch overlapping chunks back together and keep as many as fit the budget
+    with span("pack_context"):
+        context = pack_context(docs, model_name=model_name, token_budget=token_budget)
+    record("context_tokens", context.tokens)
+    record("context_tokens_saved", context.tokens_saved)
+    docs_page_content = context.text
+    if history:
+        # the prompt artifact only has {docs} and {question}, so the bounded history rides along with the context
+        docs_page_content += "\n\nThe conversation so far:\n" + history
+    return docs_page_content
 
 
-def load_chain(question:str,db:Chroma, wandb_run: wandb.run, vector_store: Chroma, openai_api_key: str):
+def load_chain(
+    question: str,
+    db: Chroma,
+    wandb_run: wandb.run,
+    vector_store: Chroma,
+    openai_api_key: str,
+    streaming: bool = False,
+    history: str = "",
+    filter: Optional[dict] = None,
+):
     """Load a ConversationalQA chain from a config and a vector store
+
+    The chain and its chat model client come from the process-wide `llm_pool` and are
+    shared with other questions; pass per-question callbacks when running it.
+
     Args:
         wandb_run (wandb.run): An active Weights & Biases run
         vector_store (Chroma): A Chroma vector store object
         openai_api_key (str): The OpenAI API key to use for embedding
+        streaming (bool, optional): Stream answer tokens to the callbacks the chain is run with
+        history (str, optional): The conversation so far, see `memory.RollingSummaryMemory.history`
+        filter (dict, optional): Metadata the retrieved chunks must match, e.g. `{"source": video_id}`
     Returns:
         ConversationalRetrievalChain: A ConversationalRetrievalChain object
     """
-    docs = db.similarity_search(question, k=5)
-    docs_page_content = " ".join([d.page_content for d in docs])
-
-    """memory = ConversationBufferMemory(
-    memory_key="chat_history",
-    return_messages=True,
+    docs_page_content = build_context(
+        question,
+        db,
+        model_name=wandb_run.config.model_name,
+        fetch_k=default_config.retrieval_fetch_k,
+        token_budget=default_config.context_token_budget,
+        history=history,
+        filter=filter,
     )
-    memory.chat_memory.add_user_message("My name is Akash, what is your name?")
-    memory.chat_memory.add_ai_message("Hello, Akash! My name is AI_YIUTUBE_CHAT. How can I help you today?")"""
 
     retriever = vector_store.as_retriever()
-    llm = ChatOpenAI(
-        openai_api_key=openai_api_key,
-        model_name=wandb_run.config.model_name,
-        temperature=wandb_run.config.chat_temperature,
-        max_retries=wandb_run.config.max_fallback_retries,
-        max_tokens=2048
-    )
-    chat_prompt_dir = wandb_run.use_artifact("chat_prompt_artifact:latest", type="prompt").download()
-    qa_prompt = load_chat_prompt(docs,f_name=f"{chat_prompt_dir}/prompt.json")
+    qa_prompt = load_prompt(wandb_run)
     
     """"qa_chain = ConversationalRetrievalChain.from_llm(
         llm=llm,
@@ -74,6 +210,13 @@ def load_chain(question:str,db:Chroma, wandb_run: wandb.run, vector_store: Chrom
         qa_prompt=qa_prompt,
         memory=memory
     )"""
-    qa_chain = LLMChain(llm=llm, prompt=qa_prompt)
+    qa_chain = llm_pool.chain(
+        qa_prompt,
+        model_name=wandb_run.config.model_name,
+        temperature=wandb_run.config.chat_temperature,
+        max_tokens=2048,
+        streaming=streaming,
+        openai_api_key=openai_api_key,
+    )
     return qa_chain,docs_page_content
 
@@ -0,0 +1,172 @@
+"""Persistent chat history with a bounded, paginated window for rendering
+
+Turns are stored in SQLite, indexed by session and video, so a conversation survives
+restarts of the app. A session only keeps a `ChatWindow` of the most recent turns in
+memory: it starts with the latest page, grows a page at a time when older messages are
+asked for, and never holds more than `max_turns` turns, so rendering a rerun costs the
+same however long the conversation has run. Older pages are read with keyset
+pagination on the row id, which stays fast at any depth.
+
+A conversation is found by its session id alone, there is no user account behind it:
+the apps keep the id in the page url (`?session=`), so anyone holding that url can
+read and continue the chat. Treat it like a password and do not share it.
+"""
+import logging
+import sqlite3
+import threading
+import time
+import uuid
+from collections import deque
+from typing import Deque, List, NamedTuple, Optional
+
+from config import default_config
+
+logger = logging.getLogger(__name__)
+
+
+def new_session_id() -> str:
+    return uuid.uuid4().hex
+
+
+class StoredTurn(NamedTuple):
+    id: int
+    question: str
+    answer: str
+    created: float
+
+
+class ChatHistoryStore:
+    """Turns of all sessions in one SQLite file, shared by the sessions of a process
+
+    Args:
+        path (str, optional): The SQLite file. Defaults to config.chat_history_path.
+    """
+
+    def __init__(self, path: str = default_config.chat_history_path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS turns ("
+            "id INTEGER PRIMARY KEY AUTOINCREMENT, session_id TEXT NOT NULL, video_id TEXT NOT NULL, "
+            "question TEXT NOT NULL, answer TEXT NOT NULL, created REAL NOT NULL)"
+        )
+        # covers the filter and the order of every query below
+        self._conn.execute("CREATE INDEX IF NOT EXISTS turns_session_video ON turns (session_id, video_id, id)")
+        self._conn.commit()
+
+    def add_turn(self, session_id: str, video_id: str, question: str, answer: str) -> StoredTurn:
+        created = time.time()
+        with self._lock:
+            cursor = self._conn.execute(
+                "INSERT INTO turns (session_id, video_id, question, answer, created) VALUES (?, ?, ?, ?, ?)",
+                (session_id, video_id, question, answer, created),
+            )
+            self._conn.commit()
+        return StoredTurn(cursor.lastrowid, question, answer, created)
+
+    def page(
+        self, session_id: str, video_id: str, limit: int, before_id: Optional[int] = None
+    ) -> List[StoredTurn]:
+        """Up to `limit` turns preceding the turn `before_id`, or the latest ones, oldest first"""
+        query = "SELECT id, question, answer, created FROM turns WHERE session_id = ? AND video_id = ?"
+        params = [session_id, video_id]
+        if before_id is not None:
+            query += " AND id < ?"
+            params.append(before_id)
+        with self._lock:
+            rows = self._conn.execute(query + " ORDER BY id DESC LIMIT ?", params + [limit]).fetchall()
+        return [StoredTurn(*row) for row in reversed(rows)]
+
+    def has_older(self, session_id: str, video_id: str, before_id: int) -> bool:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT 1 FROM turns WHERE session_id = ? AND video_id = ? AND id < ? LIMIT 1",
+                (session_id, video_id, before_id),
+            ).fetchone()
+        return row is not None
+
+    def count(self, session_id: str, video_id: str) -> int:
+        with self._lock:
+            (count,) = self._conn.execute(
+                "SELECT COUNT(*) FROM turns WHERE session_id = ? AND video_id = ?", (session_id, video_id)
+            ).fetchone()
+        return count
+
+    def clear(self, session_id: str, video_id: str):
+        with self._lock:
+            self._conn.execute("DELETE FROM turns WHERE session_id = ? AND video_id = ?", (session_id, video_id))
+            self._conn.commit()
+
+    def close(self):
+        self._conn.close()
+
+
+class ChatWindow:
+    """The turns of one conversation a session renders, at most `max_turns` of them
+
+    Args:
+        store (ChatHistoryStore): Where turns are persisted
+        session_id (str): The conversation's session
+        video_id (str): The video the conversation is about, "" when none is selected
+        page_size (int, optional): Turns shown at first and added by each `load_older`. Defaults to 20.
+        max_turns (int, optional): Turns held in memory. Defaults to 100.
+    """
+
+    def __init__(
+        self, store: ChatHistoryStore, session_id: str, video_id: str, page_size: int = 20, max_turns: int = 100
+    ):
+        self.store = store
+        self.session_id = session_id
+        self.video_id = video_id
+        self.page_size = page_size
+        self.turns: Deque[StoredTurn] = deque(store.page(session_id, video_id, page_size), maxlen=max_turns)
+        self._has_older = bool(self.turns) and store.has_older(session_id, video_id, self.turns[0].id)
+        # the turn the window continues backwards from once `reset` emptied it
+        self._reset_before: Optional[int] = None
+
+    @property
+    def has_older(self) -> bool:
+        """Whether turns older than the window exist, checked when the window last grew backwards"""
+        return self._has_older
+
+    def add(self, question: str, answer: str) -> StoredTurn:
+        """Persist a turn and show it, dropping the oldest shown turn when the window is full"""
+        turn = self.store.add_turn(self.session_id, self.video_id, question, answer)
+        if len(self.turns) == self.turns.maxlen:
+            self._has_older = True
+        self.turns.append(turn)
+        return turn
+
+    @property
+    def can_load_older(self) -> bool:
+        return self._has_older and len(self.turns) < self.turns.maxlen
+
+    def load_older(self) -> int:
+        """Prepend the page of turns before the window, returning how many were added
+
+        The window stops growing backwards at `max_turns`, so the turns shown are always
+        the latest ones without gaps.
+        """
+        room = self.turns.maxlen - len(self.turns)
+        before_id = self.turns[0].id if self.turns else self._reset_before
+        if before_id is None or room <= 0:
+            return 0
+        older = self.store.page(self.session_id, self.video_id, min(self.page_size, room), before_id=before_id)
+        self.turns.extendleft(reversed(older))
+        self._has_older = bool(older) and self.store.has_older(self.session_id, self.video_id, older[0].id)
+        return len(older)
+
+    def reset(self):
+        """Start an empty view of the conversation, the turns shown so far stay stored and load as older ones"""
+        if self.turns:
+            self._reset_before = self.turns[-1].id + 1
+            self._has_older = True
+        self.turns.clear()
+
+    def clear(self):
+        """Delete the conversation"""
+        self.store.clear(self.session_id, self.video_id)
+        self.turns.clear()
+        self._has_older = False
@@ -0,0 +1,106 @@
+"""Streaming transcript chunker with bounded memory
+
+`stream_chunks` turns an iterator of caption documents into overlapping chunks while
+holding only the words of the chunk being built, so the chunks of a long livestream
+can be embedded while the rest of its transcript is still being read and split.
+"""
+import json
+import re
+from collections import deque
+from typing import Deque, Iterable, Iterator, NamedTuple, Optional
+
+from langchain.docstore.document import Document
+
+_WORD_RE = re.compile(r"\S+")
+
+
+class _Word(NamedTuple):
+    text: str
+    start: Optional[float]
+    end: Optional[float]
+    metadata: dict
+
+
+def _make_chunk(window: Deque[_Word], chunk_index: int) -> Document:
+    metadata = {key: value for key, value in window[0].metadata.items() if key not in ("start", "end")}
+    starts = [word.start for word in window if word.start is not None]
+    ends = [word.end for word in window if word.end is not None]
+    if starts:
+        metadata["start"] = min(starts)
+    if ends:
+        metadata["end"] = max(ends)
+    metadata["chunk_index"] = chunk_index
+    return Document(page_content=" ".join(word.text for word in window), metadata=metadata)
+
+
+def stream_chunks(
+    documents: Iterable[Document], chunk_size: int = 500, chunk_overlap: int = 100
+) -> Iterator[Document]:
+    """Split documents into overlapping chunks as they are read
+
+    Chunks are at most `chunk_size` characters of whole words (a single longer word
+    becomes a chunk of its own) and repeat up to `chunk_overlap` characters of the end
+    of the previous chunk. Each chunk keeps the metadata of the document its first word
+    came from, a running `chunk_index`, and the earliest `start` and latest `end` of
+    the documents its words came from when those carry timestamps.
+
+    Args:
+        documents (Iterable[Document]): Transcript captions or whole transcripts, consumed lazily
+        chunk_size (int, optional): The size of each chunk in characters. Defaults to 500.
+        chunk_overlap (int, optional): The overlap between neighbouring chunks. Defaults to 100.
+
+    Yields:
+        Document: The chunks in transcript order
+    """
+    window: Deque[_Word] = deque()
+    length = 0
+    fresh = 0
+    chunk_index = 0
+    for document in documents:
+        start = document.metadata.get("start")
+        end = document.metadata.get("end")
+        for match in _WORD_RE.finditer(document.page_content):
+            word = _Word(match.group(), start, end, document.metadata)
+            if window and length + 1 + len(word.text) > chunk_size:
+                if fresh:
+                    yield _make_chunk(window, chunk_index)
+                    chunk_index += 1
+                    fresh = 0
+                # keep the tail of the emitted chunk as the head of the next one
+                while window and (length > chunk_overlap or length + 1 + len(word.text) > chunk_size):
+                    length -= len(window.popleft().text) + (1 if window else 0)
+            length += len(word.text) + (1 if window else 0)
+            window.append(word)
+            fresh += 1
+    if fresh:
+        yield _make_chunk(window, chunk_index)
+
+
+class DocumentSpool:
+    """JSON-lines copy of documents streaming past, readable again once they are written
+
+    Lets ingest hand chunks to the embedder one by one and still log the full dataset
+    afterwards without keeping it in memory.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.count = 0
+
+    def write_through(self, documents: Iterable[Document]) -> Iterator[Document]:
+        """Yield `documents` unchanged while appending each one to the spool file"""
+        self.count = 0
+        with open(self.path, "w") as f:
+            for document in documents:
+                f.write(json.dumps({"page_content": document.page_content, "metadata": document.metadata}) + "\n")
+                self.count += 1
+                yield document
+
+    def __iter__(self) -> Iterator[Document]:
+        with open(self.path, "r") as f:
+            for line in f:
+                row = json.loads(line)
+                yield Document(page_content=row["page_content"], metadata=row["metadata"])
+
+    def __len__(self) -> int:
+        return self.count
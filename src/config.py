@@ -15,5 +15,47 @@ default_config = SimpleNamespace(
     max_fallback_retries=1,
     model_name="gpt-3.5-turbo",
     eval_model="gpt-3.5-turbo",
-    eval_artifact="caraxes/llmapps/generated_examples:v0"
+    eval_artifact="caraxes/llmapps/generated_examples:v0",
+    eval_concurrency=8,
+    eval_cache_path="./eval_cache.sqlite",
+    chunk_size=500,
+    chunk_overlap=100,
+    index_cache_dir="./index_cache",
+    index_cache_max_bytes=2 * 1024**3,
+    index_cache_max_open=8,
+    embedding_cache_path="./embedding_cache.sqlite",
+    embedding_cache_max_bytes=512 * 1024**2,
+    artifact_refresh_interval=300,
+    segment_cache_dir="./segment_cache",
+    retrieval_fetch_k=12,
+    context_token_budget=1500,
+    answer_cache_threshold=0.95,
+    answer_cache_ttl=3600,
+    answer_cache_max_entries=2048,
+    vector_store_backend="chroma",
+    vector_store_quantization="float32",
+    # 0 disables the float32 sidecar of quantized numpy segments and its exact re-rank
+    vector_store_rerank_factor=0,
+    dataset_format="parquet",
+    dataset_batch_rows=1024,
+    retrieval_mode="vector",
+    bm25_confidence=0.6,
+    tracing_enabled=True,
+    trace_sample_rate=0.1,
+    transcript_cache_dir="./transcript_cache",
+    transcript_hedge_delay=2.0,
+    ingest_max_concurrency=2,
+    ingest_job_history=100,
+    server_client_concurrency=4,
+    llm_max_in_flight=16,
+    memory_turns=3,
+    memory_token_budget=600,
+    memory_summary_tokens=250,
+    chat_history_path="./chat_history.sqlite",
+    chat_history_page_size=20,
+    chat_history_max_turns=100,
+    corpus_dir="./corpus_index",
+    corpus_shards=4,
+    corpus_sharding="video",
+    corpus_nprobe=16,
 )
\ No newline at end of file
@@ -0,0 +1,164 @@
+"""Token-budgeted assembly of retrieved transcript chunks into prompt context"""
+import logging
+from dataclasses import dataclass, field
+from typing import List, Optional
+
+from langchain.docstore.document import Document
+
+from embedding_pipeline import get_encoding
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass
+class Span:
+    """A contiguous piece of transcript rebuilt from one or more overlapping chunks"""
+
+    text: str
+    rank: int
+    metadata: dict = field(default_factory=dict)
+    chunk_indices: List[int] = field(default_factory=list)
+
+
+@dataclass
+class PackedContext:
+    text: str
+    spans: List[Span]
+    tokens: int
+    naive_tokens: int
+
+    @property
+    def tokens_saved(self) -> int:
+        return self.naive_tokens - self.tokens
+
+
+def count_tokens(text: str, model_name: str) -> int:
+    """Number of tokens `text` takes up for `model_name`"""
+    return len(get_encoding(model_name).encode(text, disallowed_special=()))
+
+
+def overlap_length(left: str, right: str, min_overlap: int = 20, max_overlap: int = 400) -> int:
+    """Length of the longest suffix of `left` that is also a prefix of `right`, 0 if below `min_overlap`"""
+    for length in range(min(len(left), len(right), max_overlap), min_overlap - 1, -1):
+        if left[-length:] == right[:length]:
+            return length
+    return 0
+
+
+def _source(document: Document) -> Optional[str]:
+    return document.metadata.get("video_id") or document.metadata.get("source")
+
+
+def _adjacent(span: Span, document: Document, after: bool) -> bool:
+    chunk_index = document.metadata.get("chunk_index")
+    if chunk_index is None or not span.chunk_indices:
+        return True
+    edge = span.chunk_indices[-1] if after else span.chunk_indices[0]
+    if edge is None:
+        # a legacy chunk without a position, e.g. from an older segment of the same video
+        return False
+    return chunk_index == (edge + 1 if after else edge - 1)
+
+
+def merge_chunks(documents: List[Document], min_overlap: int = 20) -> List[Span]:
+    """Stitch retrieved chunks whose texts overlap back into contiguous spans
+
+    Documents are expected in relevance order; each span keeps the rank of its best
+    chunk. Chunks carrying `chunk_index` metadata are only joined to their neighbours.
+
+    Args:
+        documents (List[Document]): Retrieved chunks, most relevant first
+        min_overlap (int, optional): Shortest shared text to count as overlap. Defaults to 20.
+
+    Returns:
+        List[Span]: The merged spans
+    """
+    spans: List[Span] = []
+    for rank, document in enumerate(documents):
+        text = document.page_content
+        if any(text in span.text for span in spans):
+            continue
+        chunk_index = document.metadata.get("chunk_index")
+        for span in spans:
+            if span.metadata.get("source") != _source(document):
+                continue
+            if _adjacent(span, document, after=True):
+                length = overlap_length(span.text, text, min_overlap)
+                if length:
+                    span.text += text[length:]
+                    span.chunk_indices.append(chunk_index)
+                    break
+            if _adjacent(span, document, after=False):
+                length = overlap_length(text, span.text, min_overlap)
+                if length:
+                    span.text = text + span.text[length:]
+                    span.chunk_indices.insert(0, chunk_index)
+                    break
+        else:
+            spans.append(
+                Span(
+                    text=text,
+                    rank=rank,
+                    metadata={"source": _source(document)},
+                    chunk_indices=[chunk_index],
+                )
+            )
+    return spans
+
+
+def pack_context(
+    documents: List[Document],
+    model_name: str,
+    token_budget: int,
+    separator: str = "\n\n",
+) -> PackedContext:
+    """Fill a token budget with the most relevant de-duplicated transcript spans
+
+    Spans are added greedily in order of relevance, skipping those that would not fit,
+    and emitted in transcript order when chunk positions are known.
+
+    Args:
+        documents (List[Document]): Retrieved chunks, most relevant first
+        model_name (str): The chat model whose tokenizer counts the budget
+        token_budget (int): Maximum number of context tokens
+        separator (str, optional): Text placed between spans. Defaults to a blank line.
+
+    Returns:
+        PackedContext: The context text with its token count and the tokens saved
+    """
+    encoding = get_encoding(model_name)
+    separator_tokens = len(encoding.encode(separator))
+
+    selected: List[Span] = []
+    used = 0
+    for span in sorted(merge_chunks(documents), key=lambda span: span.rank):
+        n_tokens = len(encoding.encode(span.text, disallowed_special=()))
+        cost = n_tokens + (separator_tokens if selected else 0)
+        if used + cost > token_budget:
+            continue
+        selected.append(span)
+        used += cost
+
+    selected.sort(
+        key=lambda span: (
+            str(span.metadata.get("source")),
+            span.chunk_indices[0] if span.chunk_indices[0] is not None else span.rank,
+        )
+    )
+    text = separator.join(span.text for span in selected)
+
+    # what the same chunks would have cost joined verbatim, overlaps included
+    included = [
+        document
+        for document in documents
+        if any(document.page_content in span.text for span in selected)
+    ]
+    naive_tokens = len(
+        encoding.encode(" ".join(document.page_content for document in included), disallowed_special=())
+    )
+    packed = PackedContext(text=text, spans=selected, tokens=used, naive_tokens=naive_tokens)
+    logger.info(
+        f"Packed {len(included)} chunks into {len(selected)} spans, "
+        f"{packed.tokens} tokens, {packed.tokens_saved} saved"
+    )
+    return packed
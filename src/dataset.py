@@ -0,0 +1,210 @@
+"""Columnar transcript dataset logged alongside each ingest run
+
+Chunks are written in streaming batches to a zstd-compressed Parquet file with one
+column per field: text, video id, chunk index, start and end timestamps, token count
+and the remaining metadata as JSON. A dataset is read back through a memory map one
+row group at a time, and only the columns that are asked for are decoded, so an index
+can be rebuilt or re-embedded from a logged dataset without fetching the transcripts
+again. JSON-lines, the format of earlier dataset versions, is still available as an
+export and can be read as well.
+"""
+import json
+import logging
+import os
+from typing import Iterable, Iterator, List, Optional, Sequence
+
+import pyarrow as pa
+import pyarrow.compute as pc
+import pyarrow.parquet as pq
+from langchain.docstore.document import Document
+
+from embedding_pipeline import DEFAULT_EMBEDDING_MODEL, get_encoding
+from transcripts import canonical_video_id
+
+logger = logging.getLogger(__name__)
+
+DATASET_ARTIFACT = "transcript_dataset"
+PARQUET_FILE = "documents.parquet"
+# earlier dataset versions are one pydantic `Document.json()` per line
+JSONL_FILE = "documents.json"
+DATASET_FORMATS = ("parquet", "jsonl")
+
+SCHEMA = pa.schema(
+    [
+        ("text", pa.string()),
+        ("video_id", pa.string()),
+        ("chunk_index", pa.int32()),
+        ("start", pa.float64()),
+        ("end", pa.float64()),
+        ("n_tokens", pa.int32()),
+        ("metadata", pa.string()),
+    ]
+)
+# metadata keys stored in columns of their own rather than in the JSON column
+_COLUMN_KEYS = ("source", "chunk_index", "start", "end")
+
+
+def _empty_columns() -> dict:
+    return {name: [] for name in SCHEMA.names}
+
+
+def _append_row(columns: dict, document: Document, n_tokens: int):
+    metadata = document.metadata
+    source = metadata.get("source")
+    columns["text"].append(document.page_content)
+    columns["video_id"].append(canonical_video_id(source) if source else None)
+    columns["chunk_index"].append(metadata.get("chunk_index"))
+    columns["start"].append(metadata.get("start"))
+    columns["end"].append(metadata.get("end"))
+    columns["n_tokens"].append(n_tokens)
+    extra = {key: value for key, value in metadata.items() if key not in _COLUMN_KEYS}
+    # keep a source that is not a plain video id, e.g. a full url, so it round-trips
+    if source and source != columns["video_id"][-1]:
+        extra["source"] = source
+    columns["metadata"].append(json.dumps(extra) if extra else None)
+
+
+def write_parquet(
+    documents: Iterable[Document],
+    sink,
+    batch_rows: int = 1024,
+    compression_level: int = 3,
+    model_name: str = DEFAULT_EMBEDDING_MODEL,
+) -> int:
+    """Write documents to a zstd-compressed Parquet file, `batch_rows` at a time
+
+    Every batch becomes one row group, so at most `batch_rows` documents are held in
+    memory and readers can load the file one row group at a time.
+
+    Args:
+        documents (Iterable[Document]): The chunks to write, consumed lazily
+        sink: A path or a writable binary file object
+        batch_rows (int, optional): Rows per row group. Defaults to 1024.
+        compression_level (int, optional): The zstd level. Defaults to 3.
+        model_name (str, optional): The model whose tokenizer fills `n_tokens`. Defaults to the embedding model.
+
+    Returns:
+        int: The number of rows written
+    """
+    encoding = get_encoding(model_name)
+    rows = 0
+    columns = _empty_columns()
+    with pq.ParquetWriter(sink, SCHEMA, compression="zstd", compression_level=compression_level) as writer:
+        for document in documents:
+            _append_row(columns, document, len(encoding.encode(document.page_content, disallowed_special=())))
+            if len(columns["text"]) >= batch_rows:
+                writer.write_table(pa.Table.from_pydict(columns, schema=SCHEMA))
+                rows += len(columns["text"])
+                columns = _empty_columns()
+        if columns["text"] or not rows:
+            writer.write_table(pa.Table.from_pydict(columns, schema=SCHEMA))
+            rows += len(columns["text"])
+    return rows
+
+
+def write_jsonl(documents: Iterable[Document], f) -> int:
+    """Write documents as JSON lines of `page_content` and `metadata` to a text file object"""
+    rows = 0
+    for rows, document in enumerate(documents, 1):
+        f.write(json.dumps({"page_content": document.page_content, "metadata": document.metadata}) + "\n")
+    return rows
+
+
+def _to_document(row: dict) -> Document:
+    metadata = json.loads(row["metadata"]) if row.get("metadata") else {}
+    if row.get("video_id") is not None:
+        metadata.setdefault("source", row["video_id"])
+    for key in ("start", "end", "chunk_index"):
+        if row.get(key) is not None:
+            metadata[key] = row[key]
+    return Document(page_content=row["text"], metadata=metadata)
+
+
+class TranscriptDataset:
+    """A logged transcript dataset, read lazily from a Parquet or JSON-lines file
+
+    Parquet files are memory-mapped and read one row group at a time; JSON-lines files
+    are parsed line by line.
+
+    Args:
+        path (str): A dataset file, or an artifact directory containing one
+    """
+
+    def __init__(self, path: str):
+        if os.path.isdir(path):
+            for file_name in (PARQUET_FILE, JSONL_FILE):
+                if os.path.exists(os.path.join(path, file_name)):
+                    path = os.path.join(path, file_name)
+                    break
+            else:
+                raise FileNotFoundError(f"No {PARQUET_FILE} or {JSONL_FILE} in {path}")
+        self.path = path
+        self.format = "parquet" if path.endswith(".parquet") else "jsonl"
+        self._parquet = pq.ParquetFile(pa.memory_map(path, "r")) if self.format == "parquet" else None
+
+    def __len__(self) -> int:
+        if self._parquet is not None:
+            return self._parquet.metadata.num_rows
+        with open(self.path, "r") as f:
+            return sum(1 for _ in f)
+
+    def batches(
+        self, columns: Optional[Sequence[str]] = None, video_ids: Optional[Iterable[str]] = None
+    ) -> Iterator[pa.RecordBatch]:
+        """Record batches of the Parquet file, decoding only `columns`
+
+        Args:
+            columns (Sequence[str], optional): The columns to read. Defaults to all of `SCHEMA`.
+            video_ids (Iterable[str], optional): Only yield rows of these videos.
+        """
+        if self._parquet is None:
+            raise ValueError(f"{self.path} is not a Parquet dataset")
+        wanted = pa.array(sorted(set(video_ids)), pa.string()) if video_ids is not None else None
+        read_columns = list(columns or SCHEMA.names)
+        if wanted is not None and "video_id" not in read_columns:
+            read_columns.append("video_id")
+        for i in range(self._parquet.num_row_groups):
+            table = self._parquet.read_row_group(i, columns=read_columns)
+            if wanted is not None:
+                table = table.filter(pc.is_in(table["video_id"], value_set=wanted))
+            if columns is not None:
+                table = table.select(list(columns))
+            yield from table.to_batches()
+
+    def documents(self, video_ids: Optional[Iterable[str]] = None) -> Iterator[Document]:
+        """The chunks as documents, optionally only those of `video_ids`"""
+        if self._parquet is not None:
+            for batch in self.batches(video_ids=video_ids):
+                for row in batch.to_pylist():
+                    yield _to_document(row)
+            return
+        wanted = set(video_ids) if video_ids is not None else None
+        with open(self.path, "r") as f:
+            for line in f:
+                row = json.loads(line)
+                document = Document(page_content=row["page_content"], metadata=row["metadata"])
+                source = document.metadata.get("source")
+                if wanted is None or (source and canonical_video_id(source) in wanted):
+                    yield document
+
+    def __iter__(self) -> Iterator[Document]:
+        return self.documents()
+
+    def video_ids(self) -> List[str]:
+        """The distinct videos in the dataset, in order of appearance"""
+        if self._parquet is None:
+            return list(dict.fromkeys(d.metadata.get("source") for d in self.documents() if d.metadata.get("source")))
+        seen = {}
+        for batch in self.batches(columns=["video_id"]):
+            seen.update(dict.fromkeys(value for value in batch.column(0).to_pylist() if value))
+        return list(seen)
+
+    def export_jsonl(self, path: str) -> int:
+        """Write the dataset as JSON lines, returning the number of rows"""
+        with open(path, "w") as f:
+            return write_jsonl(self.documents(), f)
+
+
+def load_dataset_artifact(run: "wandb.run", name: str = f"{DATASET_ARTIFACT}:latest") -> TranscriptDataset:
+    """Download a logged dataset artifact and open it"""
+    return TranscriptDataset(run.use_artifact(name, type="dataset").download())
@@ -0,0 +1,172 @@
+"""Content-hash cache for embeddings backed by a local SQLite store"""
+import hashlib
+import logging
+import sqlite3
+import threading
+import time
+from array import array
+from typing import Dict, List, Optional
+
+from langchain.embeddings import OpenAIEmbeddings
+from langchain.embeddings.base import Embeddings
+
+from config import default_config
+from tracing import increment
+
+logger = logging.getLogger(__name__)
+
+
+def normalize_text(text: str) -> str:
+    """Collapse whitespace so trivially different copies of a chunk share a cache entry"""
+    return " ".join(text.split())
+
+
+def _pack(vector: List[float]) -> bytes:
+    return array("f", vector).tobytes()
+
+
+def _unpack(blob: bytes) -> List[float]:
+    vector = array("f")
+    vector.frombytes(blob)
+    return vector.tolist()
+
+
+class CachedEmbeddings(Embeddings):
+    """Drop-in embeddings wrapper that only calls the wrapped model for unseen texts
+
+    Vectors are stored as float32 blobs keyed by sha256 of (model, normalized text).
+    Once the store grows beyond `max_bytes` the least recently used rows are deleted.
+    """
+
+    def __init__(
+        self,
+        embeddings: Embeddings,
+        path: str = default_config.embedding_cache_path,
+        max_bytes: int = default_config.embedding_cache_max_bytes,
+    ):
+        self.embeddings = embeddings
+        self.model = getattr(embeddings, "model", None) or type(embeddings).__name__
+        self.path = path
+        self.max_bytes = max_bytes
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS embeddings ("
+            "key TEXT PRIMARY KEY, vector BLOB NOT NULL, last_used REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS embeddings_last_used ON embeddings (last_used)")
+        self._conn.commit()
+
+    def _key(self, text: str) -> str:
+        return hashlib.sha256(f"{self.model}\0{normalize_text(text)}".encode("utf-8")).hexdigest()
+
+    def _lookup(self, keys: List[str]) -> Dict[str, List[float]]:
+        found = {}
+        with self._lock:
+            # stay below SQLite's default bound parameter limit
+            for start in range(0, len(keys), 500):
+                batch = keys[start : start + 500]
+                rows = self._conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({','.join('?' * len(batch))})",
+                    batch,
+                ).fetchall()
+                found.update((key, _unpack(blob)) for key, blob in rows)
+            if found:
+                now = time.time()
+                self._conn.executemany(
+                    "UPDATE embeddings SET last_used = ? WHERE key = ?", [(now, key) for key in found]
+                )
+                self._conn.commit()
+        return found
+
+    def _store(self, items: Dict[str, List[float]]):
+        now = time.time()
+        with self._lock:
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO embeddings (key, vector, last_used) VALUES (?, ?, ?)",
+                [(key, _pack(vector), now) for key, vector in items.items()],
+            )
+            self._conn.commit()
+            self._evict()
+
+    def _evict(self):
+        (size,) = self._conn.execute(
+            "SELECT COALESCE(SUM(LENGTH(vector)), 0) FROM embeddings"
+        ).fetchone()
+        if size <= self.max_bytes:
+            return
+        # drop the oldest rows until we are back under budget with ~10% headroom
+        excess = size - int(self.max_bytes * 0.9)
+        rows = self._conn.execute(
+            "SELECT key, LENGTH(vector) FROM embeddings ORDER BY last_used ASC"
+        )
+        stale = []
+        for key, length in rows:
+            if excess <= 0:
+                break
+            stale.append((key,))
+            excess -= length
+        self._conn.executemany("DELETE FROM embeddings WHERE key = ?", stale)
+        self._conn.commit()
+        logger.info(f"Evicted {len(stale)} cached embeddings from {self.path}")
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        keys = [self._key(text) for text in texts]
+        cached = self._lookup(list(set(keys)))
+
+        missing: Dict[str, str] = {}
+        for key, text in zip(keys, texts):
+            if key not in cached and key not in missing:
+                missing[key] = text
+        self.hits += len(texts) - len(missing)
+        self.misses += len(missing)
+        increment("embedding_cache_hits", len(texts) - len(missing))
+        increment("embedding_cache_misses", len(missing))
+
+        if missing:
+            vectors = self.embeddings.embed_documents(list(missing.values()))
+            fresh = dict(zip(missing.keys(), vectors))
+            self._store(fresh)
+            cached.update(fresh)
+        return [cached[key] for key in keys]
+
+    def embed_query(self, text: str) -> List[float]:
+        key = self._key(text)
+        cached = self._lookup([key])
+        if key in cached:
+            self.hits += 1
+            increment("embedding_cache_hits")
+            return cached[key]
+        self.misses += 1
+        increment("embedding_cache_misses")
+        vector = self.embeddings.embed_query(text)
+        self._store({key: vector})
+        return vector
+
+    def stats(self) -> dict:
+        """Hit/miss counters and current size of the store"""
+        with self._lock:
+            entries, size = self._conn.execute(
+                "SELECT COUNT(*), COALESCE(SUM(LENGTH(vector)), 0) FROM embeddings"
+            ).fetchone()
+        return {"hits": self.hits, "misses": self.misses, "entries": entries, "bytes": size}
+
+
+def cached_openai_embeddings(
+    openai_api_key: Optional[str] = None, max_retries: Optional[int] = None
+) -> CachedEmbeddings:
+    """OpenAIEmbeddings wrapped in the shared on-disk embedding cache
+
+    Args:
+        openai_api_key (str, optional): Defaults to the OPENAI_API_KEY environment variable.
+        max_retries (int, optional): Retries of the OpenAI client itself. Defaults to the client's own default.
+    """
+    kwargs = {}
+    if openai_api_key:
+        kwargs["openai_api_key"] = openai_api_key
+    if max_retries is not None:
+        kwargs["max_retries"] = max_retries
+    return CachedEmbeddings(OpenAIEmbeddings(**kwargs))
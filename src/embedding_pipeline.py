@@ -0,0 +1,221 @@
+"""Concurrent, token-aware batched embedding of document chunks"""
+import contextvars
+import logging
+import random
+import threading
+import time
+import uuid
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from dataclasses import dataclass
+from typing import Callable, Dict, Iterable, Iterator, List, Tuple
+
+import tiktoken
+from langchain.docstore.document import Document
+from langchain.embeddings.base import Embeddings
+from langchain.vectorstores import Chroma
+
+from tracing import record
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_EMBEDDING_MODEL = "text-embedding-ada-002"
+
+RETRYABLE_ERRORS = {
+    "RateLimitError",
+    "APIError",
+    "APIConnectionError",
+    "ServiceUnavailableError",
+    "Timeout",
+}
+
+Sink = Callable[[List[Document], List[List[float]]], None]
+
+
+@dataclass
+class EmbeddingStats:
+    chunks: int = 0
+    tokens: int = 0
+    batches: int = 0
+    retries: int = 0
+    seconds: float = 0.0
+
+    @property
+    def chunks_per_sec(self) -> float:
+        return self.chunks / self.seconds if self.seconds else 0.0
+
+    @property
+    def tokens_per_sec(self) -> float:
+        return self.tokens / self.seconds if self.seconds else 0.0
+
+    def __str__(self) -> str:
+        return (
+            f"embedded {self.chunks} chunks ({self.tokens} tokens) in {self.batches} batches, "
+            f"{self.retries} retries, {self.seconds:.2f}s: "
+            f"{self.chunks_per_sec:.1f} chunks/s, {self.tokens_per_sec:.1f} tokens/s"
+        )
+
+
+def get_encoding(model_name: str) -> "tiktoken.Encoding":
+    """The tiktoken encoding for a model, falling back to cl100k_base for unknown names"""
+    try:
+        return tiktoken.encoding_for_model(model_name)
+    except KeyError:
+        return tiktoken.get_encoding("cl100k_base")
+
+
+def token_batches(
+    documents: Iterable[Document],
+    encoding: "tiktoken.Encoding",
+    max_batch_tokens: int,
+    max_batch_size: int,
+) -> Iterator[Tuple[List[Document], int]]:
+    """Group documents into batches bounded by total token count and number of texts
+
+    Args:
+        documents (Iterable[Document]): The chunks to batch, consumed lazily
+        encoding (tiktoken.Encoding): Encoding used to count tokens
+        max_batch_tokens (int): Upper bound on the summed token count of a batch
+        max_batch_size (int): Upper bound on the number of texts in a batch
+
+    Yields:
+        Tuple[List[Document], int]: A batch of documents and its token count
+    """
+    batch: List[Document] = []
+    batch_tokens = 0
+    for document in documents:
+        n_tokens = len(encoding.encode(document.page_content, disallowed_special=()))
+        if batch and (batch_tokens + n_tokens > max_batch_tokens or len(batch) >= max_batch_size):
+            yield batch, batch_tokens
+            batch, batch_tokens = [], 0
+        batch.append(document)
+        batch_tokens += n_tokens
+    if batch:
+        yield batch, batch_tokens
+
+
+def is_retryable(exc: Exception) -> bool:
+    """Whether an embedding error is a rate limit or transient server error worth retrying"""
+    if type(exc).__name__ in RETRYABLE_ERRORS:
+        return True
+    return getattr(exc, "http_status", None) in (429, 500, 502, 503, 504)
+
+
+def chunk_id(document: Document) -> str:
+    """The stable id `<video id>:<chunk index>` of a chunk, a random one for chunks without both"""
+    metadata = document.metadata or {}
+    video_id = metadata.get("video_id") or metadata.get("source")
+    if video_id is None or metadata.get("chunk_index") is None:
+        return str(uuid.uuid4())
+    return f"{video_id}:{metadata['chunk_index']}"
+
+
+def chroma_sink(vector_store: Chroma) -> Sink:
+    """A sink upserting embedded batches into the collection behind a Chroma store
+
+    Chunks are keyed by `chunk_id`, so writing a video's chunks again replaces them.
+    """
+
+    def write(documents: List[Document], embeddings: List[List[float]]):
+        vector_store._collection.upsert(
+            ids=[chunk_id(document) for document in documents],
+            embeddings=embeddings,
+            documents=[document.page_content for document in documents],
+            metadatas=[document.metadata or None for document in documents],
+        )
+
+    return write
+
+
+class EmbeddingPipeline:
+    """Embed chunks in token-sized batches on a bounded thread pool
+
+    At most `max_in_flight` batches are submitted at once, so a slow or rate limited
+    endpoint holds back reading further input instead of queueing it all in memory.
+    Finished batches are handed to the sink on the calling thread as they complete.
+    Batches are measured with the tokenizer of `model_name`, or with `encoding` when
+    one is passed, e.g. one that is already loaded.
+    """
+
+    def __init__(
+        self,
+        embeddings: Embeddings,
+        model_name: str = None,
+        max_batch_tokens: int = 8000,
+        max_batch_size: int = 256,
+        max_workers: int = 4,
+        max_in_flight: int = None,
+        max_retries: int = 6,
+        base_delay: float = 1.0,
+        max_delay: float = 60.0,
+        encoding: "tiktoken.Encoding" = None,
+    ):
+        self.embeddings = embeddings
+        self.encoding = encoding or get_encoding(
+            model_name or getattr(embeddings, "model", None) or DEFAULT_EMBEDDING_MODEL
+        )
+        self.max_batch_tokens = max_batch_tokens
+        self.max_batch_size = max_batch_size
+        self.max_workers = max_workers
+        self.max_in_flight = max_in_flight or 2 * max_workers
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._lock = threading.Lock()
+
+    def _embed_with_retry(self, texts: List[str], stats: EmbeddingStats) -> List[List[float]]:
+        attempt = 0
+        while True:
+            try:
+                return self.embeddings.embed_documents(texts)
+            except Exception as e:
+                if attempt >= self.max_retries or not is_retryable(e):
+                    raise
+                # full jitter keeps concurrent workers from retrying in lockstep
+                delay = random.uniform(0, min(self.max_delay, self.base_delay * 2**attempt))
+                logger.warning(f"Embedding batch failed with {e!r}, retrying in {delay:.1f}s")
+                with self._lock:
+                    stats.retries += 1
+                attempt += 1
+                time.sleep(delay)
+
+    def run(self, documents: Iterable[Document], sink: Sink) -> EmbeddingStats:
+        """Embed all documents and pass each finished batch to `sink`
+
+        Args:
+            documents (Iterable[Document]): The chunks to embed, consumed lazily
+            sink (Sink): Called with each batch of documents and their embeddings
+
+        Returns:
+            EmbeddingStats: Counts and throughput of the run
+        """
+        stats = EmbeddingStats()
+        start = time.perf_counter()
+        in_flight: Dict[Future, Tuple[List[Document], int]] = {}
+
+        def drain():
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in done:
+                batch, n_tokens = in_flight.pop(future)
+                sink(batch, future.result())
+                stats.chunks += len(batch)
+                stats.tokens += n_tokens
+                stats.batches += 1
+
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            for batch, n_tokens in token_batches(
+                documents, self.encoding, self.max_batch_tokens, self.max_batch_size
+            ):
+                while len(in_flight) >= self.max_in_flight:
+                    drain()
+                texts = [document.page_content for document in batch]
+                # run in a copy of the caller's context so cache hits count towards its trace
+                future = executor.submit(contextvars.copy_context().run, self._embed_with_retry, texts, stats)
+                in_flight[future] = (batch, n_tokens)
+            while in_flight:
+                drain()
+
+        stats.seconds = time.perf_counter() - start
+        record("embedded_chunks", stats.chunks)
+        record("embedded_tokens", stats.tokens)
+        logger.info(str(stats))
+        return stats
@@ -0,0 +1,343 @@
+"""Offline evaluation of answer quality, latency and token usage per configuration
+
+A question/answer set, by default the `eval_artifact`, is answered through the same
+retrieval and generation path as the app for every configuration (model,
+temperature, retrieval depth, context budget, index artifact), with at most
+`concurrency` questions in flight. Each answer is graded against the reference answer
+by `eval_model`, and the answers and grades are kept in a SQLite response cache, so
+re-running an unchanged configuration costs no completions. Every configuration is
+logged to the W&B run as one table of per-question rows plus summary metrics; the
+latency percentiles only cover answers generated in that run, a cached answer keeps
+the latency it was first generated with.
+
+Pointing OPENAI_API_BASE at `benchmarks/stub_openai.py` runs it fully offline, see
+`benchmarks/bench_eval.py`.
+"""
+import argparse
+import csv
+import dataclasses
+import glob
+import hashlib
+import json
+import logging
+import os
+import re
+import sqlite3
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Iterable, List, NamedTuple, Optional
+
+import numpy as np
+import wandb
+from langchain.callbacks import get_openai_callback
+from langchain.prompts import PromptTemplate
+
+from dotenv import find_dotenv, load_dotenv
+from config import default_config
+
+logger = logging.getLogger(__name__)
+
+EVAL_PROMPT = PromptTemplate.from_template(
+    "Rate from 1 to 5 how well the answer to a question about a youtube video agrees with the reference "
+    "answer, where 5 means it is fully correct and 1 means it is wrong or unrelated. Reply with the number "
+    "only.\n\nQuestion: {question}\nReference answer: {reference}\nAnswer: {answer}\n\nRating:"
+)
+_SCORE_RE = re.compile(r"\b([1-5])\b")
+
+
+class Example(NamedTuple):
+    question: str
+    reference: str
+
+
+@dataclasses.dataclass
+class EvalConfig:
+    """The settings an answer depends on, evaluated and logged together under `name`"""
+
+    name: str = "default"
+    model_name: str = default_config.model_name
+    chat_temperature: float = default_config.chat_temperature
+    retrieval_fetch_k: int = default_config.retrieval_fetch_k
+    context_token_budget: int = default_config.context_token_budget
+    vector_store_artifact: str = "vector_store_artifact:latest"
+
+
+@dataclasses.dataclass
+class EvalResult:
+    question: str
+    reference: str
+    answer: str
+    score: Optional[int]
+    latency_ms: float
+    prompt_tokens: int
+    completion_tokens: int
+    cached: bool
+
+
+def read_examples(path: str) -> List[Example]:
+    """Read a question/answer set from a csv, jsonl or W&B table json file, or a directory holding one
+
+    Rows need a `question` column and an `answer` (or `reference`) column.
+    """
+    if os.path.isdir(path):
+        candidates = sorted(
+            file_name
+            for pattern in ("*.csv", "*.jsonl", "*.json")
+            for file_name in glob.glob(os.path.join(path, "**", pattern), recursive=True)
+        )
+        if not candidates:
+            raise FileNotFoundError(f"No csv or json examples in {path}")
+        path = candidates[0]
+    with open(path, "r") as f:
+        if path.endswith(".csv"):
+            rows = list(csv.DictReader(f))
+        elif path.endswith(".jsonl"):
+            rows = [json.loads(line) for line in f if line.strip()]
+        else:
+            data = json.load(f)
+            # a wandb.Table is saved as its columns and a list of rows
+            rows = [dict(zip(data["columns"], row)) for row in data["data"]] if isinstance(data, dict) else data
+    return [Example(row["question"], row.get("answer", row.get("reference", ""))) for row in rows]
+
+
+def parse_score(text: str) -> Optional[int]:
+    match = _SCORE_RE.search(text)
+    return int(match.group(1)) if match else None
+
+
+class ResponseCache:
+    """Answers and grades of earlier runs keyed by everything they depend on"""
+
+    def __init__(self, path: str = default_config.eval_cache_path):
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS responses (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+        self._conn.commit()
+
+    @staticmethod
+    def key(*parts) -> str:
+        return hashlib.sha256(json.dumps(parts, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+    def get(self, key: str) -> Optional[dict]:
+        with self._lock:
+            row = self._conn.execute("SELECT value FROM responses WHERE key = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def put(self, key: str, value: dict):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO responses (key, value) VALUES (?, ?)", (key, json.dumps(value))
+            )
+            self._conn.commit()
+
+    def close(self):
+        self._conn.close()
+
+
+class Evaluator:
+    """Answer and grade a question/answer set for several configurations
+
+    Args:
+        wandb_run (wandb.run): The run the index and prompt artifacts are read from and results logged to
+        openai_api_key (str, optional): The OpenAI API key. Defaults to OPENAI_API_KEY.
+        eval_model (str, optional): The model grading the answers. Defaults to config.eval_model.
+        concurrency (int, optional): Questions answered at once. Defaults to config.eval_concurrency.
+        cache (ResponseCache, optional): Answers and grades of earlier runs. Defaults to one at config.eval_cache_path.
+    """
+
+    def __init__(
+        self,
+        wandb_run,
+        openai_api_key: Optional[str] = None,
+        eval_model: str = default_config.eval_model,
+        concurrency: int = default_config.eval_concurrency,
+        cache: Optional[ResponseCache] = None,
+    ):
+        self.run = wandb_run
+        self.openai_api_key = openai_api_key
+        self.eval_model = eval_model
+        self.concurrency = concurrency
+        self.cache = cache or ResponseCache()
+
+    def _generate(self, config: EvalConfig, example: Example) -> dict:
+        from chains import CHAT_PROMPT_ARTIFACT, artifact_cache, build_context, load_prompt, load_vector_store
+        from llm_pool import llm_pool
+
+        vector_store = load_vector_store(self.run, self.openai_api_key, artifact_name=config.vector_store_artifact)
+        prompt = load_prompt(self.run)
+        key = ResponseCache.key(
+            "answer",
+            {field: value for field, value in dataclasses.asdict(config).items() if field != "name"},
+            artifact_cache.digest(config.vector_store_artifact),
+            artifact_cache.digest(CHAT_PROMPT_ARTIFACT),
+            example.question,
+        )
+        cached = self.cache.get(key)
+        if cached is not None:
+            return dict(cached, cached=True)
+        start = time.perf_counter()
+        with get_openai_callback() as usage:
+            docs = build_context(
+                example.question,
+                vector_store,
+                model_name=config.model_name,
+                fetch_k=config.retrieval_fetch_k,
+                token_budget=config.context_token_budget,
+            )
+            chain = llm_pool.chain(
+                prompt,
+                model_name=config.model_name,
+                temperature=config.chat_temperature,
+                max_tokens=2048,
+                openai_api_key=self.openai_api_key,
+            )
+            answer = chain.run(question=example.question, docs=docs).replace("\n", "")
+        response = {
+            "answer": answer,
+            "latency_ms": (time.perf_counter() - start) * 1000,
+            "prompt_tokens": usage.prompt_tokens,
+            "completion_tokens": usage.completion_tokens,
+        }
+        self.cache.put(key, response)
+        return dict(response, cached=False)
+
+    def _grade(self, example: Example, answer: str) -> Optional[int]:
+        from llm_pool import llm_pool
+
+        # a reworded grading prompt grades differently, so it is part of the key
+        key = ResponseCache.key(
+            "grade", self.eval_model, EVAL_PROMPT.template, example.question, example.reference, answer
+        )
+        cached = self.cache.get(key)
+        if cached is not None:
+            return cached["score"]
+        chain = llm_pool.chain(
+            EVAL_PROMPT, model_name=self.eval_model, temperature=0.0, max_tokens=16, openai_api_key=self.openai_api_key
+        )
+        text = chain.run(question=example.question, reference=example.reference, answer=answer)
+        score = parse_score(text)
+        if score is None:
+            logger.warning(f"Could not parse a grade from {text!r}")
+        else:
+            # an unparsable grade is retried on the next run rather than cached
+            self.cache.put(key, {"score": score})
+        return score
+
+    def _evaluate_one(self, config: EvalConfig, example: Example) -> EvalResult:
+        response = self._generate(config, example)
+        return EvalResult(
+            question=example.question,
+            reference=example.reference,
+            score=self._grade(example, response["answer"]),
+            **response,
+        )
+
+    def evaluate(self, config: EvalConfig, examples: List[Example]) -> List[EvalResult]:
+        """Answer and grade every example with `concurrency` questions in flight"""
+        with ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix="eval") as executor:
+            return list(executor.map(lambda example: self._evaluate_one(config, example), examples))
+
+    def log(self, config: EvalConfig, results: List[EvalResult], seconds: float) -> dict:
+        """Log the results of a configuration as a table and summary metrics, returning the summary"""
+        columns = [field.name for field in dataclasses.fields(EvalResult)]
+        table = wandb.Table(columns=columns, data=[list(dataclasses.astuple(result)) for result in results])
+        scores = [result.score for result in results if result.score is not None]
+        # cached rows carry the latency of the run that generated them
+        latencies = np.array([result.latency_ms for result in results if not result.cached])
+        summary = {
+            "questions": len(results),
+            "mean_score": float(np.mean(scores)) if scores else None,
+            "graded": len(scores),
+            "latency_p50_ms": float(np.percentile(latencies, 50)) if len(latencies) else None,
+            "latency_p95_ms": float(np.percentile(latencies, 95)) if len(latencies) else None,
+            "prompt_tokens": sum(result.prompt_tokens for result in results),
+            "completion_tokens": sum(result.completion_tokens for result in results),
+            "cached": sum(result.cached for result in results),
+            "seconds": seconds,
+            "config": dataclasses.asdict(config),
+        }
+        metrics = {f"eval/{config.name}/{key}": value for key, value in summary.items() if key != "config"}
+        self.run.log({f"eval/{config.name}/results": table, **metrics})
+        return summary
+
+    def run_all(self, configs: Iterable[EvalConfig], examples: List[Example]) -> Dict[str, dict]:
+        """Evaluate and log each configuration in turn"""
+        summaries = {}
+        for config in configs:
+            start = time.perf_counter()
+            results = self.evaluate(config, examples)
+            summaries[config.name] = self.log(config, results, time.perf_counter() - start)
+            logger.info(f"{config.name}: {summaries[config.name]}")
+        return summaries
+
+
+def read_configs(path: Optional[str]) -> List[EvalConfig]:
+    """Configurations from a json list of `EvalConfig` fields, or the default one"""
+    if path is None:
+        return [EvalConfig()]
+    with open(path, "r") as f:
+        return [EvalConfig(**config) for config in json.load(f)]
+
+
+def get_parser():
+    parser = argparse.ArgumentParser()
+    parser.add_argument(
+        "--eval_artifact",
+        type=str,
+        default=default_config.eval_artifact,
+        help="The question/answer artifact to evaluate on",
+    )
+    parser.add_argument(
+        "--examples",
+        type=str,
+        default=None,
+        help="A local csv, jsonl or table json file of questions and answers, used instead of --eval_artifact",
+    )
+    parser.add_argument(
+        "--configs",
+        type=str,
+        default=None,
+        help="A json list of configurations with the fields of EvalConfig; defaults to the app's settings",
+    )
+    parser.add_argument("--eval_model", type=str, default=default_config.eval_model, help="The grading model")
+    parser.add_argument(
+        "--concurrency", type=int, default=default_config.eval_concurrency, help="Questions answered at once"
+    )
+    parser.add_argument(
+        "--cache_path",
+        type=str,
+        default=default_config.eval_cache_path,
+        help="The SQLite file caching answers and grades across runs",
+    )
+    parser.add_argument("--limit", type=int, default=None, help="Only evaluate the first N questions")
+    parser.add_argument("--wandb_project", type=str, default=default_config.project, help="The wandb project")
+    return parser
+
+
+def main():
+    args = get_parser().parse_args()
+    load_dotenv(find_dotenv())
+    run = wandb.init(project=args.wandb_project, entity=default_config.entity, job_type="eval", config=args)
+    if args.examples:
+        examples = read_examples(args.examples)
+    else:
+        examples = read_examples(run.use_artifact(args.eval_artifact).download())
+    examples = examples[: args.limit]
+    evaluator = Evaluator(
+        run,
+        openai_api_key=os.getenv("OPENAI_API_KEY"),
+        eval_model=args.eval_model,
+        concurrency=args.concurrency,
+        cache=ResponseCache(args.cache_path),
+    )
+    summaries = evaluator.run_all(read_configs(args.configs), examples)
+    print(json.dumps(summaries, indent=2))
+    run.finish()
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    main()
@@ -0,0 +1,175 @@
+"""Persistent per-video cache of built Chroma indexes with LRU eviction"""
+import hashlib
+import json
+import logging
+import os
+import shutil
+import threading
+import time
+from collections import OrderedDict
+from typing import Callable, Dict, NamedTuple, Optional
+
+from langchain.embeddings.base import Embeddings
+from langchain.vectorstores import Chroma
+
+logger = logging.getLogger(__name__)
+
+META_FILE = "index_meta.json"
+
+def embedding_model_name(embeddings: Embeddings) -> str:
+    """Name used to key cached indexes by the embedding model that built them"""
+    return getattr(embeddings, "model", None) or type(embeddings).__name__
+
+
+class IndexKey(NamedTuple):
+    video_id: str
+    chunk_size: int
+    chunk_overlap: int
+    embedding_model: str
+
+    def digest(self) -> str:
+        return hashlib.sha1("|".join(str(part) for part in self).encode("utf-8")).hexdigest()
+
+
+def _dir_size(path: str) -> int:
+    total = 0
+    for root, _, files in os.walk(path):
+        for name in files:
+            try:
+                total += os.path.getsize(os.path.join(root, name))
+            except OSError:
+                pass
+    return total
+
+
+class IndexCache:
+    """Cache of per-video vector stores persisted on disk and kept open in memory
+
+    Built collections are written to `cache_dir/<key digest>` and reopened on later
+    lookups, also from other processes and sessions. Least recently used entries are
+    closed once more than `max_open` are held in memory and deleted from disk once the
+    cache grows beyond `max_disk_bytes`.
+    """
+
+    def __init__(self, cache_dir: str, max_disk_bytes: int = 2 * 1024**3, max_open: int = 8):
+        self.cache_dir = cache_dir
+        self.max_disk_bytes = max_disk_bytes
+        self.max_open = max_open
+        self._open: "OrderedDict[str, Chroma]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._build_locks: Dict[str, threading.Lock] = {}
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _entry_dir(self, key: IndexKey) -> str:
+        return os.path.join(self.cache_dir, key.digest())
+
+    def _read_meta(self, entry_dir: str) -> Optional[dict]:
+        try:
+            with open(os.path.join(entry_dir, META_FILE), "r") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def _write_meta(self, entry_dir: str, meta: dict):
+        tmp_path = os.path.join(entry_dir, META_FILE + ".tmp")
+        with open(tmp_path, "w") as f:
+            json.dump(meta, f)
+        os.replace(tmp_path, os.path.join(entry_dir, META_FILE))
+
+    def _touch(self, entry_dir: str, meta: dict):
+        meta["last_used"] = time.time()
+        self._write_meta(entry_dir, meta)
+
+    def get_or_build(
+        self,
+        key: IndexKey,
+        embeddings: Embeddings,
+        builder: Callable[[str], Chroma],
+    ) -> Chroma:
+        """Return the cached vector store for `key`, building it with `builder` on a miss
+
+        Args:
+            key (IndexKey): The (video id, chunk size, chunk overlap, embedding model) key
+            embeddings (Embeddings): Embedding function used to reopen a persisted index
+            builder (Callable[[str], Chroma]): Builds and persists the index into the given directory
+
+        Returns:
+            Chroma: The vector store for the video
+        """
+        digest = key.digest()
+        entry_dir = self._entry_dir(key)
+
+        with self._lock:
+            vector_store = self._open.get(digest)
+            if vector_store is not None:
+                self._open.move_to_end(digest)
+                self.hits += 1
+                self._touch(entry_dir, self._read_meta(entry_dir) or key._asdict())
+                return vector_store
+            build_lock = self._build_locks.setdefault(digest, threading.Lock())
+
+        # only one thread builds a given key, the others wait and reuse the result
+        with build_lock:
+            with self._lock:
+                vector_store = self._open.get(digest)
+            if vector_store is not None:
+                return vector_store
+
+            meta = self._read_meta(entry_dir)
+            if meta is not None:
+                logger.info(f"Reusing persisted index for {key.video_id} from {entry_dir}")
+                self.hits += 1
+                vector_store = Chroma(embedding_function=embeddings, persist_directory=entry_dir)
+            else:
+                logger.info(f"Building index for {key.video_id} in {entry_dir}")
+                self.misses += 1
+                shutil.rmtree(entry_dir, ignore_errors=True)
+                os.makedirs(entry_dir)
+                vector_store = builder(entry_dir)
+                vector_store.persist()
+                meta = dict(key._asdict(), created=time.time())
+            meta["size_bytes"] = _dir_size(entry_dir)
+            self._touch(entry_dir, meta)
+
+        with self._lock:
+            self._open[digest] = vector_store
+            self._open.move_to_end(digest)
+            while len(self._open) > self.max_open:
+                evicted, _ = self._open.popitem(last=False)
+                logger.debug(f"Closed in-memory index {evicted}")
+        self._enforce_disk_budget(keep=digest)
+        return vector_store
+
+    def _enforce_disk_budget(self, keep: str):
+        entries = []
+        for digest in os.listdir(self.cache_dir):
+            entry_dir = os.path.join(self.cache_dir, digest)
+            meta = self._read_meta(entry_dir)
+            if meta is None:
+                continue
+            entries.append((meta.get("last_used", 0), digest, meta.get("size_bytes", 0)))
+
+        total = sum(size for _, _, size in entries)
+        for _, digest, size in sorted(entries):
+            if total <= self.max_disk_bytes:
+                break
+            if digest == keep:
+                continue
+            with self._lock:
+                self._open.pop(digest, None)
+            shutil.rmtree(os.path.join(self.cache_dir, digest), ignore_errors=True)
+            total -= size
+            logger.info(f"Evicted cached index {digest} ({size} bytes)")
+
+    def stats(self) -> dict:
+        """Hit/miss counters and current footprint of the cache"""
+        with self._lock:
+            open_count = len(self._open)
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "open": open_count,
+            "disk_bytes": _dir_size(self.cache_dir),
+        }
@@ -4,56 +4,71 @@ import json
 import logging
 import os
 import pathlib
-from typing import List, Tuple
+import sys
+import uuid
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from typing import Callable, ContextManager, Iterable, Iterator, List, Optional, Set, Tuple
 
-import youtube_dl
-
-import langchain
 import wandb
 #from langchain.cache import SQLiteCache
 from langchain.docstore.document import Document
-from langchain.document_loaders import YoutubeLoader
-from langchain.embeddings import OpenAIEmbeddings
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain.vectorstores import Chroma
 
 from dotenv import find_dotenv, load_dotenv
+from chunking import DocumentSpool, stream_chunks
+from config import default_config
+from dataset import (
+    DATASET_ARTIFACT,
+    DATASET_FORMATS,
+    JSONL_FILE,
+    PARQUET_FILE,
+    TranscriptDataset,
+    load_dataset_artifact,
+    write_jsonl,
+    write_parquet,
+)
+from embedding_cache import cached_openai_embeddings
+from embedding_pipeline import EmbeddingPipeline
+from quantization import QUANTIZATIONS
+from segments import SegmentWriter, log_segments
+from tracing import span, timed, tracer
+from transcripts import canonical_video_id, default_transcript_loader
 
 
 logger = logging.getLogger(__name__)
 
+CHUNK_SPOOL_FILE = "chunks-{}.jsonl"
+
+# called with the current stage and the number of chunks embedded so far
+Progress = Callable[[str, int], None]
+
 load_dotenv(find_dotenv())
 
-def load_documents(video_url: str) -> str:
+@timed("fetch_transcript")
+def load_documents(video_url: str) -> Iterable[Document]:
     """Load documents from given url of youtube video
 
+    Transcripts are cached on disk by video id; on a miss the youtube transcript api
+    and youtube_dl are hedged, see `transcripts.HedgedFetcher`. The captions are then
+    read back from the cache lazily.
+
     Args:
-        video_url (str): youtube video url 
+        video_url (str): youtube video url or video id
 
     Returns:
-        str: Trancsript of the video
+        Iterable[Document]: Trancsript of the video, one document per caption
         
     """
-    try:
-        loader = YoutubeLoader.from_youtube_url(video_url)
-    except:
-        loader = YoutubeLoader.from_youtube_url(video_id = video_url.split('youtu.be/')[-1])
-    try:
-        transcript = loader.load()
-    except:
-        youtube_dl_options = {"writesubtitles": True}
-
-        with youtube_dl.YoutubeDL(youtube_dl_options) as youtube_dl_client:
-            transcript= youtube_dl_client.download([video_url])
-      
-    return transcript
+    return default_transcript_loader().stream(video_url)
 
 
+@timed("chunk")
 def chunk_documents(
-    documents: str, chunk_size: int = 500, chunk_overlap=100
+    documents: Iterable[Document], chunk_size: int = 500, chunk_overlap=100
 ) -> List[Document]:
     """Split documents into chunks
 
+    See `chunking.stream_chunks` for splitting without materializing the chunks.
+
     Args:
         documents: A transcript to split into chunks
         chunk_size (int, optional): The size of each chunk. Defaults to 500.
@@ -62,63 +77,95 @@ def chunk_documents(
     Returns:
         List[Document]: A list of chunked documents.
     """
-    text_splitter = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
-    split_documents= text_splitter.split_documents(documents)
-    
-    return split_documents
+    return list(stream_chunks(documents, chunk_size, chunk_overlap))
 
 
 def create_vector_store(
-    documents,
+    documents: Iterable[Document],
     vector_store_path: str = "./vector_store",
-) -> Chroma:
+    max_workers: int = 4,
+    max_batch_tokens: int = 8000,
+    backend: str = default_config.vector_store_backend,
+    quantization: str = default_config.vector_store_quantization,
+) -> SegmentWriter:
     """Create a Chroma vector store from a list of documents
 
+    The documents are written into a new immutable segment below `vector_store_path`.
+
     Args:
-        documents (_type_): A list of documents to add to the vector store
+        documents (Iterable[Document]): The documents to add to the vector store, consumed lazily
         vector_store_path (str, optional): The path to the vector store. Defaults to "./vector_store".
+        max_workers (int, optional): The number of concurrent embedding requests. Defaults to 4.
+        max_batch_tokens (int, optional): The token budget of one embedding request. Defaults to 8000.
+        backend (str, optional): The segment store, "chroma" or "numpy". Defaults to config.vector_store_backend.
+        quantization (str, optional): Vector encoding of numpy segments. Defaults to config.vector_store_quantization.
 
     Returns:
-        Chroma: A Chroma vector store containing the documents.
+        SegmentWriter: The persisted segment, its Chroma store or NumpyVectorStore is `.vector_store`
     """
-    api_key = os.environ.get("OPENAI_API_KEY", None)
-    embedding_function = OpenAIEmbeddings()
-    vector_store = Chroma.from_documents(
-        documents=documents,
-        embedding=embedding_function,
-        persist_directory=vector_store_path,
+    # EmbeddingPipeline retries failed batches itself, the client must not retry them again
+    embedding_function = cached_openai_embeddings(max_retries=0)
+    segment = SegmentWriter(vector_store_path, embedding_function, backend, quantization)
+    pipeline = EmbeddingPipeline(
+        embedding_function, max_workers=max_workers, max_batch_tokens=max_batch_tokens
     )
-    vector_store.persist()
-    return vector_store
-
-
-def log_dataset(documents: List[Document], run: "wandb.run"):
+    with span("embed"):
+        pipeline.run(documents, segment.sink)
+    with span("persist"):
+        # also writes the BM25 index of the segment
+        segment.persist()
+    return segment
+
+
+@timed("log_dataset")
+def log_dataset(
+    documents: Iterable[Document],
+    run: "wandb.run",
+    dataset_format: str = default_config.dataset_format,
+    batch_rows: int = default_config.dataset_batch_rows,
+):
     """Log a dataset to wandb
 
     Args:
-        documents (List[Document]): A list of documents to log to a wandb artifact
+        documents (Iterable[Document]): The documents to log to a wandb artifact, consumed lazily
         run (wandb.run): The wandb run to log the artifact to.
+        dataset_format (str, optional): "parquet" or "jsonl", see `dataset`. Defaults to config.dataset_format.
+        batch_rows (int, optional): Rows per Parquet row group. Defaults to config.dataset_batch_rows.
     """
-    document_artifact = wandb.Artifact(name="transcript_dataset", type="dataset")
-    with document_artifact.new_file("documents.json") as f:
-        for document in documents:
-            f.write(document.json() + "\n")
+    document_artifact = wandb.Artifact(name=DATASET_ARTIFACT, type="dataset")
+    if dataset_format == "parquet":
+        with document_artifact.new_file(PARQUET_FILE, mode="wb") as f:
+            rows = write_parquet(documents, f, batch_rows=batch_rows)
+    else:
+        with document_artifact.new_file(JSONL_FILE) as f:
+            rows = write_jsonl(documents, f)
+    document_artifact.metadata["rows"] = rows
+    document_artifact.metadata["format"] = dataset_format
 
     run.log_artifact(document_artifact)
 
 
-def log_index(vector_store_dir: str, run: "wandb.run"):
+@timed("log_index")
+def log_index(
+    vector_store_dir: str,
+    run: "wandb.run",
+    segment_ids: Optional[Iterable[str]] = None,
+    manifest_lock: Optional[ContextManager] = None,
+):
     """Log a vector store to wandb
 
+    Only segments that are not part of the latest index version are uploaded.
+
     Args:
         vector_store_dir (str): The directory containing the vector store to log
         run (wandb.run): The wandb run to log the artifact to.
+        segment_ids (Iterable[str], optional): The segments this ingest wrote. Defaults to all local segments.
+        manifest_lock (ContextManager, optional): Shared by concurrent ingests, see `segments.log_segments`
     """
-    index_artifact = wandb.Artifact(name="vector_store_artifact", type="search_index")
-    index_artifact.add_dir(vector_store_dir)
-    run.log_artifact(index_artifact)
+    log_segments(vector_store_dir, run, segment_ids=segment_ids, manifest_lock=manifest_lock)
 
 
+@timed("log_prompt")
 def log_prompt(prompt: dict, run: "wandb.run"):
     """Log a prompt to wandb
 
@@ -137,26 +184,242 @@ def ingest_data(
     chunk_size: int,
     chunk_overlap: int,
     vector_store_path: str,
-) -> Tuple[List[Document], Chroma]:
+    backend: str = default_config.vector_store_backend,
+    quantization: str = default_config.vector_store_quantization,
+    progress: Optional[Progress] = None,
+) -> Tuple[DocumentSpool, SegmentWriter]:
     """Ingest a directory of markdown files into a vector store
 
+    The transcript is split while it is read and each chunk goes straight on to the
+    embedding pipeline and from there into the segment, so the transcript text and
+    embeddings held at once are bounded by the pipeline's in-flight batches. What the
+    segment itself keeps until it is persisted still grows with the video: the BM25
+    postings of its chunks, and with the numpy backend its vectors. The chunks are spooled to a
+    `<vector_store_path>/chunks-<id>.jsonl` of this ingest on the way for logging the dataset.
+
     Args:
         video_url (str):
         chunk_size (int):
         chunk_overlap (int):
         vector_store_path (str):
+        progress (Progress, optional): Called as the ingest moves through its stages
 
 
     """
+    progress = progress or (lambda stage, chunks: None)
+
     # load the documents
+    progress("fetching transcript", 0)
     documents = load_documents(video_url)
 
-    # split the documents into chunks
-    split_documents = chunk_documents(documents, chunk_size, chunk_overlap)
+    # split the documents into chunks as they are read
+    progress("embedding", 0)
+    split_documents = report_chunks(stream_chunks(documents, chunk_size, chunk_overlap), progress)
 
     # create document embeddings and store them in a vector store
-    vector_store = create_vector_store(split_documents, vector_store_path)
-    return split_documents, vector_store
+    os.makedirs(vector_store_path, exist_ok=True)
+    # ingests running at once share vector_store_path, each spools its own chunks
+    spool = DocumentSpool(os.path.join(vector_store_path, CHUNK_SPOOL_FILE.format(uuid.uuid4().hex[:12])))
+    segment = create_vector_store(
+        spool.write_through(split_documents), vector_store_path, backend=backend, quantization=quantization
+    )
+    return spool, segment
+
+
+def rebuild_from_dataset(
+    dataset: TranscriptDataset,
+    vector_store_path: str,
+    video_ids: Optional[Iterable[str]] = None,
+    backend: str = default_config.vector_store_backend,
+    quantization: str = default_config.vector_store_quantization,
+) -> SegmentWriter:
+    """Embed the chunks of a logged dataset into a new segment without fetching transcripts
+
+    Chunks embedded before are served by the embedding cache, so rebuilding with a
+    different backend or quantization only pays for the vectors it does not have yet.
+
+    Args:
+        dataset (TranscriptDataset): The logged chunks, see `dataset.load_dataset_artifact`
+        vector_store_path (str): The directory containing the `segments` subdirectory
+        video_ids (Iterable[str], optional): Only rebuild the chunks of these videos. Defaults to all.
+        backend (str, optional): The segment store, "chroma" or "numpy". Defaults to config.vector_store_backend.
+        quantization (str, optional): Vector encoding of numpy segments. Defaults to config.vector_store_quantization.
+
+    Returns:
+        SegmentWriter: The new segment
+    """
+    os.makedirs(vector_store_path, exist_ok=True)
+    return create_vector_store(
+        dataset.documents(video_ids), vector_store_path, backend=backend, quantization=quantization
+    )
+
+
+def report_chunks(documents: Iterable[Document], progress: Progress, every: int = 100) -> Iterator[Document]:
+    """Pass documents through, reporting the count to `progress` every `every` documents"""
+    count = 0
+    for count, document in enumerate(documents, 1):
+        if count % every == 0:
+            progress("embedding", count)
+        yield document
+    progress("embedding", count)
+
+
+def read_video_list(video_list: str) -> Iterator[str]:
+    """Read video urls or ids, one per line, from a file or from stdin when given "-"
+
+    Blank lines and lines starting with # are skipped.
+    """
+    f = sys.stdin if video_list == "-" else open(video_list, "r")
+    try:
+        for line in f:
+            line = line.strip()
+            if line and not line.startswith("#"):
+                yield line
+    finally:
+        if f is not sys.stdin:
+            f.close()
+
+
+def load_manifest(manifest_path: str) -> Set[str]:
+    """Return the ids of the videos a previous batch ingest recorded as completed"""
+    completed = set()
+    if not os.path.exists(manifest_path):
+        return completed
+    with open(manifest_path, "r") as f:
+        for line in f:
+            try:
+                completed.add(json.loads(line)["video_id"])
+            except (ValueError, KeyError):
+                # a torn last line from an interrupted run, the video is simply redone
+                continue
+    return completed
+
+
+def manifest_segments(manifest_path: str) -> List[str]:
+    """Ids of the segments holding the videos of a batch manifest, in the order they were written"""
+    segments = {}
+    if not os.path.exists(manifest_path):
+        return []
+    with open(manifest_path, "r") as f:
+        for line in f:
+            try:
+                segments.setdefault(json.loads(line)["segment"], None)
+            except (ValueError, KeyError):
+                continue
+    return list(segments)
+
+
+def fetch_and_chunk(video_url: str, chunk_size: int, chunk_overlap: int) -> Tuple[str, List[Document]]:
+    """Fetch and split the transcript of one video, tagging each chunk with its video id
+
+    Runs in the worker processes of `ingest_batch`.
+    """
+    video_id = canonical_video_id(video_url)
+    split_documents = chunk_documents(load_documents(video_id), chunk_size, chunk_overlap)
+    for document in split_documents:
+        document.metadata["video_id"] = video_id
+    return video_id, split_documents
+
+
+def ingest_batch(
+    video_urls: Iterable[str],
+    chunk_size: int,
+    chunk_overlap: int,
+    vector_store_path: str,
+    manifest_path: str,
+    num_workers: int = None,
+    persist_every: int = 20,
+    embedding_workers: int = 4,
+    backend: str = default_config.vector_store_backend,
+    quantization: str = default_config.vector_store_quantization,
+) -> SegmentWriter:
+    """Ingest many videos into one vector store, resuming from a completion manifest
+
+    Transcripts are fetched and chunked in a process pool while the chunks of finished
+    videos are embedded through one shared pipeline. A video is appended to the manifest
+    only once the store holding its chunks has been persisted, so an interrupted run
+    restarts from the last persisted point.
+
+    Args:
+        video_urls (Iterable[str]): Video urls or ids to ingest
+        chunk_size (int): The size of each chunk
+        chunk_overlap (int): The overlap between neighbouring chunks
+        vector_store_path (str): The path to the vector store, a new segment is written below it
+        manifest_path (str): JSON-lines file recording completed videos
+        num_workers (int, optional): Transcript fetching processes. Defaults to the cpu count.
+        persist_every (int, optional): Videos between persists of the store, their embedded chunks are held
+            in memory until then. Defaults to 20.
+        embedding_workers (int, optional): Concurrent embedding requests. Defaults to 4.
+        backend (str, optional): The segment store, "chroma" or "numpy". Defaults to config.vector_store_backend.
+        quantization (str, optional): Vector encoding of numpy segments. Defaults to config.vector_store_quantization.
+
+    Returns:
+        SegmentWriter: The segment containing all ingested videos
+    """
+    completed = load_manifest(manifest_path)
+    # EmbeddingPipeline retries failed batches itself, the client must not retry them again
+    embedding_function = cached_openai_embeddings(max_retries=0)
+    # videos only reach the segment at a checkpoint, together with their manifest entries
+    segment = SegmentWriter(vector_store_path, embedding_function, backend, quantization, buffered=True)
+    pipeline = EmbeddingPipeline(embedding_function, max_workers=embedding_workers)
+    num_workers = num_workers or os.cpu_count() or 1
+    pending: List[dict] = []
+    failed = 0
+
+    def checkpoint(lexical: bool = False):
+        segment.persist(lexical)
+        with open(manifest_path, "a") as f:
+            for entry in pending:
+                f.write(json.dumps(entry) + "\n")
+            f.flush()
+            os.fsync(f.fileno())
+        logger.info(f"Persisted {len(pending)} videos, {len(completed)} completed in total")
+        pending.clear()
+
+    def handle(done):
+        nonlocal failed
+        for future in done:
+            video_url = in_flight.pop(future)
+            try:
+                video_id, documents = future.result()
+            except Exception as e:
+                failed += 1
+                logger.error(f"Failed to fetch {video_url}: {e!r}")
+                continue
+            stats = pipeline.run(documents, segment.sink)
+            completed.add(video_id)
+            pending.append(
+                {"video_id": video_id, "segment": segment.segment_id, "chunks": stats.chunks, "tokens": stats.tokens}
+            )
+            if len(pending) >= persist_every:
+                checkpoint()
+
+    in_flight = {}
+    queued = set()
+    with ProcessPoolExecutor(max_workers=num_workers) as executor:
+        for video_url in video_urls:
+            try:
+                video_id = canonical_video_id(video_url)
+            except ValueError as e:
+                failed += 1
+                logger.error(str(e))
+                continue
+            if video_id in completed or video_id in queued:
+                continue
+            queued.add(video_id)
+            # keep only a small window of transcripts in memory ahead of the embedder
+            while len(in_flight) >= 2 * num_workers:
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                handle(done)
+            in_flight[executor.submit(fetch_and_chunk, video_url, chunk_size, chunk_overlap)] = video_url
+        while in_flight:
+            done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            handle(done)
+
+    checkpoint(lexical=True)
+    if failed:
+        logger.warning(f"{failed} videos failed and will be retried on the next run")
+    return segment
 
 
 def get_parser():
@@ -214,24 +477,139 @@ def get_parser():
         type=int,
         help="fallback",
     )
+    parser.add_argument(
+        "--video_list",
+        type=str,
+        default=None,
+        help="A file with one video url or id per line, or - for stdin, to ingest in batch mode",
+    )
+    parser.add_argument(
+        "--manifest",
+        type=str,
+        default="./ingest_manifest.jsonl",
+        help="The batch mode manifest of completed videos used to resume interrupted runs",
+    )
+    parser.add_argument(
+        "--num_workers",
+        type=int,
+        default=None,
+        help="The number of processes fetching transcripts in batch mode",
+    )
+    parser.add_argument(
+        "--embedding_workers",
+        type=int,
+        default=4,
+        help="The number of concurrent embedding requests",
+    )
+    parser.add_argument(
+        "--persist_every",
+        type=int,
+        default=20,
+        help="The number of videos to ingest between persisting the store in batch mode",
+    )
+    parser.add_argument(
+        "--vector_store_backend",
+        type=str,
+        choices=["chroma", "numpy"],
+        default=default_config.vector_store_backend,
+        help="The store each new segment is written with",
+    )
+    parser.add_argument(
+        "--vector_store_quantization",
+        type=str,
+        choices=list(QUANTIZATIONS),
+        default=default_config.vector_store_quantization,
+        help="The encoding of the vectors of numpy segments, smaller artifacts at a small recall cost",
+    )
+    parser.add_argument(
+        "--dataset_format",
+        type=str,
+        choices=list(DATASET_FORMATS),
+        default=default_config.dataset_format,
+        help="The file format of the logged transcript dataset",
+    )
+    parser.add_argument(
+        "--from_dataset",
+        type=str,
+        default=None,
+        help="Rebuild the index from a logged dataset, a local file or directory or an artifact name such as "
+        f"{DATASET_ARTIFACT}:latest, instead of fetching transcripts; --video_url limits it to one video",
+    )
 
     return parser
 
-def main(video_url):
-    parser = get_parser()
-    args = parser.parse_args()
+def main(
+    video_url, args=None, progress: Optional[Progress] = None, manifest_lock: Optional[ContextManager] = None
+):
+    if args is None:
+        # called from the app, which must not parse its own command line as ours
+        args = get_parser().parse_args([])
     args.video_url = video_url
     run = wandb.init(project=args.wandb_project, config=args)
-    documents, vector_store = ingest_data(
-        video_url=video_url,
+    with tracer.trace("ingest", run=run):
+        documents, segment = ingest_data(
+            video_url=video_url,
+            chunk_size=args.chunk_size,
+            chunk_overlap=args.chunk_overlap,
+            vector_store_path=args.vector_store_artifact,
+            backend=args.vector_store_backend,
+            quantization=args.vector_store_quantization,
+            progress=progress,
+        )
+        if progress is not None:
+            progress("logging artifacts", len(documents))
+        log_dataset(documents, run, dataset_format=args.dataset_format)
+        os.remove(documents.path)
+        log_index(args.vector_store_artifact, run, [segment.segment_id], manifest_lock)
+        log_prompt(json.load(args.chat_prompt_artifact.open("r")), run)
+    # the worker running this ingest finishes the run next
+    tracer.flush(run)
+
+
+def batch_main(args):
+    run = wandb.init(project=args.wandb_project, config=args)
+    ingest_batch(
+        read_video_list(args.video_list),
         chunk_size=args.chunk_size,
         chunk_overlap=args.chunk_overlap,
         vector_store_path=args.vector_store_artifact,
+        manifest_path=args.manifest,
+        num_workers=args.num_workers,
+        persist_every=args.persist_every,
+        embedding_workers=args.embedding_workers,
+        backend=args.vector_store_backend,
+        quantization=args.vector_store_quantization,
     )
-    log_dataset(documents, run)
-    log_index(args.vector_store_artifact, run)
+    # segments of interrupted earlier runs hold their checkpointed videos, already uploaded ones are skipped
+    log_index(args.vector_store_artifact, run, manifest_segments(args.manifest))
     log_prompt(json.load(args.chat_prompt_artifact.open("r")), run)
 
 
-#if __name__ == "__main__":
-    #main()
\ No newline at end of file
+def dataset_main(args):
+    run = wandb.init(project=args.wandb_project, config=args)
+    if os.path.exists(args.from_dataset):
+        dataset = TranscriptDataset(args.from_dataset)
+    else:
+        dataset = load_dataset_artifact(run, args.from_dataset)
+    video_ids = [canonical_video_id(args.video_url)] if args.video_url else None
+    with tracer.trace("rebuild", run=run):
+        segment = rebuild_from_dataset(
+            dataset,
+            args.vector_store_artifact,
+            video_ids=video_ids,
+            backend=args.vector_store_backend,
+            quantization=args.vector_store_quantization,
+        )
+        log_index(args.vector_store_artifact, run, [segment.segment_id])
+    tracer.flush(run)
+
+
+if __name__ == "__main__":
+    logging.basicConfig(level=logging.INFO)
+    args = get_parser().parse_args()
+    if args.from_dataset:
+        dataset_main(args)
+    elif args.video_list:
+        batch_main(args)
+    else:
+        main(args.video_url, args)
\ No newline at end of file
@@ -0,0 +1,151 @@
+"""Inverted file (IVF) index for approximate nearest neighbour search of normalised embeddings
+
+The vectors are clustered with k-means into `n_lists` lists and stored grouped by
+list, so a query only scores the vectors of the `nprobe` lists whose centroids are
+closest to it: one small matrix product per probed list instead of one over the whole
+corpus. Raising `nprobe` trades latency for recall, `nprobe = n_lists` is exact.
+"""
+import logging
+import os
+from typing import Optional, Tuple
+
+import numpy as np
+
+from quantization import BLOCK_ROWS, kmeans, top_k
+
+logger = logging.getLogger(__name__)
+
+CENTROIDS_FILE = "ivf_centroids.npy"
+OFFSETS_FILE = "ivf_offsets.npy"
+VECTORS_FILE = "ivf_vectors.npy"
+ROWS_FILE = "ivf_rows.npy"
+
+
+def default_lists(n_vectors: int) -> int:
+    """About sqrt(n) lists, the usual balance of centroid and list scanning cost"""
+    return max(1, min(n_vectors, int(round(np.sqrt(n_vectors)))))
+
+
+def assign_lists(vectors: np.ndarray, centroids: np.ndarray) -> np.ndarray:
+    """The closest centroid of every vector, computed block by block"""
+    centroid_norms = (centroids**2).sum(axis=1)
+    assignment = np.empty(len(vectors), dtype=np.int32)
+    for start in range(0, len(vectors), BLOCK_ROWS):
+        block = np.asarray(vectors[start : start + BLOCK_ROWS], dtype=np.float32)
+        assignment[start : start + len(block)] = (centroid_norms - 2 * block @ centroids.T).argmin(axis=1)
+    return assignment
+
+
+class IVFIndex:
+    """Vectors grouped by their closest k-means centroid
+
+    Args:
+        centroids (np.ndarray): (n_lists, dim) list centroids
+        offsets (np.ndarray): (n_lists + 1,) start of each list in `vectors`
+        vectors (np.ndarray): (n, dim) normalised vectors ordered by list
+        rows (np.ndarray): (n,) the row each vector had before grouping
+    """
+
+    def __init__(self, centroids: np.ndarray, offsets: np.ndarray, vectors: np.ndarray, rows: np.ndarray):
+        self.centroids = centroids
+        self.offsets = offsets
+        self.vectors = vectors
+        self.rows = rows
+        self._centroid_norms = (centroids**2).sum(axis=1)
+        self._positions: Optional[np.ndarray] = None
+
+    @classmethod
+    def build(
+        cls,
+        vectors: np.ndarray,
+        n_lists: Optional[int] = None,
+        iterations: int = 10,
+        train_per_list: int = 40,
+        seed: int = 0,
+    ) -> "IVFIndex":
+        """Cluster `vectors` and group them by list
+
+        Args:
+            vectors (np.ndarray): (n, dim) normalised float32 vectors
+            n_lists (int, optional): Number of lists. Defaults to about sqrt(n).
+            iterations (int, optional): k-means iterations. Defaults to 10.
+            train_per_list (int, optional): Training vectors sampled per list. Defaults to 40.
+            seed (int, optional): Seed of the sampling and centroid initialisation. Defaults to 0.
+        """
+        n, dim = vectors.shape
+        if n == 0:
+            return cls(np.zeros((0, dim), np.float32), np.zeros(1, np.int64), vectors, np.zeros(0, np.int64))
+        n_lists = min(n_lists or default_lists(n), n)
+        rng = np.random.default_rng(seed)
+        n_train = min(n, n_lists * train_per_list)
+        sample = vectors[np.sort(rng.choice(n, n_train, replace=False))] if n_train < n else vectors
+        centroids = kmeans(np.asarray(sample, dtype=np.float32), n_lists, iterations, rng).astype(np.float32)
+        assignment = assign_lists(vectors, centroids)
+        rows = np.argsort(assignment, kind="stable")
+        offsets = np.zeros(n_lists + 1, dtype=np.int64)
+        np.cumsum(np.bincount(assignment, minlength=n_lists), out=offsets[1:])
+        logger.info(f"Built an IVF index of {n} vectors in {n_lists} lists from {n_train} training vectors")
+        return cls(centroids, offsets, np.ascontiguousarray(vectors[rows], dtype=np.float32), rows)
+
+    def __len__(self) -> int:
+        return len(self.rows)
+
+    @property
+    def n_lists(self) -> int:
+        return len(self.centroids)
+
+    def save(self, directory: str):
+        for file_name, array in (
+            (CENTROIDS_FILE, self.centroids),
+            (OFFSETS_FILE, self.offsets),
+            (VECTORS_FILE, self.vectors),
+            (ROWS_FILE, self.rows),
+        ):
+            np.save(os.path.join(directory, file_name), array)
+
+    @classmethod
+    def load(cls, directory: str) -> "IVFIndex":
+        """Open a saved index, memory-mapping its vectors"""
+        return cls(
+            np.load(os.path.join(directory, CENTROIDS_FILE)),
+            np.load(os.path.join(directory, OFFSETS_FILE)),
+            np.load(os.path.join(directory, VECTORS_FILE), mmap_mode="r"),
+            np.load(os.path.join(directory, ROWS_FILE)),
+        )
+
+    @property
+    def positions(self) -> np.ndarray:
+        """Where each original row is stored in the grouped order"""
+        if self._positions is None:
+            self._positions = np.empty_like(self.rows)
+            self._positions[self.rows] = np.arange(len(self.rows))
+        return self._positions
+
+    def _top(self, positions: np.ndarray, query: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        scores = np.asarray(self.vectors[positions], dtype=np.float32) @ query
+        top = top_k(scores, k)
+        return self.rows[positions[top]], scores[top]
+
+    def search(self, query: np.ndarray, k: int, nprobe: int = 8) -> Tuple[np.ndarray, np.ndarray]:
+        """Approximate top-k rows and their cosine similarities, highest first
+
+        Args:
+            query (np.ndarray): (dim,) normalised query vector
+            k (int): Results to return
+            nprobe (int, optional): Lists scanned. Defaults to 8.
+        """
+        if not len(self):
+            return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.float32)
+        nprobe = min(nprobe, self.n_lists)
+        distances = self._centroid_norms - 2 * self.centroids @ query
+        probed = np.sort(np.argpartition(distances, nprobe - 1)[:nprobe])
+        # each list is a contiguous slice, scored in place instead of gathered into a copy
+        scores = np.concatenate([self.vectors[self.offsets[i] : self.offsets[i + 1]] @ query for i in probed])
+        positions = np.concatenate([np.arange(self.offsets[i], self.offsets[i + 1]) for i in probed])
+        top = top_k(scores, k)
+        return self.rows[positions[top]], scores[top]
+
+    def exact(self, query: np.ndarray, k: int, rows: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """Exact top-k among the given original rows, e.g. the chunks of one video"""
+        # sorted positions read the memory-mapped vectors front to back
+        return self._top(np.sort(self.positions[rows]), query, k)
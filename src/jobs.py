@@ -0,0 +1,165 @@
+"""Background ingestion jobs run on a process pool outside the Streamlit script thread
+
+Jobs are identified by an id and de-duplicated by video id while queued or running,
+so several sessions submitting the same video share one ingest. Workers report their
+progress over a manager queue that a thread in the app process folds into the job
+states the UI polls. Every job writes its own segment and chunk spool and publishes
+only that segment; a manager lock serialises the updates of the index manifest.
+"""
+import logging
+import multiprocessing
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from concurrent.futures import Future, ProcessPoolExecutor
+from dataclasses import dataclass, field, replace
+from typing import Dict, List, Optional
+
+logger = logging.getLogger(__name__)
+
+QUEUED = "queued"
+RUNNING = "running"
+DONE = "done"
+FAILED = "failed"
+
+# rough share of an ingest spent before each stage, for the progress bar
+STAGE_PROGRESS = {
+    "fetching transcript": 0.05,
+    "embedding": 0.15,
+    "logging artifacts": 0.85,
+    DONE: 1.0,
+}
+
+
+@dataclass
+class IngestJob:
+    id: str
+    video_id: str
+    video_url: str
+    status: str = QUEUED
+    stage: str = QUEUED
+    chunks: int = 0
+    error: Optional[str] = None
+    created: float = field(default_factory=time.time)
+    finished: Optional[float] = None
+
+    @property
+    def active(self) -> bool:
+        return self.status in (QUEUED, RUNNING)
+
+    @property
+    def progress(self) -> float:
+        return STAGE_PROGRESS.get(self.stage, 0.0)
+
+
+def _run_ingest(job_id: str, video_url: str, events, manifest_lock):
+    """Worker process entry point running one ingest and reporting its stages"""
+    import wandb
+    from ingest import main
+
+    def progress(stage: str, chunks: int = 0):
+        events.put((job_id, stage, chunks))
+
+    try:
+        main(video_url, progress=progress, manifest_lock=manifest_lock)
+    finally:
+        # workers are reused, the next job must start its own run
+        wandb.finish()
+
+
+class JobQueue:
+    """Ingest videos on at most `max_workers` processes
+
+    Args:
+        max_workers (int, optional): Ingests running at once. Defaults to 2.
+        max_history (int, optional): Finished jobs kept for status lookups. Defaults to 100.
+    """
+
+    def __init__(self, max_workers: int = 2, max_history: int = 100):
+        self.max_history = max_history
+        self._jobs: "OrderedDict[str, IngestJob]" = OrderedDict()
+        self._active: Dict[str, str] = {}
+        self._lock = threading.Lock()
+        # spawned rather than forked workers do not inherit the app's threads and clients
+        context = multiprocessing.get_context("spawn")
+        self._manager = context.Manager()
+        self._events = self._manager.Queue()
+        self._manifest_lock = self._manager.Lock()
+        self._executor = ProcessPoolExecutor(max_workers=max_workers, mp_context=context)
+        threading.Thread(target=self._drain_events, name="ingest-progress", daemon=True).start()
+
+    def submit(self, video_url: str) -> IngestJob:
+        """Queue an ingest of `video_url`, or return the job already ingesting that video
+
+        Raises:
+            ValueError: If no video id can be found in `video_url`
+        """
+        from transcripts import canonical_video_id, watch_url
+
+        video_id = canonical_video_id(video_url)
+        with self._lock:
+            job_id = self._active.get(video_id)
+            if job_id is not None:
+                logger.info(f"Video {video_id} is already being ingested by job {job_id}")
+                return replace(self._jobs[job_id])
+            job = IngestJob(id=uuid.uuid4().hex[:12], video_id=video_id, video_url=watch_url(video_id))
+            self._jobs[job.id] = job
+            self._active[video_id] = job.id
+            self._trim()
+        future = self._executor.submit(_run_ingest, job.id, job.video_url, self._events, self._manifest_lock)
+        future.add_done_callback(lambda future, job_id=job.id: self._finish(job_id, future))
+        logger.info(f"Queued ingest job {job.id} for {video_id}")
+        return replace(job)
+
+    def get(self, job_id: str) -> Optional[IngestJob]:
+        """A snapshot of the job's state, None once it dropped out of the history"""
+        with self._lock:
+            job = self._jobs.get(job_id)
+            return replace(job) if job is not None else None
+
+    def jobs(self) -> List[IngestJob]:
+        with self._lock:
+            return [replace(job) for job in self._jobs.values()]
+
+    def _drain_events(self):
+        while True:
+            try:
+                job_id, stage, chunks = self._events.get()
+            except (EOFError, OSError):
+                # the manager shut down with the app
+                return
+            with self._lock:
+                job = self._jobs.get(job_id)
+                if job is None or not job.active:
+                    continue
+                job.status = RUNNING
+                job.stage = stage
+                job.chunks = max(job.chunks, chunks)
+
+    def _finish(self, job_id: str, future: Future):
+        error = future.exception()
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return
+            job.finished = time.time()
+            if error is None:
+                job.status = job.stage = DONE
+            else:
+                job.status = FAILED
+                job.error = repr(error)
+                logger.error(f"Ingest job {job_id} for {job.video_id} failed: {error!r}")
+            if self._active.get(job.video_id) == job_id:
+                del self._active[job.video_id]
+            self._trim()
+
+    def _trim(self):
+        # drop the oldest finished jobs beyond the history limit, active jobs always stay
+        finished = [job_id for job_id, job in self._jobs.items() if not job.active]
+        for job_id in finished[: max(0, len(self._jobs) - self.max_history)]:
+            del self._jobs[job_id]
+
+    def shutdown(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        self._manager.shutdown()
@@ -0,0 +1,275 @@
+"""Process-wide pool of reusable chat model clients
+
+Clients and their chains are built once per (model, temperature, max tokens) and
+shared by every question, and at most `max_in_flight` completions run at once across
+the pool. Failed calls are retried `max_retries` times with full-jitter backoff,
+streamed calls only until their first token reached the callbacks.
+
+The openai client opens a keep-alive HTTP session per thread, and Streamlit runs every
+rerun on a new thread, so each question would pay for a new connection. The pool's
+completions run on one shared session instead; it is installed for the calling thread
+only while the completion runs, other OpenAI calls keep the client's own sessions.
+"""
+import asyncio
+import logging
+import random
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+from typing import Any, Callable, Dict, Optional, Tuple
+
+import requests
+from langchain.chains import LLMChain
+from langchain.chat_models import ChatOpenAI
+from pydantic import Field
+
+from config import default_config
+from embedding_pipeline import is_retryable
+from tracing import increment, record
+
+logger = logging.getLogger(__name__)
+
+
+class _TokenWatch:
+    """A run manager that remembers whether a token was passed on to the callbacks"""
+
+    def __init__(self, run_manager):
+        self.run_manager = run_manager
+        self.emitted = False
+
+    def on_llm_new_token(self, token: str, **kwargs):
+        self.emitted = True
+        return self.run_manager.on_llm_new_token(token, **kwargs)
+
+    def __getattr__(self, name: str):
+        return getattr(self.run_manager, name)
+
+
+class _AsyncTokenWatch(_TokenWatch):
+    async def on_llm_new_token(self, token: str, **kwargs):
+        self.emitted = True
+        return await self.run_manager.on_llm_new_token(token, **kwargs)
+
+
+class PooledChatOpenAI(ChatOpenAI):
+    """ChatOpenAI taking a slot of its pool for every request"""
+
+    pool: Any = Field(default=None, exclude=True)
+
+    def _generate(self, *args, run_manager=None, **kwargs):
+        watch = _TokenWatch(run_manager) if run_manager is not None else None
+        with self.pool.slot(), self.pool.shared_session():
+            return self.pool.call(
+                super()._generate,
+                *args,
+                run_manager=watch,
+                # a retry would stream the tokens already shown a second time
+                can_retry=lambda: watch is None or not watch.emitted,
+                **kwargs,
+            )
+
+    async def _agenerate(self, *args, run_manager=None, **kwargs):
+        watch = _AsyncTokenWatch(run_manager) if run_manager is not None else None
+        async with self.pool.async_slot():
+            return await self.pool.acall(
+                super()._agenerate,
+                *args,
+                run_manager=watch,
+                can_retry=lambda: watch is None or not watch.emitted,
+                **kwargs,
+            )
+
+
+class LLMPool:
+    """Chat model clients shared per (model, temperature, max tokens)
+
+    Args:
+        max_in_flight (int, optional): Completions running at once across all clients. Defaults to 16.
+        max_retries (int, optional): Retries of a failed completion. Defaults to 1.
+        base_delay (float, optional): Upper bound of the first backoff in seconds. Defaults to 1.0.
+        max_delay (float, optional): Upper bound of any backoff in seconds. Defaults to 30.0.
+    """
+
+    def __init__(
+        self, max_in_flight: int = 16, max_retries: int = 1, base_delay: float = 1.0, max_delay: float = 30.0
+    ):
+        self.max_in_flight = max_in_flight
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+        self._clients: Dict[Tuple, PooledChatOpenAI] = {}
+        self._chains: Dict[int, Tuple[Any, LLMChain]] = {}
+        self._lock = threading.Lock()
+        self._slots = threading.BoundedSemaphore(max_in_flight)
+        self.in_flight = 0
+        self.peak_in_flight = 0
+        self.requests = 0
+        self.retries = 0
+        self.failures = 0
+        self.wait_seconds = 0.0
+        self.session = requests.Session()
+        adapter = requests.adapters.HTTPAdapter(pool_connections=4, pool_maxsize=max_in_flight)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+    def client(
+        self,
+        model_name: str,
+        temperature: float,
+        max_tokens: int = 2048,
+        streaming: bool = False,
+        openai_api_key: Optional[str] = None,
+    ) -> ChatOpenAI:
+        """The shared client for these settings, created on first use
+
+        Streaming clients emit tokens to the callbacks passed when the chain is run.
+        """
+        key = (model_name, temperature, max_tokens, streaming, openai_api_key)
+        with self._lock:
+            client = self._clients.get(key)
+            if client is None:
+                kwargs = {"openai_api_key": openai_api_key} if openai_api_key else {}
+                client = PooledChatOpenAI(
+                    model_name=model_name,
+                    temperature=temperature,
+                    max_tokens=max_tokens,
+                    streaming=streaming,
+                    # retries happen in the pool, with jitter instead of fixed exponential waits
+                    max_retries=0,
+                    pool=self,
+                    **kwargs,
+                )
+                self._clients[key] = client
+            return client
+
+    def chain(self, prompt, model_name: str, temperature: float, max_tokens: int = 2048, **kwargs) -> LLMChain:
+        """The shared LLMChain of `prompt` on the client for these settings
+
+        The chain is rebuilt when a different prompt object is passed, e.g. after a new
+        prompt artifact version was loaded.
+        """
+        client = self.client(model_name, temperature, max_tokens, **kwargs)
+        key = id(client)
+        with self._lock:
+            cached = self._chains.get(key)
+            if cached is not None and cached[0] is prompt:
+                return cached[1]
+            chain = LLMChain(llm=client, prompt=prompt)
+            self._chains[key] = (prompt, chain)
+            return chain
+
+    def _acquired(self, waited: float):
+        with self._lock:
+            self.in_flight += 1
+            self.peak_in_flight = max(self.peak_in_flight, self.in_flight)
+            self.requests += 1
+            self.wait_seconds += waited
+        record("llm_pool_wait_ms", waited * 1000)
+
+    def _released(self):
+        with self._lock:
+            self.in_flight -= 1
+        self._slots.release()
+
+    @contextmanager
+    def slot(self):
+        start = time.perf_counter()
+        self._slots.acquire()
+        self._acquired(time.perf_counter() - start)
+        try:
+            yield
+        finally:
+            self._released()
+
+    @asynccontextmanager
+    async def async_slot(self):
+        start = time.perf_counter()
+        if not self._slots.acquire(blocking=False):
+            # wait on a worker thread so the event loop keeps serving other requests
+            await asyncio.to_thread(self._slots.acquire)
+        self._acquired(time.perf_counter() - start)
+        try:
+            yield
+        finally:
+            self._released()
+
+    @contextmanager
+    def shared_session(self):
+        """Send this thread's OpenAI requests over the pool's keep-alive session until the block exits"""
+        try:
+            from openai import api_requestor
+
+            context = api_requestor._thread_context
+        except (ImportError, AttributeError):
+            # a client without per-thread sessions manages its connections itself
+            yield
+            return
+        previous = getattr(context, "session", None), getattr(context, "session_create_time", None)
+        context.session = self.session
+        # a fresh creation time keeps the client from closing the shared session as expired
+        context.session_create_time = time.time()
+        try:
+            yield
+        finally:
+            if previous[0] is None:
+                del context.session
+                del context.session_create_time
+            else:
+                context.session, context.session_create_time = previous
+
+    def _backoff(self, attempt: int, exc: Exception, can_retry: Optional[Callable[[], bool]] = None) -> Optional[float]:
+        if attempt >= self.max_retries or not is_retryable(exc) or (can_retry is not None and not can_retry()):
+            with self._lock:
+                self.failures += 1
+            return None
+        with self._lock:
+            self.retries += 1
+        increment("llm_retries")
+        # full jitter keeps concurrent requests from retrying in lockstep
+        delay = random.uniform(0, min(self.max_delay, self.base_delay * 2**attempt))
+        logger.warning(f"Chat completion failed with {exc!r}, retrying in {delay:.1f}s")
+        return delay
+
+    def call(self, fn: Callable, *args, can_retry: Optional[Callable[[], bool]] = None, **kwargs):
+        """`fn(*args, **kwargs)`, retried while `can_retry()` allows it"""
+        attempt = 0
+        while True:
+            try:
+                return fn(*args, **kwargs)
+            except Exception as e:
+                delay = self._backoff(attempt, e, can_retry)
+                if delay is None:
+                    raise
+                attempt += 1
+                time.sleep(delay)
+
+    async def acall(self, fn: Callable, *args, can_retry: Optional[Callable[[], bool]] = None, **kwargs):
+        attempt = 0
+        while True:
+            try:
+                return await fn(*args, **kwargs)
+            except Exception as e:
+                delay = self._backoff(attempt, e, can_retry)
+                if delay is None:
+                    raise
+                attempt += 1
+                await asyncio.sleep(delay)
+
+    def stats(self) -> dict:
+        """Utilisation and counters of the pool"""
+        with self._lock:
+            return {
+                "clients": len(self._clients),
+                "in_flight": self.in_flight,
+                "peak_in_flight": self.peak_in_flight,
+                "utilisation": self.in_flight / self.max_in_flight,
+                "requests": self.requests,
+                "retries": self.retries,
+                "failures": self.failures,
+                "mean_wait_ms": 1000 * self.wait_seconds / self.requests if self.requests else 0.0,
+            }
+
+
+llm_pool = LLMPool(
+    max_in_flight=default_config.llm_max_in_flight, max_retries=default_config.max_fallback_retries
+)
@@ -0,0 +1,160 @@
+"""Bounded conversation memory: recent turns verbatim plus a rolling summary
+
+Older turns are folded into the summary on a background thread after an answer has
+been shown, so summarizing never delays a question, and the rendered history is
+capped by a token budget so the prompt stays the same size however long a chat runs.
+"""
+import logging
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, List, NamedTuple, Optional
+
+from langchain.prompts import PromptTemplate
+
+from embedding_pipeline import get_encoding
+
+logger = logging.getLogger(__name__)
+
+SUMMARY_PROMPT = PromptTemplate.from_template(
+    "Progressively summarize a conversation about a youtube video, adding the new lines to the "
+    "current summary. Keep the facts, names and open questions a follow-up question could refer to. "
+    "Reply with the new summary only.\n\n"
+    "Current summary:\n{summary}\n\nNew lines:\n{new_lines}\n\nNew summary:"
+)
+
+_executor = ThreadPoolExecutor(max_workers=2, thread_name_prefix="memory")
+
+
+class Turn(NamedTuple):
+    question: str
+    answer: str
+
+    def render(self) -> str:
+        return f"User: {self.question}\nAssistant: {self.answer}"
+
+
+Summarizer = Callable[[str, List[Turn]], str]
+
+
+def llm_summarizer(model_name: str, max_tokens: int) -> Summarizer:
+    """Summarize with a deterministic client from the shared `llm_pool`"""
+
+    def summarize(summary: str, turns: List[Turn]) -> str:
+        from llm_pool import llm_pool
+
+        chain = llm_pool.chain(SUMMARY_PROMPT, model_name=model_name, temperature=0.0, max_tokens=max_tokens)
+        return chain.run(summary=summary or "(none)", new_lines="\n".join(turn.render() for turn in turns)).strip()
+
+    return summarize
+
+
+class RollingSummaryMemory:
+    """The last `max_turns` turns verbatim and a running summary of all older ones
+
+    Args:
+        model_name (str): The chat model, used for token counting and the default summarizer
+        max_turns (int, optional): Turns kept verbatim. Defaults to 3.
+        token_budget (int, optional): Tokens the rendered history may take up. Defaults to 600.
+        summary_tokens (int, optional): Tokens the summary may take up. Defaults to 250.
+        summarizer (Summarizer, optional): Folds turns into a summary. Defaults to an `llm_summarizer`.
+    """
+
+    def __init__(
+        self,
+        model_name: str,
+        max_turns: int = 3,
+        token_budget: int = 600,
+        summary_tokens: int = 250,
+        summarizer: Optional[Summarizer] = None,
+    ):
+        self.encoding = get_encoding(model_name)
+        self.max_turns = max_turns
+        self.token_budget = token_budget
+        self.summary_tokens = summary_tokens
+        self.summarizer = summarizer or llm_summarizer(model_name, summary_tokens)
+        self.summary = ""
+        self._turns: List[Turn] = []
+        # turns pushed out of the window that are not part of the summary yet
+        self._folding: List[Turn] = []
+        self._future: Optional[Future] = None
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    def _truncate(self, text: str, max_tokens: int, keep_end: bool = False) -> str:
+        tokens = self.encoding.encode(text, disallowed_special=())
+        if len(tokens) <= max_tokens:
+            return text
+        tokens = tokens[-max_tokens:] if keep_end else tokens[:max_tokens]
+        return self.encoding.decode(tokens)
+
+    def add_turn(self, question: str, answer: str):
+        """Record a finished turn; turns leaving the window are summarized in the background"""
+        with self._lock:
+            self._turns.append(Turn(question, answer))
+            if len(self._turns) > self.max_turns:
+                self._folding.extend(self._turns[: -self.max_turns])
+                del self._turns[: -self.max_turns]
+            self._schedule()
+
+    def _schedule(self):
+        # one summary at a time, each folds everything that piled up since the last one
+        if self._future is None and self._folding:
+            self._future = _executor.submit(self._fold, list(self._folding), self.summary, self._generation)
+
+    def _fold(self, turns: List[Turn], summary: str, generation: int):
+        try:
+            summary = self._truncate(self.summarizer(summary, turns), self.summary_tokens)
+        except Exception as e:
+            logger.warning(f"Summarizing {len(turns)} turns failed, keeping them verbatim: {e!r}")
+            with self._lock:
+                self._future = None
+            return
+        with self._lock:
+            self._future = None
+            if generation != self._generation:
+                # the memory was cleared while summarizing
+                self._schedule()
+                return
+            self.summary = summary
+            del self._folding[: len(turns)]
+            self._schedule()
+
+    def history(self) -> str:
+        """The summary and the turns not covered by it, within `token_budget` tokens
+
+        Turns still waiting to be summarized are included verbatim; the oldest turns are
+        dropped first when they do not fit.
+        """
+        with self._lock:
+            summary = self.summary
+            turns = self._folding + self._turns
+        parts = [f"Summary of the earlier conversation: {summary}"] if summary else []
+        budget = self.token_budget - sum(len(self.encoding.encode(part, disallowed_special=())) for part in parts)
+        recent: List[str] = []
+        for turn in reversed(turns):
+            text = turn.render()
+            n_tokens = len(self.encoding.encode(text, disallowed_special=()))
+            if n_tokens > budget:
+                if not recent and budget > 0:
+                    # the latest turn alone is too long, keep its end which the follow-up refers to
+                    recent.append(self._truncate(text, budget, keep_end=True))
+                break
+            recent.append(text)
+            budget -= n_tokens
+        return "\n".join(parts + recent[::-1])
+
+    def wait(self, timeout: Optional[float] = None):
+        """Block until pending summaries are done, e.g. in benchmarks"""
+        while True:
+            with self._lock:
+                future = self._future
+            if future is None:
+                return
+            future.result(timeout)
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self.summary = ""
+            self._turns.clear()
+            self._folding.clear()
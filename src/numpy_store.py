@@ -0,0 +1,311 @@
+"""A lightweight vector store backed by a memory-mapped float32 NumPy array
+
+A store directory holds `embeddings.npy`, one L2-normalised float32 row per chunk, and
+`documents.jsonl` with the text and metadata of each row in the same order. Opening a
+store maps the array instead of reading it, and top-k search is one matrix-vector
+product, which for the few hundred chunks of a video is much cheaper than opening a
+Chroma persist directory.
+
+With `quantization` set to float16 or int8 the vectors are persisted in that encoding
+instead (see `quantization`), which shrinks the files to a half or a quarter. Loaded
+quantized stores are scanned on the quantized vectors. With a `rerank_factor` the
+float32 vectors are also persisted as a sidecar `embeddings.npy`, and the
+`rerank_factor * k` best quantized candidates are re-ranked by their exact float32
+scores; only those rows of the memory-mapped sidecar are read, but it is uploaded and
+downloaded with the segment. Without it results can differ from the float32 store's;
+`benchmarks/bench_quantization.py` reports the recall of both.
+"""
+import json
+import logging
+import os
+import uuid
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+from langchain.docstore.document import Document
+from langchain.embeddings.base import Embeddings
+from langchain.vectorstores import Chroma
+from langchain.vectorstores.base import VectorStore
+
+from config import default_config
+from quantization import QUANTIZATIONS, blocked_scores, dequantize_int8, quantize_int8, top_k
+
+logger = logging.getLogger(__name__)
+
+EMBEDDINGS_FILE = "embeddings.npy"
+DOCUMENTS_FILE = "documents.jsonl"
+QUANTIZATION_FILE = "quantization.json"
+# the arrays persisted for each quantization, besides the documents
+QUANTIZED_FILES = {
+    "float32": {"float32": EMBEDDINGS_FILE},
+    "float16": {"float16": "embeddings.f16.npy"},
+    "int8": {"int8": "embeddings.int8.npy", "scales": "scales.npy"},
+}
+
+
+def is_numpy_store(path: str) -> bool:
+    # the documents are written last, after the vectors of any encoding
+    return os.path.exists(os.path.join(path, DOCUMENTS_FILE))
+
+
+def _normalize(vectors: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(vectors, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return vectors / norms
+
+
+class NumpyVectorStore(VectorStore):
+    """Vector store searching normalised embeddings with a vectorised dot product
+
+    Scores are returned as cosine distances (1 - cosine similarity) so that lower is
+    better, like the distances Chroma reports.
+
+    Args:
+        embedding_function (Embeddings): Embeds queries and added texts
+        persist_directory (str, optional): Where `persist` writes the store
+        quantization (str, optional): Encoding of the persisted vectors, one of `QUANTIZATIONS`. Defaults to "float32".
+        rerank_factor (int, optional): Quantized candidates per result re-ranked against a float32 sidecar, 0 writes
+            no sidecar. Defaults to config.vector_store_rerank_factor.
+    """
+
+    def __init__(
+        self,
+        embedding_function: Embeddings,
+        persist_directory: Optional[str] = None,
+        embeddings: Optional[np.ndarray] = None,
+        texts: Optional[List[str]] = None,
+        metadatas: Optional[List[dict]] = None,
+        quantization: str = "float32",
+        rerank_factor: Optional[int] = None,
+    ):
+        if quantization not in QUANTIZATIONS:
+            raise ValueError(f"Unknown quantization {quantization!r}, expected one of {QUANTIZATIONS}")
+        self.embedding_function = embedding_function
+        self.persist_directory = persist_directory
+        self.quantization = quantization
+        self.rerank_factor = default_config.vector_store_rerank_factor if rerank_factor is None else rerank_factor
+        self._embeddings = embeddings
+        # memory-mapped arrays of a loaded quantized store, searched without decoding
+        self._quantized: Dict[str, np.ndarray] = {}
+        self._pending: List[np.ndarray] = []
+        self.texts: List[str] = texts or []
+        self.metadatas: List[dict] = metadatas or []
+
+    @classmethod
+    def load(cls, persist_directory: str, embedding_function: Embeddings) -> "NumpyVectorStore":
+        """Open a store directory, memory-mapping its embeddings in their persisted encoding"""
+        try:
+            with open(os.path.join(persist_directory, QUANTIZATION_FILE), "r") as f:
+                meta = json.load(f)
+        except OSError:
+            meta = {"quantization": "float32"}
+        quantization = meta["quantization"]
+        if quantization not in QUANTIZED_FILES:
+            raise ValueError(f"{persist_directory} uses the unsupported {quantization!r} encoding, ingest it again")
+        arrays = {
+            name: np.load(os.path.join(persist_directory, file_name), mmap_mode="r")
+            for name, file_name in QUANTIZED_FILES[quantization].items()
+        }
+        rerank_factor = meta.get("rerank_factor", 0)
+        if quantization != "float32" and rerank_factor:
+            arrays["exact"] = np.load(os.path.join(persist_directory, EMBEDDINGS_FILE), mmap_mode="r")
+        texts, metadatas = [], []
+        with open(os.path.join(persist_directory, DOCUMENTS_FILE), "r") as f:
+            for line in f:
+                row = json.loads(line)
+                texts.append(row["text"])
+                metadatas.append(row["metadata"])
+        store = cls(
+            embedding_function,
+            persist_directory,
+            arrays.pop("float32", None),
+            texts,
+            metadatas,
+            quantization=quantization,
+            rerank_factor=rerank_factor,
+        )
+        store._quantized = arrays
+        return store
+
+    def _decode(self) -> np.ndarray:
+        if "exact" in self._quantized:
+            return np.asarray(self._quantized["exact"], dtype=np.float32)
+        if "float16" in self._quantized:
+            return np.asarray(self._quantized["float16"], dtype=np.float32)
+        return dequantize_int8(self._quantized["int8"], self._quantized["scales"])
+
+    @property
+    def embeddings(self) -> np.ndarray:
+        """All vectors as float32, decoding a quantized store in full"""
+        if self._embeddings is None and self._quantized:
+            self._embeddings = self._decode()
+        if self._pending:
+            parts = ([self._embeddings] if self._embeddings is not None else []) + self._pending
+            self._embeddings = np.concatenate(parts).astype(np.float32, copy=False)
+            self._pending = []
+        if self._embeddings is None:
+            return np.zeros((0, 0), dtype=np.float32)
+        return self._embeddings
+
+    def __len__(self) -> int:
+        return len(self.texts)
+
+    def add_embeddings(self, documents: List[Document], embeddings: List[List[float]]):
+        """Append already embedded documents, usable as an `EmbeddingPipeline` sink"""
+        if self._quantized:
+            # appending needs the decoded vectors, later searches use them as well
+            self.embeddings
+            self._quantized = {}
+        self._pending.append(_normalize(np.asarray(embeddings, dtype=np.float32)))
+        self.texts.extend(document.page_content for document in documents)
+        self.metadatas.extend(document.metadata or {} for document in documents)
+
+    def add_texts(self, texts: Iterable[str], metadatas: Optional[List[dict]] = None, **kwargs: Any) -> List[str]:
+        texts = list(texts)
+        metadatas = metadatas or [{} for _ in texts]
+        documents = [Document(page_content=text, metadata=metadata) for text, metadata in zip(texts, metadatas)]
+        self.add_embeddings(documents, self.embedding_function.embed_documents(texts))
+        return [str(uuid.uuid4()) for _ in texts]
+
+    @classmethod
+    def from_texts(
+        cls,
+        texts: List[str],
+        embedding: Embeddings,
+        metadatas: Optional[List[dict]] = None,
+        persist_directory: Optional[str] = None,
+        **kwargs: Any,
+    ) -> "NumpyVectorStore":
+        store = cls(embedding, persist_directory)
+        store.add_texts(texts, metadatas)
+        return store
+
+    def _encode(self, embeddings: np.ndarray) -> Tuple[str, Dict[str, np.ndarray], dict]:
+        quantization = self.quantization if len(embeddings) else "float32"
+        meta = {"quantization": quantization}
+        if quantization == "float32":
+            return quantization, {"float32": embeddings}, meta
+        if self.rerank_factor:
+            meta["rerank_factor"] = self.rerank_factor
+            arrays = {"exact": embeddings}
+        else:
+            arrays = {}
+        if quantization == "float16":
+            arrays["float16"] = embeddings.astype(np.float16)
+        else:
+            arrays["int8"], arrays["scales"] = quantize_int8(embeddings)
+        return quantization, arrays, meta
+
+    def persist(self):
+        """Write the store to `persist_directory`, replacing any previous files atomically"""
+        if self.persist_directory is None:
+            raise ValueError("NumpyVectorStore has no persist_directory")
+        os.makedirs(self.persist_directory, exist_ok=True)
+        embeddings = np.ascontiguousarray(self.embeddings, dtype=np.float32)
+        quantization, arrays, meta = self._encode(embeddings)
+        files = dict(QUANTIZED_FILES[quantization], exact=EMBEDDINGS_FILE)
+        written = []
+        for name, array in arrays.items():
+            path = os.path.join(self.persist_directory, files[name])
+            with open(path + ".tmp", "wb") as f:
+                np.save(f, array)
+            written.append(path)
+        meta_path = os.path.join(self.persist_directory, QUANTIZATION_FILE)
+        with open(meta_path + ".tmp", "w") as f:
+            json.dump(meta, f)
+        written.append(meta_path)
+        documents_path = os.path.join(self.persist_directory, DOCUMENTS_FILE)
+        with open(documents_path + ".tmp", "w") as f:
+            for text, metadata in zip(self.texts, self.metadatas):
+                f.write(json.dumps({"text": text, "metadata": metadata}) + "\n")
+        written.append(documents_path)
+        for path in written:
+            os.replace(path + ".tmp", path)
+        # drop the arrays of an encoding the store was persisted with before
+        stale = {name for files in QUANTIZED_FILES.values() for name in files.values()}
+        stale -= {files[name] for name in arrays}
+        for name in stale:
+            path = os.path.join(self.persist_directory, name)
+            if os.path.exists(path):
+                os.remove(path)
+
+    def _mask(self, filter: dict) -> np.ndarray:
+        return np.fromiter(
+            (all(metadata.get(key) == value for key, value in filter.items()) for metadata in self.metadatas),
+            dtype=bool,
+            count=len(self.metadatas),
+        )
+
+    def similarity_search_by_vector_with_score(
+        self, embedding: List[float], k: int = 4, filter: Optional[dict] = None
+    ) -> List[Tuple[Document, float]]:
+        if not len(self):
+            return []
+        query = _normalize(np.asarray(embedding, dtype=np.float32))
+        if self._quantized and not self._pending:
+            scores = self._quantized_scores(query)
+        else:
+            scores = self.embeddings @ query
+        if filter:
+            scores = np.where(self._mask(filter), scores, -np.inf)
+        if "exact" in self._quantized and not self._pending:
+            top, top_scores = self._rerank(scores, query, k)
+        else:
+            top = top_k(scores, k)
+            top_scores = scores[top]
+        return [
+            (Document(page_content=self.texts[i], metadata=self.metadatas[i]), float(1.0 - score))
+            for i, score in zip(top, top_scores)
+            if np.isfinite(score)
+        ]
+
+    def _quantized_scores(self, query: np.ndarray) -> np.ndarray:
+        if "float16" in self._quantized:
+            return blocked_scores(self._quantized["float16"], query)
+        return blocked_scores(self._quantized["int8"], query, self._quantized["scales"])
+
+    def _rerank(self, approximate: np.ndarray, query: np.ndarray, k: int) -> Tuple[np.ndarray, np.ndarray]:
+        candidates = top_k(approximate, k * self.rerank_factor)
+        # sorted rows read the memory-mapped sidecar front to back
+        candidates = np.sort(candidates[np.isfinite(approximate[candidates])])
+        scores = np.asarray(self._quantized["exact"][candidates], dtype=np.float32) @ query
+        order = top_k(scores, k)
+        return candidates[order], scores[order]
+
+    def similarity_search_with_score(
+        self, query: str, k: int = 4, filter: Optional[dict] = None, **kwargs: Any
+    ) -> List[Tuple[Document, float]]:
+        return self.similarity_search_by_vector_with_score(
+            self.embedding_function.embed_query(query), k=k, filter=filter
+        )
+
+    def similarity_search(self, query: str, k: int = 4, filter: Optional[dict] = None, **kwargs: Any) -> List[Document]:
+        return [document for document, _ in self.similarity_search_with_score(query, k=k, filter=filter)]
+
+    def similarity_search_by_vector(self, embedding: List[float], k: int = 4, **kwargs: Any) -> List[Document]:
+        return [document for document, _ in self.similarity_search_by_vector_with_score(embedding, k=k)]
+
+
+def convert_chroma(chroma_dir: str, output_dir: str, embedding_function: Embeddings = None) -> NumpyVectorStore:
+    """Convert a Chroma persist directory, e.g. a downloaded vector store artifact, to a NumPy store
+
+    Args:
+        chroma_dir (str): The Chroma persist directory
+        output_dir (str): The directory to write the NumPy store to
+        embedding_function (Embeddings, optional): Embeddings for queries against the result
+
+    Returns:
+        NumpyVectorStore: The converted store
+    """
+    collection = Chroma(embedding_function=embedding_function, persist_directory=chroma_dir)._collection
+    rows = collection.get(include=["embeddings", "documents", "metadatas"])
+    store = NumpyVectorStore(embedding_function, output_dir)
+    documents = [
+        Document(page_content=text, metadata=metadata or {})
+        for text, metadata in zip(rows["documents"], rows["metadatas"])
+    ]
+    if documents:
+        store.add_embeddings(documents, rows["embeddings"])
+    store.persist()
+    logger.info(f"Converted {len(documents)} chunks from {chroma_dir} to {output_dir}")
+    return store
@@ -0,0 +1,72 @@
+"""Compact encodings of normalised embeddings for the NumPy vector store
+
+- float16: half precision copies of the vectors
+- int8: symmetric 8-bit codes with one float32 scale per vector
+
+Scores of every encoding are computed block by block in float32, so a query never
+materialises a full float32 copy of the corpus. They are the final scores unless the
+store keeps a float32 sidecar to re-rank the best candidates, see `numpy_store`.
+"""
+import logging
+from typing import Tuple
+
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+QUANTIZATIONS = ("float32", "float16", "int8")
+
+# rows scored per step, keeps the float32 temporaries of a query small
+BLOCK_ROWS = 16384
+
+
+def quantize_int8(vectors: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+    """Symmetric int8 codes and the per-vector scales to decode them"""
+    scales = np.abs(vectors).max(axis=1) / 127.0
+    scales[scales == 0] = 1.0
+    codes = np.clip(np.rint(vectors / scales[:, None]), -127, 127).astype(np.int8)
+    return codes, scales.astype(np.float32)
+
+
+def dequantize_int8(codes: np.ndarray, scales: np.ndarray) -> np.ndarray:
+    return codes.astype(np.float32) * scales[:, None]
+
+
+def blocked_scores(vectors: np.ndarray, query: np.ndarray, scales: np.ndarray = None) -> np.ndarray:
+    """Dot products of `query` with float16, float32 or scaled int8 rows"""
+    scores = np.empty(len(vectors), dtype=np.float32)
+    for start in range(0, len(vectors), BLOCK_ROWS):
+        block = np.asarray(vectors[start : start + BLOCK_ROWS], dtype=np.float32)
+        scores[start : start + len(block)] = block @ query
+    if scales is not None:
+        scores *= scales
+    return scores
+
+
+def top_k(scores: np.ndarray, k: int) -> np.ndarray:
+    """Indices of the `k` highest scores, highest first"""
+    k = min(k, len(scores))
+    if k <= 0:
+        return np.zeros(0, dtype=np.int64)
+    top = np.argpartition(-scores, k - 1)[:k]
+    return top[np.argsort(-scores[top])]
+
+
+def kmeans(vectors: np.ndarray, n_centroids: int, iterations: int, rng: np.random.Generator) -> np.ndarray:
+    """Lloyd's k-means from `n_centroids` random vectors, returns the (n_centroids, dim) centroids"""
+    centroids = vectors[rng.choice(len(vectors), n_centroids, replace=False)].copy()
+    for _ in range(iterations):
+        distances = (
+            (vectors**2).sum(axis=1, keepdims=True) - 2 * vectors @ centroids.T + (centroids**2).sum(axis=1)
+        )
+        assignment = distances.argmin(axis=1)
+        counts = np.bincount(assignment, minlength=n_centroids)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignment, vectors)
+        filled = counts > 0
+        centroids[filled] = sums[filled] / counts[filled, None]
+        # re-seed empty clusters with random points
+        empty = np.flatnonzero(~filled)
+        if len(empty):
+            centroids[empty] = vectors[rng.choice(len(vectors), len(empty))]
+    return centroids
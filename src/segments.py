@@ -0,0 +1,400 @@
+"""Append-only segmented vector store layout and its Weights & Biases artifacts
+
+Every ingest run writes its chunks into a new, immutable segment (a Chroma or NumPy
+store, see `vector_store_backend`) under
+`<vector_store_dir>/segments/<segment id>`. Each segment is uploaded once as its own
+artifact, and the `vector_store_artifact` only carries a small `manifest.json` listing
+the segment artifacts, so a new version costs one segment upload and consumers only
+download the segments they have not seen before.
+"""
+import json
+import logging
+import os
+import threading
+import time
+import uuid
+from typing import Any, ContextManager, Dict, Iterable, List, Optional, Tuple
+
+import wandb
+from langchain.docstore.document import Document
+from langchain.embeddings.base import Embeddings
+from langchain.vectorstores import Chroma
+from langchain.vectorstores.base import VectorStore
+
+from bm25 import BM25Index, reciprocal_rank_fusion
+from embedding_pipeline import chroma_sink
+from numpy_store import NumpyVectorStore, convert_chroma, is_numpy_store
+
+logger = logging.getLogger(__name__)
+
+MANIFEST_FILE = "manifest.json"
+SEGMENTS_DIR = "segments"
+COMPLETE_MARKER = ".complete"
+BM25_DIR = "bm25"
+RETRIEVAL_MODES = ("vector", "bm25", "hybrid", "auto")
+
+# serialises manifest updates of the ingests of one process, see `log_segments`
+_manifest_lock = threading.Lock()
+
+
+def new_segment_dir(vector_store_dir: str) -> str:
+    """Create and return the directory of a new segment below `vector_store_dir`"""
+    segment_id = time.strftime("%Y%m%d%H%M%S") + "-" + uuid.uuid4().hex[:8]
+    segment_dir = os.path.join(vector_store_dir, SEGMENTS_DIR, segment_id)
+    os.makedirs(segment_dir)
+    return segment_dir
+
+
+class SegmentWriter:
+    """Fill a new segment from the embedding pipeline and persist it with its BM25 index
+
+    Embedded batches are written to the store as they arrive. With `buffered` they only
+    reach it on the next `persist` instead: Chroma writes its collection to disk when
+    the process exits, so chunks added straight away would outlive an interrupted
+    `ingest.ingest_batch` without being in its manifest, and be ingested again on
+    resume. The buffer then holds the batches since the last checkpoint.
+
+    Args:
+        vector_store_dir (str): The directory containing the `segments` subdirectory
+        embedding_function (Embeddings): The embedding function of the store
+        backend (str, optional): "chroma" or "numpy". Defaults to "chroma".
+        quantization (str, optional): Encoding of the vectors of a numpy segment. Defaults to "float32".
+        buffered (bool, optional): Hold embedded batches back until `persist`. Defaults to False.
+    """
+
+    def __init__(
+        self,
+        vector_store_dir: str,
+        embedding_function: Embeddings,
+        backend: str = "chroma",
+        quantization: str = "float32",
+        buffered: bool = False,
+    ):
+        self.segment_dir = new_segment_dir(vector_store_dir)
+        self.segment_id = os.path.basename(self.segment_dir)
+        self.bm25 = BM25Index()
+        if backend == "numpy":
+            self.vector_store = NumpyVectorStore(
+                embedding_function, persist_directory=self.segment_dir, quantization=quantization
+            )
+            self._sink = self.vector_store.add_embeddings
+        else:
+            self.vector_store = Chroma(embedding_function=embedding_function, persist_directory=self.segment_dir)
+            self._sink = chroma_sink(self.vector_store)
+        self.buffered = buffered
+        self._unpersisted: List[Tuple[List[Document], List[List[float]]]] = []
+
+    def sink(self, documents: List[Document], embeddings: List[List[float]]):
+        """`EmbeddingPipeline` sink writing (or buffering) batches for the store and adding them to the lexical index"""
+        if self.buffered:
+            self._unpersisted.append((documents, embeddings))
+        else:
+            self._sink(documents, embeddings)
+        self.bm25.add(documents)
+
+    def persist(self, lexical: bool = True):
+        """Write any buffered chunks to the store and persist it
+
+        Args:
+            lexical (bool, optional): Also compile and save the BM25 index, which rebuilds its postings over
+                all chunks. Checkpoints of a long ingest skip it and compile it once at the end; a segment
+                left without one gets an in-memory index when it is opened, see `build_bm25`.
+        """
+        for documents, embeddings in self._unpersisted:
+            self._sink(documents, embeddings)
+        self._unpersisted.clear()
+        self.vector_store.persist()
+        if lexical:
+            self.bm25.finalize()
+            self.bm25.save(os.path.join(self.segment_dir, BM25_DIR))
+
+
+def local_segments(vector_store_dir: str) -> List[str]:
+    """Ids of the segments written locally below `vector_store_dir`, oldest first"""
+    segments_dir = os.path.join(vector_store_dir, SEGMENTS_DIR)
+    if not os.path.isdir(segments_dir):
+        return []
+    return sorted(
+        name for name in os.listdir(segments_dir) if os.path.isdir(os.path.join(segments_dir, name))
+    )
+
+
+def read_manifest(artifact_dir: str) -> Optional[dict]:
+    """Read the segment manifest of a downloaded index artifact, None for a legacy single store"""
+    manifest_path = os.path.join(artifact_dir, MANIFEST_FILE)
+    if not os.path.exists(manifest_path):
+        return None
+    with open(manifest_path, "r") as f:
+        return json.load(f)
+
+
+def _previous_manifest(run: "wandb.run", index_artifact_name: str) -> dict:
+    try:
+        previous = run.use_artifact(f"{index_artifact_name}:latest")
+    except wandb.errors.CommError:
+        return {"segments": []}
+    manifest = read_manifest(previous.download())
+    if manifest is None:
+        # the previous version is a whole Chroma directory, keep it as the first segment
+        manifest = {
+            "segments": [
+                {"id": f"legacy-{previous.version}", "artifact": f"{index_artifact_name}:{previous.version}"}
+            ]
+        }
+    return manifest
+
+
+def log_segments(
+    vector_store_dir: str,
+    run: "wandb.run",
+    index_artifact_name: str = "vector_store_artifact",
+    segment_ids: Optional[Iterable[str]] = None,
+    manifest_lock: Optional[ContextManager] = None,
+):
+    """Upload segments that are not in the latest index version and log a new manifest
+
+    Segments are uploaded first; the manifest is then re-read, extended and logged
+    under `manifest_lock`, and the new version is waited for before the lock is
+    released, so concurrent ingests append to each other's manifests instead of
+    overwriting them.
+
+    Args:
+        vector_store_dir (str): The directory containing the `segments` subdirectory
+        run (wandb.run): The wandb run to log the artifacts to.
+        index_artifact_name (str, optional): Name of the manifest artifact. Defaults to "vector_store_artifact".
+        segment_ids (Iterable[str], optional): The finished segments to publish, the ones this ingest wrote.
+            Defaults to every local segment, only safe when no other ingest writes below `vector_store_dir`.
+        manifest_lock (ContextManager, optional): Held around the manifest update, shared by ingest processes
+            publishing to the same index. Defaults to a lock of this process.
+    """
+    known = {segment["id"] for segment in _previous_manifest(run, index_artifact_name)["segments"]}
+    logged = []
+    for segment_id in local_segments(vector_store_dir) if segment_ids is None else segment_ids:
+        if segment_id in known:
+            continue
+        segment_dir = os.path.join(vector_store_dir, SEGMENTS_DIR, segment_id)
+        segment_artifact = wandb.Artifact(name=f"vector_store_segment-{segment_id}", type="search_index_segment")
+        segment_artifact.add_dir(segment_dir)
+        run.log_artifact(segment_artifact)
+        # pin the version, a later upload of the same segment id must not change what the manifest points to
+        segment_artifact.wait()
+        logged.append(
+            {
+                "id": segment_id,
+                "artifact": f"vector_store_segment-{segment_id}:{segment_artifact.version}",
+                "created": time.time(),
+            }
+        )
+        logger.info(f"Logged new segment {segment_id}")
+
+    with manifest_lock or _manifest_lock:
+        # another ingest may have published since the manifest was read above
+        manifest = _previous_manifest(run, index_artifact_name)
+        known = {segment["id"] for segment in manifest["segments"]}
+        manifest["segments"].extend(segment for segment in logged if segment["id"] not in known)
+        index_artifact = wandb.Artifact(name=index_artifact_name, type="search_index")
+        with index_artifact.new_file(MANIFEST_FILE) as f:
+            f.write(json.dumps(manifest))
+        run.log_artifact(index_artifact)
+        # the next ingest taking the lock must read this version as :latest
+        index_artifact.wait()
+
+
+def open_segment(segment_dir: str, embedding_function: Embeddings, backend: str = "chroma") -> VectorStore:
+    """Open a segment directory with the backend it was written with
+
+    With `backend="numpy"` Chroma segments are converted once into a `numpy`
+    subdirectory and opened from there.
+    """
+    if is_numpy_store(segment_dir):
+        return NumpyVectorStore.load(segment_dir, embedding_function)
+    if backend == "numpy":
+        numpy_dir = os.path.join(segment_dir, "numpy")
+        if not is_numpy_store(numpy_dir):
+            convert_chroma(segment_dir, numpy_dir, embedding_function)
+        return NumpyVectorStore.load(numpy_dir, embedding_function)
+    return Chroma(embedding_function=embedding_function, persist_directory=segment_dir)
+
+
+def build_bm25(segment: VectorStore) -> BM25Index:
+    """Build a lexical index in memory for a segment written without one"""
+    if isinstance(segment, NumpyVectorStore):
+        texts, metadatas = segment.texts, segment.metadatas
+    else:
+        rows = segment._collection.get(include=["documents", "metadatas"])
+        texts, metadatas = rows["documents"], rows["metadatas"]
+    return BM25Index.build(
+        [Document(page_content=text, metadata=metadata or {}) for text, metadata in zip(texts, metadatas)]
+    )
+
+
+def search_segment(
+    segment: VectorStore, embedding: List[float], k: int, filter: Optional[dict] = None
+) -> List[Tuple[Document, float]]:
+    """Top-k (document, cosine distance) pairs of one segment for an already embedded query
+
+    Chroma collections default to squared L2 distance, which is `2 - 2 cos` for the
+    unit-length OpenAI embeddings; it is halved so hits of Chroma and NumPy segments
+    are merged on the same scale.
+    """
+    if isinstance(segment, NumpyVectorStore):
+        return segment.similarity_search_by_vector_with_score(embedding, k=k, filter=filter)
+    n_results = min(k, segment._collection.count())
+    if n_results == 0:
+        return []
+    result = segment._collection.query(query_embeddings=[embedding], n_results=n_results, where=filter)
+    # "cosine" and "ip" collections already return 1 - cos for unit vectors
+    scale = 0.5 if (segment._collection.metadata or {}).get("hnsw:space", "l2") == "l2" else 1.0
+    return [
+        (Document(page_content=text, metadata=metadata or {}), distance * scale)
+        for text, metadata, distance in zip(
+            result["documents"][0], result["metadatas"][0], result["distances"][0]
+        )
+    ]
+
+
+class SegmentedVectorStore(VectorStore):
+    """Read-only vector store answering queries across several segments
+
+    `similarity_search` retrieves according to `retrieval_mode`:
+
+    - "vector": the query is embedded once, searched in every segment and the hits
+      are merged by cosine distance
+    - "bm25": only the local BM25 indexes are searched, no embedding call is made
+    - "hybrid": vector and BM25 rankings are merged by reciprocal rank fusion
+    - "auto": BM25 results are used alone when the best one covers the query terms
+      with at least `bm25_confidence`, otherwise falls back to "hybrid"
+    """
+
+    def __init__(
+        self,
+        segments: Dict[str, VectorStore],
+        embedding_function: Embeddings,
+        lexical: Optional[Dict[str, BM25Index]] = None,
+        retrieval_mode: str = "vector",
+        bm25_confidence: float = 0.6,
+    ):
+        if retrieval_mode not in RETRIEVAL_MODES:
+            raise ValueError(f"retrieval_mode must be one of {RETRIEVAL_MODES}, got {retrieval_mode!r}")
+        self.segments = segments
+        self.embedding_function = embedding_function
+        self.lexical = lexical or {}
+        self.retrieval_mode = retrieval_mode
+        self.bm25_confidence = bm25_confidence
+
+    def add_texts(self, texts: Iterable[str], metadatas: Optional[List[dict]] = None, **kwargs: Any) -> List[str]:
+        raise NotImplementedError("Segments are immutable, ingest a new segment instead")
+
+    @classmethod
+    def from_texts(cls, texts: List[str], embedding: Embeddings, metadatas: Optional[List[dict]] = None, **kwargs: Any):
+        raise NotImplementedError("Build segments with ingest.create_vector_store")
+
+    def similarity_search_by_vector_with_score(
+        self, embedding: List[float], k: int = 4, filter: Optional[dict] = None
+    ) -> List[Tuple[Document, float]]:
+        hits = []
+        for segment in self.segments.values():
+            hits.extend(search_segment(segment, embedding, k, filter))
+        hits.sort(key=lambda hit: hit[1])
+        return hits[:k]
+
+    def similarity_search_with_score(
+        self, query: str, k: int = 4, filter: Optional[dict] = None, **kwargs: Any
+    ) -> List[Tuple[Document, float]]:
+        return self.similarity_search_by_vector_with_score(
+            self.embedding_function.embed_query(query), k=k, filter=filter
+        )
+
+    def lexical_search(self, query: str, k: int = 4, filter: Optional[dict] = None) -> List[Tuple[Document, float]]:
+        """Top-k (document, confidence) pairs from the BM25 indexes of all segments"""
+        hits = []
+        for index in self.lexical.values():
+            hits.extend((document, confidence) for document, _, confidence in index.search(query, k, filter))
+        hits.sort(key=lambda hit: hit[1], reverse=True)
+        return hits[:k]
+
+    def similarity_search(
+        self, query: str, k: int = 4, filter: Optional[dict] = None, mode: Optional[str] = None, **kwargs: Any
+    ) -> List[Document]:
+        mode = mode or self.retrieval_mode
+        if mode == "vector" or not self.lexical:
+            return [document for document, _ in self.similarity_search_with_score(query, k=k, filter=filter)]
+
+        lexical = self.lexical_search(query, k=k, filter=filter)
+        if mode == "bm25" or (mode == "auto" and lexical and lexical[0][1] >= self.bm25_confidence):
+            return [document for document, _ in lexical]
+
+        vector = [document for document, _ in self.similarity_search_with_score(query, k=k, filter=filter)]
+        return reciprocal_rank_fusion([vector, [document for document, _ in lexical]])[:k]
+
+
+class SegmentLoader:
+    """Fetch and open the segments listed in index manifests, reusing those already present
+
+    Downloaded segments are kept in `cache_dir` across processes and open segments are
+    kept in memory, so a new manifest version only costs its new segments.
+    """
+
+    def __init__(
+        self,
+        cache_dir: str,
+        backend: str = "chroma",
+        retrieval_mode: str = "vector",
+        bm25_confidence: float = 0.6,
+    ):
+        self.cache_dir = cache_dir
+        self.backend = backend
+        self.retrieval_mode = retrieval_mode
+        self.bm25_confidence = bm25_confidence
+        self._open: Dict[str, VectorStore] = {}
+        self._lexical: Dict[str, BM25Index] = {}
+        self._lock = threading.Lock()
+
+    def _open_segment(self, segment_id: str, segment_dir: str, embedding_function: Embeddings):
+        if segment_id in self._open:
+            return
+        self._open[segment_id] = open_segment(segment_dir, embedding_function, self.backend)
+        if self.retrieval_mode != "vector":
+            bm25 = BM25Index.load(os.path.join(segment_dir, BM25_DIR))
+            self._lexical[segment_id] = bm25 or build_bm25(self._open[segment_id])
+
+    def _fetch(self, wandb_run: wandb.run, segment: dict) -> str:
+        segment_dir = os.path.join(self.cache_dir, segment["id"])
+        if not os.path.exists(os.path.join(segment_dir, COMPLETE_MARKER)):
+            logger.info(f"Downloading segment {segment['id']}")
+            wandb_run.use_artifact(segment["artifact"]).download(root=segment_dir)
+            open(os.path.join(segment_dir, COMPLETE_MARKER), "w").close()
+        return segment_dir
+
+    def load(self, wandb_run: wandb.run, artifact_dir: str, embedding_function: Embeddings) -> VectorStore:
+        """Open the store described by a downloaded index artifact
+
+        Args:
+            wandb_run (wandb.run): An active Weights & Biases run used to fetch missing segments
+            artifact_dir (str): The downloaded `vector_store_artifact` directory
+            embedding_function (Embeddings): The embedding function for queries
+
+        Returns:
+            SegmentedVectorStore: A store over all segments, a single one for legacy artifacts
+        """
+        manifest = read_manifest(artifact_dir)
+        with self._lock:
+            if manifest is None:
+                segment_ids = [artifact_dir]
+                self._open_segment(artifact_dir, artifact_dir, embedding_function)
+            else:
+                segment_ids = [segment["id"] for segment in manifest["segments"]]
+                for segment in manifest["segments"]:
+                    if segment["id"] not in self._open:
+                        self._open_segment(segment["id"], self._fetch(wandb_run, segment), embedding_function)
+            segments = {segment_id: self._open[segment_id] for segment_id in segment_ids}
+            lexical = {
+                segment_id: self._lexical[segment_id] for segment_id in segment_ids if segment_id in self._lexical
+            }
+        return SegmentedVectorStore(
+            segments,
+            embedding_function,
+            lexical=lexical,
+            retrieval_mode=self.retrieval_mode,
+            bm25_confidence=self.bm25_confidence,
+        )
@@ -0,0 +1,344 @@
+"""Asyncio HTTP API serving the retrieval and generation chain to other services
+
+Endpoints:
+
+- `POST /ask` with `{"question": ..., "bypass_cache": false}` returns `{"answer": ...}`;
+  with `"corpus": true` the question is answered from the sharded corpus of all videos
+  (see `shards`), and a `"video_id"` restricts the corpus to that video's shard
+- `POST /ingest` with `{"video_url": ...}` queues a background ingest job
+- `GET /ingest/{job_id}` returns the state of an ingest job
+- `GET /health` returns liveness and serving counters
+
+One W&B run, vector store, answer cache and ingest job queue are shared by all
+requests of a process. Identical questions in flight at the same time are answered
+once (singleflight), and each client, identified by its `X-Client-Id` header or
+address, may only have `client_concurrency` requests in flight; further requests are
+rejected with 429 instead of queueing behind it.
+"""
+import argparse
+import asyncio
+import dataclasses
+import logging
+import multiprocessing
+import os
+import time
+from collections import defaultdict
+from typing import Awaitable, Callable, Dict, Hashable, Optional, Tuple, TypeVar
+
+from aiohttp import web
+
+from dotenv import find_dotenv, load_dotenv
+from config import default_config
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+
+
+class Singleflight:
+    """Run one call per key at a time and hand its result to every concurrent caller"""
+
+    def __init__(self):
+        self._calls: Dict[Hashable, asyncio.Future] = {}
+        self.calls = 0
+        self.shared = 0
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[T]]) -> Tuple[T, bool]:
+        """Await `fn()`, or the call already running for `key`
+
+        Returns:
+            Tuple[T, bool]: The result and whether it was shared with an earlier caller
+        """
+        future = self._calls.get(key)
+        shared = future is not None
+        if shared:
+            self.shared += 1
+        else:
+            self.calls += 1
+            future = asyncio.ensure_future(fn())
+            self._calls[key] = future
+            future.add_done_callback(lambda done: self._calls.pop(key, None))
+        # a caller that disconnects must not cancel the call for everyone else
+        return await asyncio.shield(future), shared
+
+    def __len__(self) -> int:
+        return len(self._calls)
+
+
+class ClientLimiter:
+    """Non-blocking per-client cap on requests in flight"""
+
+    def __init__(self, max_in_flight: int):
+        self.max_in_flight = max_in_flight
+        self._in_flight: Dict[str, int] = defaultdict(int)
+        self.rejected = 0
+
+    def try_acquire(self, client: str) -> bool:
+        if self._in_flight[client] >= self.max_in_flight:
+            self.rejected += 1
+            return False
+        self._in_flight[client] += 1
+        return True
+
+    def release(self, client: str):
+        self._in_flight[client] -= 1
+        if not self._in_flight[client]:
+            del self._in_flight[client]
+
+    @property
+    def in_flight(self) -> int:
+        return sum(self._in_flight.values())
+
+
+class ChatService:
+    """The question answering path of the app, shared by all requests of a process
+
+    Args:
+        wandb_run (wandb.run): The run the vector store and prompt artifacts are read from
+        openai_api_key (str): The OpenAI API key
+    """
+
+    def __init__(self, wandb_run, openai_api_key: Optional[str]):
+        from answer_cache import AnswerCache
+        from embedding_cache import cached_openai_embeddings
+
+        self.run = wandb_run
+        self.openai_api_key = openai_api_key
+        # one embeddings client for the answer cache and the stores' queries
+        self.embeddings = cached_openai_embeddings(openai_api_key=openai_api_key)
+        self.answer_cache = AnswerCache(
+            self.embeddings,
+            similarity_threshold=default_config.answer_cache_threshold,
+            ttl=default_config.answer_cache_ttl,
+            max_entries=default_config.answer_cache_max_entries,
+        )
+
+    async def answer(
+        self, question: str, bypass_cache: bool = False, corpus: bool = False, video_id: Optional[str] = None
+    ) -> str:
+        from chains import answer_cache_namespace, load_chain, load_corpus_store, load_vector_store
+        from tracing import increment, span, tracer
+
+        with tracer.trace("question"):
+            # artifact checks, retrieval and cache lookups block, so they run on the
+            # default executor; the chat completion itself is awaited
+            if corpus:
+                vector_store = await asyncio.to_thread(
+                    load_corpus_store, self.openai_api_key, embeddings=self.embeddings
+                )
+                namespace = await asyncio.to_thread(answer_cache_namespace, self.run, vector_store, video_id)
+            else:
+                vector_store = await asyncio.to_thread(
+                    load_vector_store,
+                    wandb_run=self.run,
+                    openai_api_key=self.openai_api_key,
+                    embeddings=self.embeddings,
+                )
+                namespace = await asyncio.to_thread(answer_cache_namespace, self.run, None, video_id)
+            with span("answer_cache"):
+                response = await asyncio.to_thread(self.answer_cache.get, namespace, question, bypass_cache)
+            increment("answer_cache_hits", response is not None)
+            if response is not None:
+                return response
+            chain, docs_pages = await asyncio.to_thread(
+                load_chain,
+                question=question,
+                db=vector_store,
+                wandb_run=self.run,
+                vector_store=vector_store,
+                openai_api_key=self.openai_api_key,
+                filter={"source": video_id} if video_id else None,
+            )
+            with span("generation"):
+                response = await chain.arun(question=question, docs=docs_pages)
+            response = response.replace("\n", "")
+            await asyncio.to_thread(self.answer_cache.put, namespace, question, response)
+            return response
+
+
+def client_id(request: web.Request) -> str:
+    return request.headers.get("X-Client-Id") or request.remote or "unknown"
+
+
+def create_app(
+    wandb_run,
+    openai_api_key: Optional[str] = None,
+    client_concurrency: int = default_config.server_client_concurrency,
+) -> web.Application:
+    """Build the API application around one shared chat service
+
+    Args:
+        wandb_run (wandb.run): The run the artifacts are read from
+        openai_api_key (str, optional): The OpenAI API key. Defaults to OPENAI_API_KEY.
+        client_concurrency (int, optional): Requests one client may have in flight. Defaults to config.
+
+    Returns:
+        web.Application: The application, run it with `web.run_app`
+    """
+    from answer_cache import normalize_question
+    from llm_pool import llm_pool
+    from transcripts import canonical_video_id
+
+    service = ChatService(wandb_run, openai_api_key)
+    singleflight = Singleflight()
+    limiter = ClientLimiter(client_concurrency)
+    job_queue = None
+    started = time.time()
+
+    @web.middleware
+    async def limit_clients(request: web.Request, handler):
+        if request.path == "/health":
+            return await handler(request)
+        client = client_id(request)
+        if not limiter.try_acquire(client):
+            return web.json_response(
+                {"error": f"more than {limiter.max_in_flight} requests in flight"}, status=429
+            )
+        try:
+            return await handler(request)
+        finally:
+            limiter.release(client)
+
+    async def read_json(request: web.Request) -> dict:
+        try:
+            body = await request.json()
+        except ValueError:
+            raise web.HTTPBadRequest(text="request body must be JSON")
+        if not isinstance(body, dict):
+            raise web.HTTPBadRequest(text="request body must be a JSON object")
+        return body
+
+    async def ask(request: web.Request) -> web.Response:
+        body = await read_json(request)
+        question = body.get("question")
+        if not isinstance(question, str) or not question.strip():
+            raise web.HTTPBadRequest(text="question must be a non-empty string")
+        bypass_cache = bool(body.get("bypass_cache", False))
+        video_id = body.get("video_id")
+        if video_id is not None:
+            try:
+                video_id = canonical_video_id(str(video_id))
+            except ValueError as e:
+                raise web.HTTPBadRequest(text=str(e))
+        corpus = bool(body.get("corpus", False)) or video_id is not None
+        key = (normalize_question(question), bypass_cache, corpus, video_id)
+        answer, shared = await singleflight.do(
+            key, lambda: service.answer(question, bypass_cache, corpus=corpus, video_id=video_id)
+        )
+        return web.json_response({"answer": answer, "coalesced": shared})
+
+    def get_job_queue():
+        nonlocal job_queue
+        if job_queue is None:
+            from jobs import JobQueue
+
+            job_queue = JobQueue(
+                max_workers=default_config.ingest_max_concurrency, max_history=default_config.ingest_job_history
+            )
+        return job_queue
+
+    async def ingest(request: web.Request) -> web.Response:
+        body = await read_json(request)
+        video_url = body.get("video_url")
+        if not isinstance(video_url, str):
+            raise web.HTTPBadRequest(text="video_url must be a string")
+        try:
+            job = await asyncio.to_thread(get_job_queue().submit, video_url)
+        except ValueError as e:
+            raise web.HTTPBadRequest(text=str(e))
+        return web.json_response(dataclasses.asdict(job), status=202)
+
+    async def ingest_status(request: web.Request) -> web.Response:
+        job = job_queue.get(request.match_info["job_id"]) if job_queue is not None else None
+        if job is None:
+            raise web.HTTPNotFound(text="unknown job id")
+        return web.json_response(dict(dataclasses.asdict(job), progress=job.progress))
+
+    async def health(request: web.Request) -> web.Response:
+        return web.json_response(
+            {
+                "status": "ok",
+                "pid": os.getpid(),
+                "uptime": time.time() - started,
+                "cpu_seconds": time.process_time(),
+                "in_flight": limiter.in_flight,
+                "rejected": limiter.rejected,
+                "answered": singleflight.calls,
+                "coalesced": singleflight.shared,
+                "answer_cache": service.answer_cache.stats(),
+                "llm_pool": llm_pool.stats(),
+            }
+        )
+
+    async def shutdown(app: web.Application):
+        from tracing import tracer
+
+        if job_queue is not None:
+            job_queue.shutdown()
+        tracer.flush()
+
+    app = web.Application(middlewares=[limit_clients])
+    app.add_routes(
+        [
+            web.post("/ask", ask),
+            web.post("/ingest", ingest),
+            web.get("/ingest/{job_id}", ingest_status),
+            web.get("/health", health),
+        ]
+    )
+    app.on_shutdown.append(shutdown)
+    return app
+
+
+def get_parser():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--host", type=str, default="0.0.0.0", help="The interface to listen on")
+    parser.add_argument("--port", type=int, default=8080, help="The port to listen on")
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=1,
+        help="Server processes sharing the port, one per core for the best throughput",
+    )
+    parser.add_argument(
+        "--client_concurrency",
+        type=int,
+        default=default_config.server_client_concurrency,
+        help="The number of requests one client may have in flight",
+    )
+    parser.add_argument(
+        "--wandb_project",
+        default="ytchat",
+        type=str,
+        help="The wandb project the artifacts are read from",
+    )
+    return parser
+
+
+def serve(args):
+    import wandb
+    from tracing import tracer
+
+    load_dotenv(find_dotenv())
+    run = wandb.init(project=args.wandb_project, job_type="serving", config=vars(default_config))
+    tracer.configure(run=run, enabled=default_config.tracing_enabled, sample_rate=default_config.trace_sample_rate)
+    app = create_app(run, os.getenv("OPENAI_API_KEY"), args.client_concurrency)
+    # with several workers the kernel spreads connections over the processes
+    web.run_app(app, host=args.host, port=args.port, reuse_port=args.workers > 1)
+
+
+def main():
+    logging.basicConfig(level=logging.INFO)
+    args = get_parser().parse_args()
+    if args.workers <= 1:
+        serve(args)
+        return
+    workers = [multiprocessing.Process(target=serve, args=(args,)) for _ in range(args.workers)]
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,473 @@
+"""Corpus-level search across thousands of videos, sharded by video over worker processes
+
+`build_corpus` regroups the chunks of all segments by video into `n_shards` shards
+under `<corpus_dir>/versions/<version>/shards/<n>`, each with an IVF index (see `ivf`).
+A video's chunks always land in one shard: with `sharding="video"` videos are spread to
+balance the shard sizes, with `sharding="hash"` a video's shard is a hash of its id.
+The version's `corpus.json` records which shard holds which video. Every build writes
+a new version and then atomically points `<corpus_dir>/current` at it, so searchers
+never see a half-written corpus.
+
+`ShardedSearcher` serves every shard from its own process (or thread, with
+`processes=False`). A query is scattered to the shards, each returns its approximate
+top-k, and the per-shard results are merged into the global top-k. Queries filtered to
+some videos are only sent to the shards holding them and are answered exactly from
+those videos' chunks.
+"""
+import argparse
+import heapq
+import json
+import logging
+import math
+import multiprocessing
+import os
+import shutil
+import threading
+import time
+import uuid
+import zlib
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Dict, Iterable, List, Optional, Sequence, Tuple
+
+import numpy as np
+from langchain.docstore.document import Document
+from langchain.embeddings.base import Embeddings
+from langchain.vectorstores.base import VectorStore
+
+from config import default_config
+from ivf import IVFIndex
+from numpy_store import DOCUMENTS_FILE, NumpyVectorStore, _normalize
+from transcripts import canonical_video_id
+
+logger = logging.getLogger(__name__)
+
+CORPUS_FILE = "corpus.json"
+CURRENT_FILE = "current"
+SHARD_FILE = "shard.json"
+SHARDS_DIR = "shards"
+VERSIONS_DIR = "versions"
+SHARDINGS = ("video", "hash")
+
+# (cosine distance, text, metadata) as returned by a shard
+Hit = Tuple[float, str, dict]
+
+
+def chunk_video_id(metadata: dict) -> str:
+    """The video a chunk belongs to, from its `source` metadata"""
+    source = metadata.get("source") or ""
+    try:
+        return canonical_video_id(source)
+    except ValueError:
+        return source
+
+
+def assign_shards(video_sizes: Dict[str, int], n_shards: int, sharding: str = "video") -> Dict[str, int]:
+    """The shard of every video
+
+    Args:
+        video_sizes (Dict[str, int]): Chunks per video
+        n_shards (int): Number of shards
+        sharding (str, optional): "video" places the largest videos first on the least loaded shard,
+            "hash" uses a hash of the video id. Defaults to "video".
+    """
+    if sharding not in SHARDINGS:
+        raise ValueError(f"sharding must be one of {SHARDINGS}, got {sharding!r}")
+    if sharding == "hash":
+        return {video_id: zlib.crc32(video_id.encode("utf-8")) % n_shards for video_id in video_sizes}
+    loads = [(0, shard) for shard in range(n_shards)]
+    assignment = {}
+    for video_id, size in sorted(video_sizes.items(), key=lambda item: (-item[1], item[0])):
+        load, shard = heapq.heappop(loads)
+        assignment[video_id] = shard
+        heapq.heappush(loads, (load + size, shard))
+    return assignment
+
+
+def corpus_version(corpus_dir: str) -> Optional[str]:
+    """The version `<corpus_dir>/current` points at, None for a corpus built before versioning"""
+    try:
+        with open(os.path.join(corpus_dir, CURRENT_FILE), "r") as f:
+            return f.read().strip()
+    except FileNotFoundError:
+        return None
+
+
+def version_dir(corpus_dir: str, version: Optional[str]) -> str:
+    """Where the shards and `corpus.json` of a corpus version live"""
+    return corpus_dir if version is None else os.path.join(corpus_dir, VERSIONS_DIR, version)
+
+
+def build_corpus(
+    stores: Sequence[NumpyVectorStore],
+    corpus_dir: str,
+    n_shards: int = default_config.corpus_shards,
+    sharding: str = default_config.corpus_sharding,
+    n_lists: Optional[int] = None,
+) -> dict:
+    """Regroup the chunks of `stores` by video into IVF-indexed shards
+
+    Only one shard's vectors are gathered in memory at a time. The corpus is written
+    as a new version and made current once complete; the version before it is kept for
+    searchers still starting from it, older ones are deleted.
+
+    Args:
+        stores (Sequence[NumpyVectorStore]): The segments of the index, e.g. from `open_segments`
+        corpus_dir (str): The corpus directory, see the module docstring
+        n_shards (int, optional): Number of shards. Defaults to config.corpus_shards.
+        sharding (str, optional): "video" or "hash", see `assign_shards`. Defaults to config.corpus_sharding.
+        n_lists (int, optional): IVF lists per shard. Defaults to about sqrt(shard size).
+
+    Returns:
+        dict: The corpus metadata written to `corpus.json`, its "version" is now current
+    """
+    version = f"{time.strftime('%Y%m%d-%H%M%S')}-{uuid.uuid4().hex[:8]}"
+    output_dir = version_dir(corpus_dir, version)
+    # (store, row) locations of every video's chunks, in ingest order
+    locations: Dict[str, List[Tuple[int, int]]] = {}
+    for store_index, store in enumerate(stores):
+        for row, metadata in enumerate(store.metadatas):
+            locations.setdefault(chunk_video_id(metadata), []).append((store_index, row))
+    videos = assign_shards({video_id: len(rows) for video_id, rows in locations.items()}, n_shards, sharding)
+    dim = next((store.embeddings.shape[1] for store in stores if len(store)), 0)
+
+    for shard in range(n_shards):
+        shard_dir = os.path.join(output_dir, SHARDS_DIR, str(shard))
+        os.makedirs(shard_dir, exist_ok=True)
+        ranges: Dict[str, List[int]] = {}
+        shard_rows: List[Tuple[int, int]] = []
+        with open(os.path.join(shard_dir, DOCUMENTS_FILE), "w") as f:
+            for video_id in sorted(video_id for video_id, assigned in videos.items() if assigned == shard):
+                rows = locations[video_id]
+                for store_index, row in rows:
+                    store = stores[store_index]
+                    f.write(json.dumps({"text": store.texts[row], "metadata": store.metadatas[row]}) + "\n")
+                ranges[video_id] = [len(shard_rows), len(shard_rows) + len(rows)]
+                shard_rows.extend(rows)
+        # gather the shard's vectors store by store rather than row by row
+        vectors = np.zeros((len(shard_rows), dim), dtype=np.float32)
+        if shard_rows:
+            store_indices, rows = np.asarray(shard_rows).T
+            for store_index in np.unique(store_indices):
+                mask = store_indices == store_index
+                vectors[mask] = stores[store_index].embeddings[rows[mask]]
+        IVFIndex.build(vectors, n_lists=n_lists).save(shard_dir)
+        with open(os.path.join(shard_dir, SHARD_FILE), "w") as f:
+            json.dump({"videos": ranges}, f)
+        logger.info(f"Wrote shard {shard} with {len(ranges)} videos and {len(vectors)} chunks")
+
+    meta = {
+        "version": version,
+        "shards": n_shards,
+        "sharding": sharding,
+        "chunks": sum(len(rows) for rows in locations.values()),
+        "dim": dim,
+        "created": time.time(),
+        "videos": videos,
+    }
+    with open(os.path.join(output_dir, CORPUS_FILE), "w") as f:
+        json.dump(meta, f)
+
+    previous = corpus_version(corpus_dir)
+    pointer = os.path.join(corpus_dir, f"{CURRENT_FILE}.{version}.tmp")
+    with open(pointer, "w") as f:
+        f.write(version)
+    os.replace(pointer, os.path.join(corpus_dir, CURRENT_FILE))
+    logger.info(f"Corpus version {version} is current")
+    for old in os.listdir(os.path.join(corpus_dir, VERSIONS_DIR)):
+        if old not in (version, previous):
+            shutil.rmtree(os.path.join(corpus_dir, VERSIONS_DIR, old), ignore_errors=True)
+    return meta
+
+
+def open_segments(vector_store_dir: str) -> List[NumpyVectorStore]:
+    """The local segments below `vector_store_dir` as NumPy stores, converting Chroma segments once"""
+    from segments import SEGMENTS_DIR, local_segments, open_segment
+
+    return [
+        open_segment(os.path.join(vector_store_dir, SEGMENTS_DIR, segment_id), None, backend="numpy")
+        for segment_id in local_segments(vector_store_dir)
+    ]
+
+
+class Shard:
+    """One shard's IVF index and documents"""
+
+    def __init__(self, shard_dir: str):
+        self.index = IVFIndex.load(shard_dir)
+        with open(os.path.join(shard_dir, SHARD_FILE), "r") as f:
+            self.videos: Dict[str, List[int]] = json.load(f)["videos"]
+        self.texts: List[str] = []
+        self.metadatas: List[dict] = []
+        with open(os.path.join(shard_dir, DOCUMENTS_FILE), "r") as f:
+            for line in f:
+                row = json.loads(line)
+                self.texts.append(row["text"])
+                self.metadatas.append(row["metadata"])
+
+    def __len__(self) -> int:
+        return len(self.texts)
+
+    def search(
+        self, query: np.ndarray, k: int, nprobe: int, video_ids: Optional[Sequence[str]] = None
+    ) -> List[Hit]:
+        if video_ids is None:
+            rows, scores = self.index.search(query, k, nprobe)
+        else:
+            ranges = [self.videos[video_id] for video_id in video_ids if video_id in self.videos]
+            if not ranges:
+                return []
+            # a few videos' chunks are cheaper to score exactly than to probe lists for
+            rows, scores = self.index.exact(query, k, np.concatenate([np.arange(*r) for r in ranges]))
+        return [(float(1.0 - score), self.texts[row], self.metadatas[row]) for row, score in zip(rows, scores)]
+
+
+def _serve_shard(shard_dir: str, conn):
+    shard = Shard(shard_dir)
+    conn.send(len(shard))
+    while True:
+        request = conn.recv()
+        if request is None:
+            break
+        try:
+            conn.send(shard.search(*request))
+        except Exception as e:
+            conn.send(e)
+    conn.close()
+
+
+class ShardedSearcher:
+    """Scatter queries to the shards of a corpus and merge their top-k
+
+    The searcher serves the version that was current when it was opened, see `version`.
+    If a shard worker dies the searcher is broken and every later search raises;
+    open a new one.
+
+    Args:
+        corpus_dir (str): A directory written by `build_corpus`
+        nprobe (int, optional): IVF lists a single-shard corpus would scan, see `shard_nprobe`.
+            Defaults to config.corpus_nprobe.
+        processes (bool, optional): Serve each shard from its own process rather than a thread. Defaults to True.
+    """
+
+    def __init__(self, corpus_dir: str, nprobe: int = default_config.corpus_nprobe, processes: bool = True):
+        self.version = corpus_version(corpus_dir)
+        root = version_dir(corpus_dir, self.version)
+        with open(os.path.join(root, CORPUS_FILE), "r") as f:
+            self.meta = json.load(f)
+        self.corpus_dir = corpus_dir
+        self.nprobe = nprobe
+        self.processes = processes
+        self.videos: Dict[str, int] = self.meta["videos"]
+        shard_dirs = [os.path.join(root, SHARDS_DIR, str(shard)) for shard in range(self.meta["shards"])]
+        self.queries = 0
+        self.shard_requests = 0
+        self.broken: Optional[Exception] = None
+        self._closed = False
+        if processes:
+            context = multiprocessing.get_context("spawn")
+            self._conns = []
+            self._workers = []
+            for shard_dir in shard_dirs:
+                conn, worker_conn = context.Pipe()
+                worker = context.Process(target=_serve_shard, args=(shard_dir, worker_conn), daemon=True)
+                worker.start()
+                self._conns.append(conn)
+                self._workers.append(worker)
+            # wait until every shard is loaded
+            self.sizes = [conn.recv() for conn in self._conns]
+            self._locks = [threading.Lock() for _ in shard_dirs]
+        else:
+            self._shards = [Shard(shard_dir) for shard_dir in shard_dirs]
+            self.sizes = [len(shard) for shard in self._shards]
+            self._executor = ThreadPoolExecutor(max_workers=len(shard_dirs), thread_name_prefix="shard")
+
+    def shard_nprobe(self, shard: int, nprobe: int) -> int:
+        """Lists scanned in one shard so that all shards scan the share of the corpus one shard would
+
+        A shard of a fraction f of the corpus has about sqrt(f) as many lists, each
+        sqrt(f) times as long, as one shard holding everything.
+        """
+        return max(1, math.ceil(nprobe * math.sqrt(self.sizes[shard] / max(1, sum(self.sizes)))))
+
+    def shards_for(self, video_ids: Optional[Sequence[str]] = None) -> List[int]:
+        """The shards a query has to reach, all of them without a video filter"""
+        if video_ids is None:
+            return list(range(len(self.sizes)))
+        return sorted({self.videos[video_id] for video_id in video_ids if video_id in self.videos})
+
+    def search(
+        self,
+        embedding: Sequence[float],
+        k: int = 4,
+        video_ids: Optional[Sequence[str]] = None,
+        nprobe: Optional[int] = None,
+    ) -> List[Tuple[Document, float]]:
+        """Top-k (document, cosine distance) pairs across the corpus or the given videos"""
+        if self.broken is not None:
+            raise RuntimeError("A shard worker of this searcher failed, open a new ShardedSearcher") from self.broken
+        if self._closed:
+            raise RuntimeError("The searcher is closed")
+        query = _normalize(np.asarray(embedding, dtype=np.float32))
+        nprobe = nprobe or self.nprobe
+        video_ids = list(video_ids) if video_ids is not None else None
+        shards = self.shards_for(video_ids)
+        requests = {shard: (query, k, self.shard_nprobe(shard, nprobe), video_ids) for shard in shards}
+        self.queries += 1
+        self.shard_requests += len(shards)
+        if self.processes:
+            hits = self._scatter_processes(requests)
+        else:
+            hits = self._executor.map(lambda shard: self._shards[shard].search(*requests[shard]), shards)
+        merged = heapq.nsmallest(k, (hit for shard_hits in hits for hit in shard_hits), key=lambda hit: hit[0])
+        return [(Document(page_content=text, metadata=metadata), distance) for distance, text, metadata in merged]
+
+    def _scatter_processes(self, requests: Dict[int, tuple]) -> List[List[Hit]]:
+        shards = list(requests)
+        # locks are taken in shard order, so concurrent queries cannot deadlock
+        for shard in shards:
+            self._locks[shard].acquire()
+        sent, results, error = [], [], None
+        try:
+            try:
+                for shard in shards:
+                    self._conns[shard].send(requests[shard])
+                    sent.append(shard)
+            except Exception as e:
+                error = e
+            # every shard a request was sent to is read from, even after a failure, so no
+            # reply is left in a pipe to be mistaken for the answer to the next query
+            for shard in sent:
+                try:
+                    results.append(self._conns[shard].recv())
+                except Exception as e:
+                    error = error or e
+            if error is not None:
+                # a worker died or a pipe broke, the shard cannot answer again
+                self.broken = error
+        finally:
+            for shard in shards:
+                self._locks[shard].release()
+        if error is not None:
+            raise RuntimeError(f"Shard worker failed with {error!r}") from error
+        for result in results:
+            if isinstance(result, Exception):
+                raise result
+        return results
+
+    def stats(self) -> dict:
+        return {
+            "shards": len(self.sizes),
+            "chunks": sum(self.sizes),
+            "queries": self.queries,
+            "shards_per_query": self.shard_requests / self.queries if self.queries else 0.0,
+        }
+
+    def close(self):
+        """Stop the shard workers once queries already scattered to them are answered"""
+        if self._closed:
+            return
+        self._closed = True
+        if self.processes:
+            for lock, conn in zip(self._locks, self._conns):
+                with lock:
+                    try:
+                        conn.send(None)
+                    except OSError:
+                        # the worker is already gone
+                        pass
+            for worker in self._workers:
+                worker.join(timeout=5)
+        else:
+            self._executor.shutdown()
+
+    def __enter__(self) -> "ShardedSearcher":
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+def _video_filter(filter: Optional[dict]) -> Optional[List[str]]:
+    if not filter:
+        return None
+    unknown = set(filter) - {"source", "video_id"}
+    if unknown:
+        raise ValueError(f"The corpus can only be filtered by video, not by {sorted(unknown)}")
+    value = filter.get("video_id", filter.get("source"))
+    return [value] if isinstance(value, str) else list(value)
+
+
+class ShardedVectorStore(VectorStore):
+    """Read-only vector store searching a sharded corpus
+
+    A `filter` of `{"source": video_id}` (or a list of ids) restricts the search to
+    those videos and only reaches their shards.
+    """
+
+    def __init__(self, searcher: ShardedSearcher, embedding_function: Embeddings):
+        self.searcher = searcher
+        self.embedding_function = embedding_function
+
+    def add_texts(self, texts: Iterable[str], metadatas: Optional[List[dict]] = None, **kwargs: Any) -> List[str]:
+        raise NotImplementedError("Rebuild the corpus with shards.build_corpus instead")
+
+    @classmethod
+    def from_texts(cls, texts: List[str], embedding: Embeddings, metadatas: Optional[List[dict]] = None, **kwargs: Any):
+        raise NotImplementedError("Build the corpus with shards.build_corpus")
+
+    def similarity_search_by_vector_with_score(
+        self, embedding: List[float], k: int = 4, filter: Optional[dict] = None
+    ) -> List[Tuple[Document, float]]:
+        return self.searcher.search(embedding, k=k, video_ids=_video_filter(filter))
+
+    def similarity_search_with_score(
+        self, query: str, k: int = 4, filter: Optional[dict] = None, **kwargs: Any
+    ) -> List[Tuple[Document, float]]:
+        return self.similarity_search_by_vector_with_score(
+            self.embedding_function.embed_query(query), k=k, filter=filter
+        )
+
+    def similarity_search(self, query: str, k: int = 4, filter: Optional[dict] = None, **kwargs: Any) -> List[Document]:
+        return [document for document, _ in self.similarity_search_with_score(query, k=k, filter=filter)]
+
+
+def get_parser():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("command", choices=["build", "query"], help="Build the corpus or ask it a question")
+    parser.add_argument(
+        "--vector_store_dir", type=str, default="./vector_store", help="The local index whose segments are sharded"
+    )
+    parser.add_argument("--corpus_dir", type=str, default=default_config.corpus_dir, help="Where the shards live")
+    parser.add_argument("--shards", type=int, default=default_config.corpus_shards, help="Number of shards")
+    parser.add_argument(
+        "--sharding", type=str, choices=list(SHARDINGS), default=default_config.corpus_sharding, help="Shard placement"
+    )
+    parser.add_argument("--question", type=str, default=None, help="The question to search the corpus for")
+    parser.add_argument("--video_url", type=str, default=None, help="Only search this video")
+    parser.add_argument("--k", type=int, default=default_config.retrieval_fetch_k, help="Results to print")
+    return parser
+
+
+def main():
+    args = get_parser().parse_args()
+    if args.command == "build":
+        meta = build_corpus(open_segments(args.vector_store_dir), args.corpus_dir, args.shards, args.sharding)
+        print(f"Sharded {meta['chunks']} chunks of {len(meta['videos'])} videos into {meta['shards']} shards")
+        return
+
+    from embedding_cache import cached_openai_embeddings
+    from transcripts import canonical_video_id
+
+    filter = {"source": canonical_video_id(args.video_url)} if args.video_url else None
+    with ShardedSearcher(args.corpus_dir) as searcher:
+        store = ShardedVectorStore(searcher, cached_openai_embeddings())
+        for document, distance in store.similarity_search_with_score(args.question, k=args.k, filter=filter):
+            print(f"{distance:.3f} {document.metadata.get('source')} {document.page_content[:100]}")
+
+
+if __name__ == "__main__":
+    from dotenv import find_dotenv, load_dotenv
+
+    logging.basicConfig(level=logging.INFO)
+    load_dotenv(find_dotenv())
+    main()
@@ -0,0 +1,65 @@
+"""Stream chat model tokens into a Streamlit placeholder while timing the generation"""
+import time
+from typing import Any, Dict, List, Optional
+
+from langchain.callbacks.base import BaseCallbackHandler
+
+
+class StreamlitTokenHandler(BaseCallbackHandler):
+    """Callback handler rendering partial answers and recording time-to-first-token
+
+    Args:
+        placeholder: A Streamlit `st.empty()` placeholder to render the partial answer into
+        min_interval (float, optional): Minimum seconds between re-renders. Defaults to 0.05.
+    """
+
+    def __init__(self, placeholder=None, min_interval: float = 0.05):
+        self.placeholder = placeholder
+        self.min_interval = min_interval
+        self.text = ""
+        self.start: Optional[float] = None
+        self.first_token_at: Optional[float] = None
+        self.end: Optional[float] = None
+        self.n_tokens = 0
+        self._last_render = 0.0
+
+    def on_llm_start(self, serialized: Dict[str, Any], prompts: List[str], **kwargs: Any) -> None:
+        self.start = time.perf_counter()
+
+    def on_chat_model_start(self, serialized: Dict[str, Any], messages: List[List[Any]], **kwargs: Any) -> None:
+        self.start = time.perf_counter()
+
+    def on_llm_new_token(self, token: str, **kwargs: Any) -> None:
+        now = time.perf_counter()
+        if self.first_token_at is None:
+            self.first_token_at = now
+        self.text += token
+        self.n_tokens += 1
+        # re-rendering on every token costs more than the tokens arrive
+        if self.placeholder is not None and now - self._last_render >= self.min_interval:
+            self.placeholder.markdown(self.text + "▌")
+            self._last_render = now
+
+    def on_llm_end(self, response: Any, **kwargs: Any) -> None:
+        self.end = time.perf_counter()
+        if self.placeholder is not None:
+            self.placeholder.markdown(self.text)
+
+    @property
+    def time_to_first_token(self) -> Optional[float]:
+        if self.start is None or self.first_token_at is None:
+            return None
+        return self.first_token_at - self.start
+
+    @property
+    def generation_time(self) -> Optional[float]:
+        if self.start is None or self.end is None:
+            return None
+        return self.end - self.start
+
+    def metrics(self) -> Dict[str, Optional[float]]:
+        return {
+            "time_to_first_token": self.time_to_first_token,
+            "generation_time": self.generation_time,
+            "completion_tokens": self.n_tokens,
+        }
@@ -0,0 +1,191 @@
+"""Per-request stage timings, token counts and cache hits logged to the W&B run
+
+Wrap one request in `tracer.trace(...)`; stage timings recorded with `span`, `timed`
+and counters recorded with `record`/`increment` anywhere below it (including in
+worker threads that copy the context) are attached to that request and logged as
+metrics when it ends, together with a sampled per-request table. The table rows are
+buffered per run and request name and logged every `table_every` rows, by `flush`
+before a run finishes, and at interpreter exit. When the tracer is disabled or no
+request is active these calls return immediately.
+"""
+import atexit
+import contextvars
+import functools
+import logging
+import random
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+
+class Trace:
+    def __init__(self, name: str):
+        self.name = name
+        self.start = time.perf_counter()
+        self.stages: Dict[str, float] = {}
+        self.counters: Dict[str, float] = {}
+        self._lock = threading.Lock()
+
+    def add_stage(self, stage: str, seconds: float):
+        with self._lock:
+            self.stages[stage] = self.stages.get(stage, 0.0) + seconds
+
+    def add(self, key: str, value: float):
+        with self._lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def metrics(self) -> Dict[str, float]:
+        metrics = {f"{self.name}/{stage}_ms": seconds * 1000 for stage, seconds in self.stages.items()}
+        metrics.update({f"{self.name}/{key}": value for key, value in self.counters.items()})
+        metrics[f"{self.name}/total_ms"] = (time.perf_counter() - self.start) * 1000
+        return metrics
+
+
+_current: contextvars.ContextVar = contextvars.ContextVar("trace", default=None)
+
+
+class _NoopSpan:
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NOOP = _NoopSpan()
+
+
+class _Span:
+    __slots__ = ("trace", "stage", "start")
+
+    def __init__(self, trace: Trace, stage: str):
+        self.trace = trace
+        self.stage = stage
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.trace.add_stage(self.stage, time.perf_counter() - self.start)
+        return False
+
+
+class Tracer:
+    """Collects traces and logs them to a W&B run
+
+    Args:
+        run (wandb.run, optional): The run to log to; without one traces are only logged to the logger
+        enabled (bool, optional): Whether to record anything at all. Defaults to True.
+        sample_rate (float, optional): Fraction of requests added to the per-request table. Defaults to 0.1.
+        table_every (int, optional): Sampled rows collected before the table is logged. Defaults to 50.
+    """
+
+    def __init__(self, run=None, enabled: bool = True, sample_rate: float = 0.1, table_every: int = 50):
+        self.configure(run, enabled, sample_rate, table_every)
+        # sampled rows by (id of the run, request name), with the run they are logged to
+        self._rows: Dict[Tuple[int, str], Tuple[Any, List[Dict[str, Any]]]] = {}
+        self._lock = threading.Lock()
+
+    def configure(self, run=None, enabled: bool = True, sample_rate: float = 0.1, table_every: int = 50):
+        self.run = run
+        self.enabled = enabled
+        self.sample_rate = sample_rate
+        self.table_every = table_every
+
+    @contextmanager
+    def trace(self, name: str, run=None):
+        """Record everything below this block as one request named `name`"""
+        if not self.enabled:
+            yield None
+            return
+        trace = Trace(name)
+        token = _current.set(trace)
+        try:
+            yield trace
+        finally:
+            _current.reset(token)
+            self._emit(trace, run or self.run)
+
+    def _emit(self, trace: Trace, run):
+        metrics = trace.metrics()
+        logger.debug(f"{trace.name}: {metrics}")
+        if run is None:
+            return
+        run.log(metrics)
+        if random.random() >= self.sample_rate:
+            return
+        key = (id(run), trace.name)
+        with self._lock:
+            _, rows = self._rows.setdefault(key, (run, []))
+            rows.append(metrics)
+            if len(rows) < self.table_every:
+                return
+            del self._rows[key]
+        self._log_table(trace.name, rows, run)
+
+    def _log_table(self, name: str, rows: List[Dict[str, Any]], run):
+        import wandb
+
+        columns = sorted({key for row in rows for key in row})
+        table = wandb.Table(columns=columns, data=[[row.get(column) for column in columns] for row in rows])
+        run.log({f"{name}/requests": table})
+
+    def flush(self, run=None):
+        """Log the sampled rows collected so far for `run`, or for every run, e.g. before a run finishes"""
+        with self._lock:
+            keys = [key for key, (row_run, _) in self._rows.items() if run is None or row_run is run]
+            buffers = [(key[1], *self._rows.pop(key)) for key in keys]
+        for name, row_run, rows in buffers:
+            try:
+                self._log_table(name, rows, row_run)
+            except Exception as e:
+                # at exit the run may already be finished
+                logger.warning(f"Could not log the {name} trace table: {e!r}")
+
+
+tracer = Tracer()
+atexit.register(tracer.flush)
+
+
+def span(stage: str):
+    """Time a block as `stage` of the active request"""
+    trace = _current.get()
+    if trace is None:
+        return _NOOP
+    return _Span(trace, stage)
+
+
+def record(key: str, value: float):
+    """Add `value` to the counter `key` of the active request"""
+    trace = _current.get()
+    if trace is not None:
+        trace.add(key, value)
+
+
+def increment(key: str, n: int = 1):
+    record(key, n)
+
+
+def timed(stage: str) -> Callable:
+    """Decorator timing every call of a function as `stage` of the active request"""
+
+    def decorator(fn: Callable) -> Callable:
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            trace = _current.get()
+            if trace is None:
+                return fn(*args, **kwargs)
+            with _Span(trace, stage):
+                return fn(*args, **kwargs)
+
+        return wrapper
+
+    return decorator
+
+
+def current_trace() -> Optional[Trace]:
+    return _current.get()
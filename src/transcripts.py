@@ -0,0 +1,264 @@
+"""Fetch youtube transcripts through an on-disk cache and hedged fallback sources
+
+Transcripts are lists of caption documents, one per caption, with the caption's
+`start` and `end` in seconds as metadata, so chunks built from them can point back
+into the video. The cache stores them as JSON lines and streams them back lazily.
+"""
+import json
+import logging
+import os
+import re
+import threading
+import time
+import urllib.parse
+import urllib.request
+from concurrent.futures import FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from typing import Callable, Dict, Iterator, List, Optional, Sequence, Tuple
+
+import youtube_dl
+from langchain.docstore.document import Document
+from youtube_transcript_api import YouTubeTranscriptApi
+
+from config import default_config
+
+logger = logging.getLogger(__name__)
+
+Fetcher = Callable[[str], List[Document]]
+
+_VIDEO_ID_RE = re.compile(r"^[A-Za-z0-9_-]{11}$")
+
+
+def canonical_video_id(video_url: str) -> str:
+    """Extract the video id from any common youtube url form, or return a bare id as is
+
+    Handles `youtu.be/<id>`, `watch?v=<id>` (with extra parameters, on www., m. and
+    music. hosts), `/embed/<id>`, `/shorts/<id>` and `/live/<id>`.
+    """
+    video_url = video_url.strip()
+    if _VIDEO_ID_RE.match(video_url):
+        return video_url
+    if "://" not in video_url:
+        video_url = "https://" + video_url
+    parsed = urllib.parse.urlparse(video_url)
+    host = parsed.netloc.lower().split(":")[0]
+    path = [part for part in parsed.path.split("/") if part]
+    if host.endswith("youtu.be") and path:
+        return path[0][:11]
+    query = urllib.parse.parse_qs(parsed.query)
+    if "v" in query:
+        return query["v"][0][:11]
+    if len(path) >= 2 and path[0] in ("embed", "shorts", "live", "v"):
+        return path[1][:11]
+    raise ValueError(f"Could not find a youtube video id in {video_url!r}")
+
+
+def watch_url(video_id: str) -> str:
+    return "https://www.youtube.com/watch?v=" + video_id
+
+
+def caption(video_id: str, text: str, start: float, end: float) -> Document:
+    return Document(page_content=text, metadata={"source": video_id, "start": start, "end": end})
+
+
+def fetch_with_transcript_api(video_id: str) -> List[Document]:
+    """Fetch the timed captions through the youtube transcript api"""
+    pieces = YouTubeTranscriptApi.get_transcript(video_id, languages=["en"])
+    return [
+        caption(video_id, piece["text"], piece["start"], piece["start"] + piece["duration"])
+        for piece in pieces
+        if piece["text"].strip()
+    ]
+
+
+_VTT_TIMING_RE = re.compile(r"^((?:\d+:)?\d+:\d+\.\d+)\s+-->\s+((?:\d+:)?\d+:\d+\.\d+)")
+
+
+def _vtt_seconds(timestamp: str) -> float:
+    seconds = 0.0
+    for part in timestamp.split(":"):
+        seconds = seconds * 60 + float(part)
+    return seconds
+
+
+def _parse_vtt(vtt: str) -> List[Tuple[float, float, str]]:
+    """(start, end, text) of each cue of a WebVTT file"""
+    cues = []
+    seen_lines = []
+    timing = None
+    for line in vtt.splitlines():
+        match = _VTT_TIMING_RE.match(line.strip())
+        if match:
+            timing = (_vtt_seconds(match.group(1)), _vtt_seconds(match.group(2)))
+            continue
+        line = re.sub(r"<[^>]+>", "", line).strip()
+        if timing is None or not line:
+            continue
+        # auto captions repeat each line while it scrolls
+        if line in seen_lines[-2:]:
+            continue
+        seen_lines.append(line)
+        cues.append((timing[0], timing[1], line))
+    return cues
+
+
+def fetch_with_youtube_dl(video_id: str) -> List[Document]:
+    """Fetch english subtitles, or automatic captions, through youtube_dl"""
+    options = {"skip_download": True, "writesubtitles": True, "writeautomaticsub": True, "quiet": True}
+    with youtube_dl.YoutubeDL(options) as youtube_dl_client:
+        info = youtube_dl_client.extract_info(watch_url(video_id), download=False)
+    tracks = (info.get("subtitles") or {}).get("en") or (info.get("automatic_captions") or {}).get("en")
+    track = next((track for track in tracks or [] if track.get("ext") == "vtt"), None)
+    if track is None:
+        raise LookupError(f"No english subtitles for {video_id}")
+    with urllib.request.urlopen(track["url"], timeout=30) as response:
+        cues = _parse_vtt(response.read().decode("utf-8"))
+    return [caption(video_id, text, start, end) for start, end, text in cues]
+
+
+class TranscriptCache:
+    """Transcripts stored as one JSON-lines file per canonical video id"""
+
+    def __init__(self, cache_dir: str):
+        self.cache_dir = cache_dir
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def _path(self, video_id: str) -> str:
+        return os.path.join(self.cache_dir, f"{video_id}.jsonl")
+
+    def contains(self, video_id: str) -> bool:
+        return os.path.exists(self._path(video_id))
+
+    def stream(self, video_id: str) -> Iterator[Document]:
+        """Read a cached transcript one caption at a time"""
+        with open(self._path(video_id), "r") as f:
+            for line in f:
+                row = json.loads(line)
+                yield Document(page_content=row["page_content"], metadata=row["metadata"])
+
+    def get(self, video_id: str) -> Optional[List[Document]]:
+        try:
+            return list(self.stream(video_id))
+        except (OSError, ValueError):
+            return None
+
+    def put(self, video_id: str, documents: List[Document]):
+        # written to a temporary file first so readers never see a partial transcript; the
+        # name is unique per process and thread as server workers can share the cache
+        tmp_path = self._path(video_id) + f".{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w") as f:
+            for d in documents:
+                f.write(json.dumps({"page_content": d.page_content, "metadata": d.metadata}) + "\n")
+        os.replace(tmp_path, self._path(video_id))
+
+
+class HedgedFetcher:
+    """Try transcript sources in order, starting the next one when the current one is slow
+
+    The first source starts immediately; every `hedge_delay` seconds without a result,
+    or as soon as a running source fails or returns no captions, the next source is
+    started as well. The first non-empty result wins. Sources not started yet are
+    cancelled; a source already running cannot be interrupted, it finishes in the
+    background holding its executor thread and its result is ignored. With
+    `hedge_delay=0` all sources race from the start.
+
+    Args:
+        fetchers (Sequence[Fetcher]): Sources taking a video id and returning its transcript
+        hedge_delay (float, optional): Seconds to wait before starting the next source. Defaults to 2.0.
+        timeout (float, optional): Overall seconds to wait for any source. Defaults to 120.
+    """
+
+    def __init__(self, fetchers: Sequence[Fetcher], hedge_delay: float = 2.0, timeout: float = 120.0):
+        if not fetchers:
+            raise ValueError("HedgedFetcher needs at least one fetcher")
+        self.fetchers = list(fetchers)
+        self.hedge_delay = hedge_delay
+        self.timeout = timeout
+        self._executor = ThreadPoolExecutor(max_workers=4 * len(self.fetchers), thread_name_prefix="transcript")
+
+    def __call__(self, video_id: str) -> List[Document]:
+        pending = list(self.fetchers)
+        running: Dict[Future, Fetcher] = {}
+        errors = []
+
+        def start_next():
+            fetcher = pending.pop(0)
+            running[self._executor.submit(fetcher, video_id)] = fetcher
+
+        start_next()
+        deadline = time.monotonic() + self.timeout
+        next_hedge = time.monotonic() + self.hedge_delay
+        try:
+            while running:
+                now = time.monotonic()
+                if now >= deadline:
+                    break
+                wait_until = min(deadline, next_hedge) if pending else deadline
+                done, _ = wait(running, timeout=wait_until - now, return_when=FIRST_COMPLETED)
+                if not done:
+                    if pending and time.monotonic() >= next_hedge:
+                        logger.info(f"Transcript source is slow for {video_id}, also trying the next one")
+                        start_next()
+                        next_hedge = time.monotonic() + self.hedge_delay
+                    continue
+                for future in done:
+                    fetcher = running.pop(future)
+                    try:
+                        documents = future.result()
+                        if not documents:
+                            raise LookupError(f"empty transcript for {video_id}")
+                    except Exception as e:
+                        errors.append(e)
+                        logger.warning(f"{getattr(fetcher, '__name__', fetcher)} failed for {video_id}: {e!r}")
+                        if pending:
+                            start_next()
+                            next_hedge = time.monotonic() + self.hedge_delay
+                        continue
+                    return documents
+        finally:
+            # only stops sources still queued in the executor, running ones finish on their own
+            for future in running:
+                future.cancel()
+        raise LookupError(f"No transcript source succeeded for {video_id}: {errors!r}")
+
+
+class TranscriptLoader:
+    """Load transcripts by url from the cache, fetching and caching them on a miss"""
+
+    def __init__(self, cache: TranscriptCache, fetcher: Fetcher):
+        self.cache = cache
+        self.fetcher = fetcher
+
+    def stream(self, video_url: str) -> Iterator[Document]:
+        """Make sure the transcript is cached and return an iterator over its captions
+
+        A miss is fetched and cached right away; the captions are then read back
+        lazily, so callers never need to hold the whole transcript in memory.
+        """
+        video_id = canonical_video_id(video_url)
+        if self.cache.contains(video_id):
+            logger.info(f"Transcript cache hit for {video_id}")
+        else:
+            self.cache.put(video_id, self.fetcher(video_id))
+        return self.cache.stream(video_id)
+
+    def __call__(self, video_url: str) -> List[Document]:
+        return list(self.stream(video_url))
+
+
+_default_loader: Optional[TranscriptLoader] = None
+_default_loader_lock = threading.Lock()
+
+
+def default_transcript_loader() -> TranscriptLoader:
+    """The process-wide loader over the configured cache and the youtube sources"""
+    global _default_loader
+    with _default_loader_lock:
+        if _default_loader is None:
+            _default_loader = TranscriptLoader(
+                TranscriptCache(default_config.transcript_cache_dir),
+                HedgedFetcher(
+                    [fetch_with_transcript_api, fetch_with_youtube_dl],
+                    hedge_delay=default_config.transcript_hedge_delay,
+                ),
+            )
+        return _default_loader
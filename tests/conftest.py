@@ -0,0 +1,24 @@
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.join(ROOT, "src"))
+# the stub OpenAI server of the benchmarks also serves the tests
+sys.path.insert(0, os.path.join(ROOT, "benchmarks"))
+
+
+class WordEncoding:
+    """A tiktoken stand-in counting one token per whitespace-separated word, no download needed"""
+
+    def encode(self, text, disallowed_special=()):
+        return text.split()
+
+    def decode(self, tokens):
+        return " ".join(tokens)
+
+
+@pytest.fixture
+def word_encoding():
+    return WordEncoding()
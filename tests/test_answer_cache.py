@@ -0,0 +1,76 @@
+"""AnswerCache exact and near-duplicate hits, misses and keying"""
+import pytest
+
+pytest.importorskip("langchain.embeddings.base")
+
+from langchain.embeddings.base import Embeddings
+
+from answer_cache import AnswerCache, normalize_question
+
+VECTORS = {
+    "what is a transformer": [1.0, 0.0, 0.0],
+    "what's a transformer": [0.99, 0.14, 0.0],
+    "what is attention": [0.6, 0.8, 0.0],
+}
+
+
+class TableEmbeddings(Embeddings):
+    def __init__(self):
+        self.queries = []
+
+    def embed_documents(self, texts):
+        return [self.embed_query(text) for text in texts]
+
+    def embed_query(self, text):
+        self.queries.append(text)
+        return VECTORS.get(text, [0.0, 0.0, 1.0])
+
+
+@pytest.fixture
+def embeddings():
+    return TableEmbeddings()
+
+
+def test_normalize_question():
+    assert normalize_question("  What IS a   transformer?") == "what is a transformer"
+
+
+def test_exact_hit_needs_no_embedding_call(embeddings):
+    cache = AnswerCache(embeddings)
+    cache.put("index", "What is a transformer?", "A model")
+    embeddings.queries.clear()
+    assert cache.get("index", "what is a transformer") == "A model"
+    assert embeddings.queries == []
+    assert cache.stats() == {"hits": 1, "near_hits": 0, "misses": 0, "entries": 1}
+
+
+def test_near_duplicate_hit_and_miss(embeddings):
+    cache = AnswerCache(embeddings, similarity_threshold=0.95)
+    cache.put("index", "what is a transformer", "A model")
+    assert cache.get("index", "What's a transformer?") == "A model"
+    assert cache.get("index", "what is attention") is None
+    assert cache.stats()["near_hits"] == 1
+    assert cache.stats()["misses"] == 1
+
+
+def test_answers_are_keyed_by_namespace(embeddings):
+    cache = AnswerCache(embeddings)
+    cache.put(("digest-a", "gpt-3.5-turbo", 0.3), "what is a transformer", "A model")
+    assert cache.get(("digest-b", "gpt-3.5-turbo", 0.3), "what is a transformer") is None
+    assert cache.get(("digest-a", "gpt-4", 0.3), "what is a transformer") is None
+    assert cache.get(("digest-a", "gpt-3.5-turbo", 0.3), "what is a transformer") == "A model"
+
+
+def test_bypass_expiry_and_eviction(embeddings):
+    cache = AnswerCache(embeddings, max_entries=2)
+    cache.put("index", "what is a transformer", "A model")
+    assert cache.get("index", "what is a transformer", bypass=True) is None
+    cache.put("index", "what is attention", "Weighting")
+    cache.put("index", "who won", "Nobody")
+    # the least recently used answer was evicted
+    assert cache.stats()["entries"] == 2
+    assert cache.get("index", "what is a transformer") is None
+
+    expired = AnswerCache(embeddings, ttl=-1)
+    expired.put("index", "what is a transformer", "A model")
+    assert expired.get("index", "what is a transformer") is None
@@ -0,0 +1,76 @@
+"""BM25 CSR postings, scores against the Okapi formula and reciprocal rank fusion"""
+import math
+
+import numpy as np
+import pytest
+
+pytest.importorskip("langchain.docstore.document")
+
+from langchain.docstore.document import Document
+
+from bm25 import BM25Index, reciprocal_rank_fusion, tokenize
+
+CORPUS = [
+    "the cat sat on the mat",
+    "dogs chase the cat",
+    "dogs and dogs and more dogs",
+    "quantum physics lecture",
+]
+
+
+def documents():
+    return [Document(page_content=text, metadata={"chunk_index": i}) for i, text in enumerate(CORPUS)]
+
+
+def okapi(query: str, doc_id: int, k1: float = 1.5, b: float = 0.75) -> float:
+    """BM25 computed term by term from the raw corpus"""
+    tokenized = [tokenize(text) for text in CORPUS]
+    avg_length = sum(map(len, tokenized)) / len(tokenized)
+    score = 0.0
+    for term in set(tokenize(query)):
+        n_docs_with_term = sum(term in tokens for tokens in tokenized)
+        if not n_docs_with_term:
+            continue
+        idf = math.log(1 + (len(CORPUS) - n_docs_with_term + 0.5) / (n_docs_with_term + 0.5))
+        tf = tokenized[doc_id].count(term)
+        score += idf * tf * (k1 + 1) / (tf + k1 * (1 - b + b * len(tokenized[doc_id]) / avg_length))
+    return score
+
+
+def test_build_writes_csr_postings():
+    index = BM25Index.build(documents())
+    assert list(index.vocab) == sorted(index.vocab)
+    assert len(index.indptr) == len(index.vocab) + 1
+    assert index.indptr[-1] == len(index.doc_ids) == len(index.term_freqs)
+    term = index.vocab["dogs"]
+    start, stop = index.indptr[term], index.indptr[term + 1]
+    assert dict(zip(index.doc_ids[start:stop].tolist(), index.term_freqs[start:stop].tolist())) == {1: 1, 2: 3}
+    # stopwords are not indexed and do not count towards the document length
+    assert "the" not in index.vocab
+    np.testing.assert_array_equal(index.doc_lengths, [len(tokenize(text)) for text in CORPUS])
+
+
+@pytest.mark.parametrize("query", ["cat", "dogs cat", "quantum mat", "unknown words"])
+def test_scores_match_okapi_bm25(query):
+    scores, _ = BM25Index.build(documents()).scores(query)
+    np.testing.assert_allclose(scores, [okapi(query, i) for i in range(len(CORPUS))], rtol=1e-5)
+
+
+def test_search_ranks_and_survives_save_load(tmp_path):
+    BM25Index.build(documents()).save(str(tmp_path))
+    index = BM25Index.load(str(tmp_path))
+    results = index.search("dogs cat", k=4)
+    assert [document.metadata["chunk_index"] for document, _, _ in results] == [1, 2, 0]
+    scores = [score for _, score, _ in results]
+    assert scores == sorted(scores, reverse=True)
+    assert all(0 < confidence <= 1 for _, _, confidence in results)
+    assert index.search("dogs", filter={"chunk_index": 2})[0][0].page_content == CORPUS[2]
+    assert BM25Index.load(str(tmp_path / "missing")) is None
+
+
+def test_reciprocal_rank_fusion_orders_by_summed_reciprocal_ranks():
+    a, b, c, d = (Document(page_content=text) for text in "abcd")
+    fused = reciprocal_rank_fusion([[a, b, c], [c, b, d]], k=60)
+    # b: 1/62 + 1/62, c: 1/63 + 1/61, a: 1/61, d: 1/63
+    assert [document.page_content for document in fused] == ["c", "b", "a", "d"]
+    assert reciprocal_rank_fusion([[a, b], [a, b]]) == [a, b]
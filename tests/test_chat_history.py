@@ -0,0 +1,87 @@
+"""ChatWindow pagination over the SQLite chat history and isolation of sessions"""
+import pytest
+
+from chat_history import ChatHistoryStore, ChatWindow
+
+
+@pytest.fixture
+def store(tmp_path):
+    store = ChatHistoryStore(str(tmp_path / "chat_history.sqlite"))
+    yield store
+    store.close()
+
+
+def questions(window: ChatWindow) -> list:
+    return [turn.question for turn in window.turns]
+
+
+def fill(store: ChatHistoryStore, session_id: str, video_id: str, n_turns: int):
+    for i in range(n_turns):
+        store.add_turn(session_id, video_id, f"q{i}", f"a{i}")
+
+
+def test_window_pages_backwards_through_the_conversation(store):
+    fill(store, "s", "v", 8)
+    window = ChatWindow(store, "s", "v", page_size=3)
+    assert questions(window) == ["q5", "q6", "q7"]
+    assert window.has_older
+    assert window.load_older() == 3
+    assert questions(window) == ["q2", "q3", "q4", "q5", "q6", "q7"]
+    assert window.load_older() == 2
+    assert questions(window)[0] == "q0"
+    assert not window.has_older
+    assert window.load_older() == 0
+
+
+def test_window_holds_at_most_max_turns(store):
+    fill(store, "s", "v", 4)
+    window = ChatWindow(store, "s", "v", page_size=2, max_turns=3)
+    assert window.load_older() == 1
+    assert not window.can_load_older
+    window.add("q4", "a4")
+    assert questions(window) == ["q2", "q3", "q4"]
+    assert window.has_older
+    assert store.count("s", "v") == 5
+
+
+def test_sessions_and_videos_are_isolated(store):
+    fill(store, "alice", "v1", 3)
+    fill(store, "bob", "v1", 2)
+    fill(store, "alice", "v2", 1)
+    assert len(ChatWindow(store, "alice", "v1").turns) == 3
+    assert len(ChatWindow(store, "bob", "v1").turns) == 2
+    assert len(ChatWindow(store, "alice", "v2").turns) == 1
+    assert not ChatWindow(store, "carol", "v1").turns
+    ChatWindow(store, "bob", "v1").clear()
+    assert store.count("bob", "v1") == 0
+    assert store.count("alice", "v1") == 3
+
+
+def test_conversation_survives_a_new_store(tmp_path):
+    path = str(tmp_path / "chat_history.sqlite")
+    first = ChatHistoryStore(path)
+    ChatWindow(first, "s", "v").add("q0", "a0")
+    first.close()
+    second = ChatHistoryStore(path)
+    assert questions(ChatWindow(second, "s", "v")) == ["q0"]
+    second.close()
+
+
+def test_reset_keeps_the_stored_turns_loadable(store):
+    fill(store, "s", "v", 3)
+    window = ChatWindow(store, "s", "v", page_size=2)
+    window.reset()
+    assert not window.turns
+    assert store.count("s", "v") == 3
+    window.add("q3", "a3")
+    assert questions(window) == ["q3"]
+    assert window.load_older() == 2
+    assert questions(window) == ["q1", "q2", "q3"]
+
+    empty = ChatWindow(store, "s", "other", page_size=2)
+    empty.reset()
+    assert empty.load_older() == 0
+    window = ChatWindow(store, "s", "v", page_size=2)
+    window.reset()
+    assert window.load_older() == 2
+    assert questions(window) == ["q2", "q3"]
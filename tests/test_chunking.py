@@ -0,0 +1,68 @@
+"""stream_chunks and DocumentSpool"""
+from langchain.docstore.document import Document
+
+from chunking import DocumentSpool, stream_chunks
+
+
+def captions(n: int, words_per_caption: int = 5):
+    """Captions of numbered words, one second each"""
+    for i in range(n):
+        text = " ".join(f"w{i * words_per_caption + j}" for j in range(words_per_caption))
+        yield Document(page_content=text, metadata={"source": "video", "start": float(i), "end": float(i + 1)})
+
+
+def words(document: Document):
+    return document.page_content.split()
+
+
+def test_chunks_respect_size_and_overlap():
+    chunks = list(stream_chunks(captions(40), chunk_size=60, chunk_overlap=20))
+    assert len(chunks) > 2
+    assert all(len(chunk.page_content) <= 60 for chunk in chunks)
+    for previous, chunk in zip(chunks, chunks[1:]):
+        overlap = []
+        for word in words(previous)[::-1]:
+            if word not in words(chunk):
+                break
+            overlap.insert(0, word)
+        # the next chunk starts with the tail of the previous one, at most chunk_overlap long
+        assert overlap and words(chunk)[: len(overlap)] == overlap
+        assert len(" ".join(overlap)) <= 20
+
+
+def test_every_word_is_kept_in_order():
+    chunks = list(stream_chunks(captions(40), chunk_size=60, chunk_overlap=20))
+    seen = []
+    for chunk in chunks:
+        for word in words(chunk):
+            if not seen or int(word[1:]) > int(seen[-1][1:]):
+                seen.append(word)
+    assert seen == [f"w{i}" for i in range(200)]
+
+
+def test_chunk_index_is_continuous():
+    chunks = list(stream_chunks(captions(40), chunk_size=60, chunk_overlap=20))
+    assert [chunk.metadata["chunk_index"] for chunk in chunks] == list(range(len(chunks)))
+
+
+def test_timestamps_span_the_captions_of_the_words():
+    chunks = list(stream_chunks(captions(40), chunk_size=60, chunk_overlap=20))
+    for chunk in chunks:
+        seconds = [int(word[1:]) // 5 for word in words(chunk)]
+        assert chunk.metadata["start"] == min(seconds)
+        assert chunk.metadata["end"] == max(seconds) + 1
+        assert chunk.metadata["source"] == "video"
+
+
+def test_documents_without_timestamps_and_long_words():
+    documents = [Document(page_content="short " + "x" * 30 + " tail", metadata={"source": "doc"})]
+    chunks = list(stream_chunks(documents, chunk_size=10, chunk_overlap=0))
+    assert [chunk.page_content for chunk in chunks] == ["short", "x" * 30, "tail"]
+    assert all("start" not in chunk.metadata and "end" not in chunk.metadata for chunk in chunks)
+
+
+def test_spool_reads_back_what_streamed_through(tmp_path):
+    spool = DocumentSpool(str(tmp_path / "chunks.jsonl"))
+    streamed = list(spool.write_through(stream_chunks(captions(10), chunk_size=40, chunk_overlap=10)))
+    assert len(spool) == len(streamed)
+    assert [(d.page_content, d.metadata) for d in spool] == [(d.page_content, d.metadata) for d in streamed]
@@ -0,0 +1,75 @@
+"""Overlap merging of retrieved chunks and token-budgeted context packing"""
+import pytest
+
+pytest.importorskip("tiktoken")
+pytest.importorskip("langchain.docstore.document")
+
+from langchain.docstore.document import Document
+
+import context
+from context import merge_chunks, overlap_length, pack_context
+
+WORDS = [f"w{i:02d}" for i in range(60)]
+
+
+def chunk(start: int, stop: int, chunk_index=None, source="video") -> Document:
+    metadata = {"source": source}
+    if chunk_index is not None:
+        metadata["chunk_index"] = chunk_index
+    return Document(page_content=" ".join(WORDS[start:stop]), metadata=metadata)
+
+
+@pytest.fixture(autouse=True)
+def words_as_tokens(monkeypatch, word_encoding):
+    monkeypatch.setattr(context, "get_encoding", lambda model_name: word_encoding)
+
+
+def test_overlap_length():
+    assert overlap_length("a b c d e f", "d e f g h", min_overlap=3) == len("d e f")
+    assert overlap_length("a b c", "x y z", min_overlap=1) == 0
+    assert overlap_length("a b c d", "c d e", min_overlap=5) == 0
+
+
+def test_merges_adjacent_overlapping_chunks_in_either_order():
+    spans = merge_chunks([chunk(10, 30, chunk_index=1), chunk(0, 16, chunk_index=0), chunk(24, 45, chunk_index=2)])
+    assert len(spans) == 1
+    assert spans[0].text == " ".join(WORDS[0:45])
+    assert spans[0].chunk_indices == [0, 1, 2]
+    assert spans[0].rank == 0
+
+
+def test_does_not_merge_non_adjacent_or_foreign_chunks():
+    # the texts overlap, but the chunk positions say they are not neighbours
+    assert len(merge_chunks([chunk(0, 16, chunk_index=0), chunk(10, 30, chunk_index=2)])) == 2
+    assert len(merge_chunks([chunk(0, 16, source="a"), chunk(10, 30, source="b")])) == 2
+    # chunks without positions are joined on their overlap alone
+    assert len(merge_chunks([chunk(0, 16), chunk(10, 30)])) == 1
+
+
+def test_drops_chunks_already_contained_in_a_span():
+    spans = merge_chunks([chunk(0, 30, chunk_index=0), chunk(5, 20, chunk_index=1)])
+    assert [span.text for span in spans] == [" ".join(WORDS[0:30])]
+
+
+def test_pack_context_skips_spans_over_the_budget():
+    documents = [chunk(0, 10, chunk_index=0), chunk(20, 45, chunk_index=5), chunk(50, 55, chunk_index=9)]
+    packed = pack_context(documents, "gpt-3.5-turbo", token_budget=16)
+    # the 25 word span of rank 1 does not fit next to the 10 words of rank 0, the 5 words of rank 2 do
+    assert [span.rank for span in packed.spans] == [0, 2]
+    assert packed.tokens == 15 <= 16
+    assert packed.text == " ".join(WORDS[0:10]) + "\n\n" + " ".join(WORDS[50:55])
+
+
+def test_pack_context_counts_the_tokens_saved_by_merging():
+    documents = [chunk(10, 30, chunk_index=1), chunk(0, 16, chunk_index=0)]
+    packed = pack_context(documents, "gpt-3.5-turbo", token_budget=100)
+    assert packed.text == " ".join(WORDS[0:30])
+    assert packed.tokens == 30
+    assert packed.naive_tokens == 36
+    assert packed.tokens_saved == 6
+
+
+def test_pack_context_emits_spans_in_transcript_order():
+    documents = [chunk(40, 45, chunk_index=8), chunk(0, 5, chunk_index=0)]
+    packed = pack_context(documents, "gpt-3.5-turbo", token_budget=100)
+    assert packed.text.split("\n\n") == [" ".join(WORDS[0:5]), " ".join(WORDS[40:45])]
@@ -0,0 +1,78 @@
+"""Transcript datasets round-tripping through zstd Parquet and JSON lines"""
+import pytest
+
+pytest.importorskip("pyarrow")
+pytest.importorskip("tiktoken")
+pytest.importorskip("langchain.docstore.document")
+
+import pyarrow.parquet as pq
+from langchain.docstore.document import Document
+
+import dataset
+from dataset import TranscriptDataset, write_parquet
+
+
+@pytest.fixture(autouse=True)
+def words_as_tokens(monkeypatch, word_encoding):
+    monkeypatch.setattr(dataset, "get_encoding", lambda model_name: word_encoding)
+
+
+def documents():
+    rows = []
+    for video in ("aaaaaaaaaaa", "bbbbbbbbbbb"):
+        for i in range(5):
+            metadata = {"source": video, "chunk_index": i, "start": 10.0 * i, "end": 10.0 * i + 9.5}
+            rows.append(Document(page_content=f"{video} says chunk number {i}", metadata=metadata))
+    # a url source and extra metadata are kept in the JSON column
+    rows.append(
+        Document(
+            page_content="from a url",
+            metadata={"source": "https://youtu.be/ccccccccccc", "chunk_index": 0, "title": "A talk"},
+        )
+    )
+    return rows
+
+
+@pytest.fixture
+def path(tmp_path):
+    path = str(tmp_path / "documents.parquet")
+    assert write_parquet(iter(documents()), path, batch_rows=4) == 11
+    return path
+
+
+def test_parquet_is_zstd_compressed_in_row_groups(path):
+    metadata = pq.ParquetFile(path).metadata
+    assert metadata.num_row_groups == 3
+    assert metadata.row_group(0).num_rows == 4
+    assert metadata.row_group(0).column(0).compression == "ZSTD"
+
+
+def test_parquet_round_trip(path):
+    data = TranscriptDataset(path)
+    assert data.format == "parquet"
+    assert len(data) == 11
+    assert [(document.page_content, document.metadata) for document in data] == [
+        (document.page_content, document.metadata) for document in documents()
+    ]
+
+
+def test_reads_only_the_requested_columns_and_videos(path):
+    data = TranscriptDataset(path)
+    batches = list(data.batches(columns=["n_tokens"], video_ids=["bbbbbbbbbbb"]))
+    assert all(batch.schema.names == ["n_tokens"] for batch in batches)
+    assert sum(batch.num_rows for batch in batches) == 5
+    assert [value for batch in batches for value in batch.column(0).to_pylist()] == [5] * 5
+    assert [document.metadata["chunk_index"] for document in data.documents(video_ids=["aaaaaaaaaaa"])] == list(
+        range(5)
+    )
+    assert data.video_ids() == ["aaaaaaaaaaa", "bbbbbbbbbbb", "ccccccccccc"]
+
+
+def test_jsonl_export_reads_back(tmp_path, path):
+    jsonl = str(tmp_path / "documents.json")
+    assert TranscriptDataset(path).export_jsonl(jsonl) == 11
+    data = TranscriptDataset(jsonl)
+    assert data.format == "jsonl"
+    assert len(data) == 11
+    assert [document.metadata for document in data] == [document.metadata for document in documents()]
+    assert len(list(data.documents(video_ids=["ccccccccccc"]))) == 1
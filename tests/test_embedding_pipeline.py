@@ -0,0 +1,101 @@
+"""EmbeddingPipeline against the local stub OpenAI server"""
+import pytest
+
+pytest.importorskip("openai")
+pytest.importorskip("tiktoken")
+
+import openai
+from langchain.docstore.document import Document
+from langchain.embeddings.base import Embeddings
+
+from embedding_pipeline import EmbeddingPipeline
+from stub_openai import start_stub_server
+
+DIM = 64
+
+
+@pytest.fixture
+def stub_server(request):
+    server = start_stub_server(dim=DIM, **getattr(request, "param", {}))
+    yield server
+    server.shutdown()
+
+
+class StubEmbeddings(Embeddings):
+    """Calls the embeddings endpoint once per batch, without retries or tiktoken"""
+
+    def __init__(self, server):
+        self.api_base = f"http://127.0.0.1:{server.server_port}/v1"
+
+    def embed_documents(self, texts):
+        response = openai.Embedding.create(
+            input=texts, model="text-embedding-ada-002", api_key="stub", api_base=self.api_base
+        )
+        return [row["embedding"] for row in sorted(response["data"], key=lambda row: row["index"])]
+
+    def embed_query(self, text):
+        return self.embed_documents([text])[0]
+
+
+@pytest.fixture
+def make_pipeline(stub_server, word_encoding):
+    def make(**kwargs) -> EmbeddingPipeline:
+        # the pipeline does the retrying, as in ingest; tokens are counted as words, no tokenizer download
+        return EmbeddingPipeline(StubEmbeddings(stub_server), encoding=word_encoding, **kwargs)
+
+    return make
+
+
+def chunks(n_chunks: int, words_per_chunk: int = 50):
+    return [
+        Document(page_content=" ".join(f"word{i}x{j}" for j in range(words_per_chunk)), metadata={"chunk": i})
+        for i in range(n_chunks)
+    ]
+
+
+def n_tokens(pipeline: EmbeddingPipeline, batch) -> int:
+    return sum(len(pipeline.encoding.encode(document.page_content, disallowed_special=())) for document in batch)
+
+
+def run(pipeline: EmbeddingPipeline, documents):
+    batches = []
+    stats = pipeline.run(documents, lambda batch, vectors: batches.append((batch, vectors)))
+    return stats, batches
+
+
+def test_embeds_every_chunk_once(make_pipeline):
+    documents = chunks(120)
+    stats, batches = run(make_pipeline(max_batch_tokens=1000, max_workers=3), iter(documents))
+    embedded = [document.metadata["chunk"] for batch, _ in batches for document in batch]
+    assert sorted(embedded) == list(range(len(documents)))
+    assert all(len(vectors) == len(batch) and len(vectors[0]) == DIM for batch, vectors in batches)
+    assert stats.chunks == len(documents)
+    assert stats.batches == len(batches)
+    assert stats.retries == 0
+
+
+def test_batches_stay_within_token_and_size_bounds(make_pipeline):
+    pipeline = make_pipeline(max_batch_tokens=500, max_batch_size=8)
+    stats, batches = run(pipeline, chunks(100))
+    assert len(batches) > 1
+    for batch, _ in batches:
+        assert len(batch) <= 8
+        assert n_tokens(pipeline, batch) <= 500
+    assert stats.tokens == sum(n_tokens(pipeline, batch) for batch, _ in batches)
+
+
+@pytest.mark.parametrize("stub_server", [{"rate_limit_prob": 0.3}], indirect=True)
+def test_retries_rate_limited_batches(stub_server, make_pipeline):
+    documents = chunks(200)
+    pipeline = make_pipeline(
+        max_batch_tokens=500,
+        max_workers=4,
+        max_retries=20,
+        base_delay=0.001,
+        max_delay=0.01,
+    )
+    stats, batches = run(pipeline, documents)
+    assert stats.chunks == len(documents)
+    assert stats.retries > 0
+    # every retry is one more request, the client itself never retries
+    assert stub_server.RequestHandlerClass.config.requests == stats.batches + stats.retries
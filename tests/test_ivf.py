@@ -0,0 +1,73 @@
+"""IVFIndex recall against brute-force search"""
+import numpy as np
+import pytest
+
+from ivf import IVFIndex
+
+
+def normalise(vectors: np.ndarray) -> np.ndarray:
+    return (vectors / np.linalg.norm(vectors, axis=-1, keepdims=True)).astype(np.float32)
+
+
+@pytest.fixture(scope="module")
+def vectors():
+    # embeddings of transcript chunks cluster by topic
+    rng = np.random.default_rng(0)
+    centers = rng.normal(size=(40, 64))
+    return normalise(centers[rng.integers(0, len(centers), 2000)] + 0.4 * rng.normal(size=(2000, 64)))
+
+
+@pytest.fixture(scope="module")
+def queries(vectors):
+    rng = np.random.default_rng(1)
+    return normalise(vectors[rng.integers(0, len(vectors), 50)] + 0.2 * rng.normal(size=(50, 64)))
+
+
+@pytest.fixture(scope="module")
+def index(vectors):
+    return IVFIndex.build(vectors)
+
+
+def brute_force(vectors: np.ndarray, query: np.ndarray, k: int) -> np.ndarray:
+    return np.argsort(-(vectors @ query), kind="stable")[:k]
+
+
+def recall(index: IVFIndex, vectors: np.ndarray, queries: np.ndarray, k: int, nprobe: int) -> float:
+    found = 0
+    for query in queries:
+        rows, _ = index.search(query, k, nprobe)
+        found += len(set(rows.tolist()) & set(brute_force(vectors, query, k).tolist()))
+    return found / (k * len(queries))
+
+
+def test_build_groups_every_vector_once(index, vectors):
+    assert index.n_lists == 45
+    assert index.offsets[-1] == len(vectors)
+    assert sorted(index.rows.tolist()) == list(range(len(vectors)))
+    np.testing.assert_array_equal(index.vectors, vectors[index.rows])
+
+
+def test_probing_every_list_is_exact(index, vectors, queries):
+    for query in queries[:10]:
+        rows, scores = index.search(query, 10, nprobe=index.n_lists)
+        np.testing.assert_array_equal(rows, brute_force(vectors, query, 10))
+        np.testing.assert_allclose(scores, vectors[rows] @ query, rtol=1e-5)
+
+
+def test_recall_grows_with_nprobe(index, vectors, queries):
+    low, high = recall(index, vectors, queries, 10, 1), recall(index, vectors, queries, 10, 8)
+    assert high >= 0.95
+    assert high >= low
+
+
+def test_exact_search_within_rows(index, vectors, queries):
+    subset = np.arange(100, 300)
+    rows, _ = index.exact(queries[0], 5, subset)
+    np.testing.assert_array_equal(rows, subset[brute_force(vectors[subset], queries[0], 5)])
+
+
+def test_save_and_load(tmp_path, index, queries):
+    index.save(str(tmp_path))
+    loaded = IVFIndex.load(str(tmp_path))
+    assert isinstance(loaded.vectors, np.memmap)
+    np.testing.assert_array_equal(loaded.search(queries[0], 10)[0], index.search(queries[0], 10)[0])
@@ -0,0 +1,46 @@
+"""LLMPool retries and its scoped HTTP session"""
+import pytest
+
+pytest.importorskip("langchain.chat_models")
+
+from llm_pool import LLMPool
+
+
+class RateLimited(Exception):
+    http_status = 429
+
+
+def flaky(failures: int, calls: list):
+    def complete():
+        calls.append(1)
+        if len(calls) <= failures:
+            raise RateLimited()
+        return "answer"
+
+    return complete
+
+
+def test_retries_transient_errors():
+    calls = []
+    pool = LLMPool(max_retries=2, base_delay=0.001)
+    assert pool.call(flaky(2, calls)) == "answer"
+    assert len(calls) == 3
+    assert pool.stats()["retries"] == 2
+
+
+def test_does_not_retry_once_tokens_were_streamed():
+    calls = []
+    pool = LLMPool(max_retries=2, base_delay=0.001)
+    with pytest.raises(RateLimited):
+        pool.call(flaky(1, calls), can_retry=lambda: False)
+    assert len(calls) == 1
+    assert pool.stats()["failures"] == 1
+
+
+def test_shared_session_is_scoped_to_the_block():
+    api_requestor = pytest.importorskip("openai.api_requestor")
+    pool = LLMPool()
+    own = getattr(api_requestor._thread_context, "session", None)
+    with pool.shared_session():
+        assert api_requestor._thread_context.session is pool.session
+    assert getattr(api_requestor._thread_context, "session", None) is own
@@ -0,0 +1,92 @@
+"""RollingSummaryMemory folding turns that leave the window into its summary"""
+import threading
+
+import pytest
+
+pytest.importorskip("tiktoken")
+pytest.importorskip("langchain.prompts")
+
+import memory
+from memory import RollingSummaryMemory
+
+
+@pytest.fixture(autouse=True)
+def words_as_tokens(monkeypatch, word_encoding):
+    monkeypatch.setattr(memory, "get_encoding", lambda model_name: word_encoding)
+
+
+class RecordingSummarizer:
+    def __init__(self):
+        self.calls = []
+        self.release = threading.Event()
+        self.release.set()
+
+    def __call__(self, summary, turns):
+        self.release.wait(5)
+        self.calls.append((summary, [turn.question for turn in turns]))
+        return " ".join(filter(None, [summary] + [f"asked {turn.question}" for turn in turns]))
+
+
+def test_older_turns_are_summarised_when_the_window_overflows():
+    summarizer = RecordingSummarizer()
+    chat = RollingSummaryMemory("gpt-3.5-turbo", max_turns=2, summarizer=summarizer)
+    for i in range(2):
+        chat.add_turn(f"q{i}", f"a{i}")
+    chat.wait(5)
+    assert summarizer.calls == []
+    assert chat.history() == "User: q0\nAssistant: a0\nUser: q1\nAssistant: a1"
+
+    chat.add_turn("q2", "a2")
+    chat.add_turn("q3", "a3")
+    chat.wait(5)
+    assert [questions for _, questions in summarizer.calls] in ([["q0"], ["q1"]], [["q0", "q1"]])
+    assert chat.summary == "asked q0 asked q1"
+    assert chat.history() == (
+        "Summary of the earlier conversation: asked q0 asked q1\n"
+        "User: q2\nAssistant: a2\nUser: q3\nAssistant: a3"
+    )
+
+
+def test_turns_being_summarised_stay_in_the_history():
+    summarizer = RecordingSummarizer()
+    summarizer.release.clear()
+    chat = RollingSummaryMemory("gpt-3.5-turbo", max_turns=1, summarizer=summarizer)
+    chat.add_turn("q0", "a0")
+    chat.add_turn("q1", "a1")
+    assert chat.history() == "User: q0\nAssistant: a0\nUser: q1\nAssistant: a1"
+    summarizer.release.set()
+    chat.wait(5)
+    assert chat.history() == "Summary of the earlier conversation: asked q0\nUser: q1\nAssistant: a1"
+
+
+def test_failed_summary_keeps_the_turns_verbatim():
+    def failing(summary, turns):
+        raise RuntimeError("rate limited")
+
+    chat = RollingSummaryMemory("gpt-3.5-turbo", max_turns=1, summarizer=failing)
+    chat.add_turn("q0", "a0")
+    chat.add_turn("q1", "a1")
+    chat.wait(5)
+    assert chat.summary == ""
+    assert "User: q0" in chat.history()
+
+
+def test_history_drops_the_oldest_turns_over_the_token_budget():
+    chat = RollingSummaryMemory("gpt-3.5-turbo", max_turns=5, token_budget=8, summarizer=RecordingSummarizer())
+    for i in range(3):
+        # four words each
+        chat.add_turn(f"q{i}", f"a{i}")
+    assert chat.history() == "User: q1\nAssistant: a1\nUser: q2\nAssistant: a2"
+
+
+def test_clear_discards_a_summary_in_flight():
+    summarizer = RecordingSummarizer()
+    summarizer.release.clear()
+    chat = RollingSummaryMemory("gpt-3.5-turbo", max_turns=1, summarizer=summarizer)
+    chat.add_turn("q0", "a0")
+    chat.add_turn("q1", "a1")
+    chat.clear()
+    summarizer.release.set()
+    chat.wait(5)
+    assert chat.summary == ""
+    assert chat.history() == ""
@@ -0,0 +1,95 @@
+"""NumpyVectorStore persistence and top-k search against brute-force cosine similarity"""
+import numpy as np
+import pytest
+
+pytest.importorskip("langchain.vectorstores")
+
+from langchain.docstore.document import Document
+from langchain.embeddings.base import Embeddings
+
+from numpy_store import EMBEDDINGS_FILE, QUANTIZED_FILES, NumpyVectorStore
+
+
+class NoEmbeddings(Embeddings):
+    def embed_documents(self, texts):
+        raise AssertionError("the tests search by vector")
+
+    def embed_query(self, text):
+        raise AssertionError("the tests search by vector")
+
+
+def brute_force(vectors: np.ndarray, query: np.ndarray, k: int) -> list:
+    normalised = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+    scores = normalised @ (query / np.linalg.norm(query))
+    return list(np.argsort(-scores, kind="stable")[:k])
+
+
+def build(path, vectors: np.ndarray, **kwargs) -> NumpyVectorStore:
+    store = NumpyVectorStore(NoEmbeddings(), str(path), **kwargs)
+    documents = [Document(page_content=f"chunk {i}", metadata={"chunk_index": i}) for i in range(len(vectors))]
+    store.add_embeddings(documents, vectors.tolist())
+    store.persist()
+    return store
+
+
+def search(store: NumpyVectorStore, query: np.ndarray, k: int) -> list:
+    results = store.similarity_search_by_vector_with_score(query.tolist(), k=k)
+    return [document.metadata["chunk_index"] for document, _ in results]
+
+
+@pytest.fixture
+def vectors():
+    return np.random.default_rng(0).normal(size=(300, 32)).astype(np.float32)
+
+
+@pytest.fixture
+def queries():
+    return np.random.default_rng(1).normal(size=(20, 32)).astype(np.float32)
+
+
+def test_round_trip_memory_maps_the_embeddings(tmp_path, vectors):
+    build(tmp_path, vectors)
+    store = NumpyVectorStore.load(str(tmp_path), NoEmbeddings())
+    assert isinstance(store.embeddings, np.memmap)
+    assert store.texts == [f"chunk {i}" for i in range(len(vectors))]
+    assert store.metadatas[7] == {"chunk_index": 7}
+    expected = vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+    np.testing.assert_allclose(store.embeddings, expected, rtol=1e-6, atol=1e-6)
+
+
+def test_float32_top_k_matches_brute_force(tmp_path, vectors, queries):
+    build(tmp_path, vectors)
+    store = NumpyVectorStore.load(str(tmp_path), NoEmbeddings())
+    for query in queries:
+        assert search(store, query, 10) == brute_force(vectors, query, 10)
+    results = store.similarity_search_by_vector_with_score(queries[0].tolist(), k=3)
+    scores = [score for _, score in results]
+    assert scores == sorted(scores)
+    best = vectors[brute_force(vectors, queries[0], 1)[0]]
+    cosine = best @ queries[0] / (np.linalg.norm(best) * np.linalg.norm(queries[0]))
+    assert scores[0] == pytest.approx(1 - cosine, abs=1e-5)
+
+
+@pytest.mark.parametrize("quantization", ["float16", "int8"])
+def test_quantized_top_k_recall(tmp_path, vectors, queries, quantization):
+    build(tmp_path, vectors, quantization=quantization, rerank_factor=0)
+    store = NumpyVectorStore.load(str(tmp_path), NoEmbeddings())
+    assert set(store._quantized) == set(QUANTIZED_FILES[quantization])
+    assert not (tmp_path / EMBEDDINGS_FILE).exists()
+    found = sum(len(set(search(store, query, 10)) & set(brute_force(vectors, query, 10))) for query in queries)
+    assert found / (10 * len(queries)) >= 0.9
+
+
+@pytest.mark.parametrize("quantization", ["float16", "int8"])
+def test_quantized_rerank_matches_brute_force(tmp_path, vectors, queries, quantization):
+    build(tmp_path, vectors, quantization=quantization, rerank_factor=4)
+    store = NumpyVectorStore.load(str(tmp_path), NoEmbeddings())
+    assert "exact" in store._quantized
+    for query in queries:
+        assert search(store, query, 10) == brute_force(vectors, query, 10)
+
+
+def test_filter_restricts_the_results(tmp_path, vectors, queries):
+    store = build(tmp_path, vectors)
+    results = store.similarity_search_by_vector_with_score(queries[0].tolist(), k=5, filter={"chunk_index": 42})
+    assert [document.metadata["chunk_index"] for document, _ in results] == [42]
@@ -0,0 +1,80 @@
+"""Request coalescing and per-client limits of the HTTP API"""
+import asyncio
+
+import pytest
+
+pytest.importorskip("aiohttp")
+
+from server import ClientLimiter, Singleflight
+
+
+def test_singleflight_runs_concurrent_identical_calls_once():
+    async def scenario():
+        singleflight = Singleflight()
+        release = asyncio.Event()
+        calls = []
+
+        async def answer(question):
+            calls.append(question)
+            await release.wait()
+            return f"answer to {question}"
+
+        waiting = [
+            asyncio.ensure_future(singleflight.do(question, lambda question=question: answer(question)))
+            for question in ("q1", "q1", "q1", "q2")
+        ]
+        await asyncio.sleep(0)
+        assert len(singleflight) == 2
+        release.set()
+        results = await asyncio.gather(*waiting)
+        assert results == [
+            ("answer to q1", False),
+            ("answer to q1", True),
+            ("answer to q1", True),
+            ("answer to q2", False),
+        ]
+        assert calls == ["q1", "q2"]
+        assert (singleflight.calls, singleflight.shared) == (2, 2)
+        # finished calls are forgotten, the next identical question runs again
+        assert len(singleflight) == 0
+        assert await singleflight.do("q1", lambda: answer("q1")) == ("answer to q1", False)
+
+    asyncio.run(scenario())
+
+
+def test_singleflight_shares_failures_and_survives_a_cancelled_caller():
+    async def scenario():
+        singleflight = Singleflight()
+        release = asyncio.Event()
+
+        async def failing():
+            await release.wait()
+            raise RuntimeError("rate limited")
+
+        first = asyncio.ensure_future(singleflight.do("q", failing))
+        second = asyncio.ensure_future(singleflight.do("q", failing))
+        await asyncio.sleep(0)
+        # a disconnecting client does not cancel the call the other one waits for
+        first.cancel()
+        release.set()
+        with pytest.raises(RuntimeError, match="rate limited"):
+            await second
+        assert first.cancelled()
+
+    asyncio.run(scenario())
+
+
+def test_client_limiter_rejects_requests_over_the_cap():
+    limiter = ClientLimiter(max_in_flight=2)
+    assert limiter.try_acquire("a")
+    assert limiter.try_acquire("a")
+    assert not limiter.try_acquire("a")
+    # other clients are not affected
+    assert limiter.try_acquire("b")
+    assert limiter.in_flight == 3
+    assert limiter.rejected == 1
+    limiter.release("a")
+    assert limiter.try_acquire("a")
+    for client in ("a", "a", "b"):
+        limiter.release(client)
+    assert limiter.in_flight == 0
@@ -0,0 +1,89 @@
+"""ShardedSearcher scatter-gather against brute-force search and recovery from a dead shard worker"""
+import numpy as np
+import pytest
+
+pytest.importorskip("langchain.vectorstores")
+
+from langchain.docstore.document import Document
+
+from numpy_store import NumpyVectorStore
+from shards import ShardedSearcher, build_corpus
+
+N_VIDEOS = 12
+CHUNKS_PER_VIDEO = 40
+DIM = 32
+
+
+def video_id(i: int) -> str:
+    return f"video{i:06d}"
+
+
+@pytest.fixture(scope="module")
+def vectors():
+    rng = np.random.default_rng(0)
+    vectors = rng.normal(size=(N_VIDEOS * CHUNKS_PER_VIDEO, DIM)).astype(np.float32)
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+@pytest.fixture(scope="module")
+def corpus_dir(tmp_path_factory, vectors):
+    # two segments, each holding the chunks of every video ingested into it
+    stores = [NumpyVectorStore(None), NumpyVectorStore(None)]
+    for row, vector in enumerate(vectors):
+        video = row // CHUNKS_PER_VIDEO
+        document = Document(page_content=f"chunk {row}", metadata={"source": video_id(video), "row": row})
+        stores[video % 2].add_embeddings([document], [vector.tolist()])
+    corpus_dir = str(tmp_path_factory.mktemp("corpus"))
+    build_corpus(stores, corpus_dir, n_shards=3, n_lists=4)
+    return corpus_dir
+
+
+def brute_force(vectors: np.ndarray, query: np.ndarray, k: int, rows=None) -> list:
+    rows = np.arange(len(vectors)) if rows is None else rows
+    return rows[np.argsort(-(vectors[rows] @ query), kind="stable")[:k]].tolist()
+
+
+def found_rows(results) -> list:
+    return [document.metadata["row"] for document, _ in results]
+
+
+def test_merged_top_k_matches_brute_force(corpus_dir, vectors):
+    queries = np.random.default_rng(1).normal(size=(10, DIM)).astype(np.float32)
+    with ShardedSearcher(corpus_dir, nprobe=4, processes=False) as searcher:
+        assert searcher.sizes == [160, 160, 160]
+        for query in queries:
+            query = query / np.linalg.norm(query)
+            # every list of every shard is probed, so the merge alone decides the result
+            results = searcher.search(query, k=10, nprobe=100)
+            assert found_rows(results) == brute_force(vectors, query, 10)
+            distances = [distance for _, distance in results]
+            assert distances == sorted(distances)
+            np.testing.assert_allclose(distances, 1 - vectors[found_rows(results)] @ query, atol=1e-5)
+        assert searcher.stats()["shards_per_query"] == 3
+
+
+def test_video_filter_only_reaches_its_shard(corpus_dir, vectors):
+    query = vectors[5]
+    with ShardedSearcher(corpus_dir, processes=False) as searcher:
+        results = searcher.search(query, k=5, video_ids=[video_id(3)])
+        rows = np.arange(3 * CHUNKS_PER_VIDEO, 4 * CHUNKS_PER_VIDEO)
+        assert found_rows(results) == brute_force(vectors, query, 5, rows)
+        assert searcher.shard_requests == 1
+        assert searcher.search(query, k=5, video_ids=["unknownvid0"]) == []
+
+
+def test_dead_worker_breaks_the_searcher_until_reopened(corpus_dir, vectors):
+    searcher = ShardedSearcher(corpus_dir, processes=True)
+    assert found_rows(searcher.search(vectors[0], k=3, nprobe=100)) == brute_force(vectors, vectors[0], 3)
+    searcher._workers[1].kill()
+    searcher._workers[1].join(5)
+    with pytest.raises(RuntimeError, match="Shard worker failed"):
+        searcher.search(vectors[0], k=3)
+    assert searcher.broken is not None
+    # the surviving shards' replies were drained, but the searcher refuses to answer with a shard missing
+    with pytest.raises(RuntimeError, match="open a new ShardedSearcher"):
+        searcher.search(vectors[0], k=3)
+    searcher.close()
+
+    with ShardedSearcher(corpus_dir, processes=True) as reopened:
+        assert found_rows(reopened.search(vectors[0], k=1, nprobe=100)) == [0]
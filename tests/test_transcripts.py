@@ -0,0 +1,89 @@
+"""HedgedFetcher and TranscriptLoader against local fake sources"""
+import threading
+import time
+
+import pytest
+
+from transcripts import HedgedFetcher, TranscriptCache, TranscriptLoader, canonical_video_id, caption
+
+VIDEO_ID = "dQw4w9WgXcQ"
+
+
+def source(name, delay=0.0, result=True, error=None, calls=None):
+    def fetch(video_id):
+        if calls is not None:
+            calls.append(name)
+        time.sleep(delay)
+        if error is not None:
+            raise error
+        return [caption(video_id, name, 0.0, 1.0)] if result else []
+
+    fetch.__name__ = name
+    return fetch
+
+
+def test_first_source_wins_without_hedging():
+    calls = []
+    fetcher = HedgedFetcher([source("primary", calls=calls), source("fallback", calls=calls)], hedge_delay=1.0)
+    assert fetcher(VIDEO_ID)[0].page_content == "primary"
+    assert calls == ["primary"]
+
+
+def test_slow_source_is_hedged():
+    fetcher = HedgedFetcher([source("slow", delay=1.0), source("fast")], hedge_delay=0.05)
+    start = time.monotonic()
+    assert fetcher(VIDEO_ID)[0].page_content == "fast"
+    assert time.monotonic() - start < 0.5
+
+
+def test_failed_source_starts_the_next_one_at_once():
+    fetcher = HedgedFetcher([source("broken", error=OSError("down")), source("fallback")], hedge_delay=10.0)
+    start = time.monotonic()
+    assert fetcher(VIDEO_ID)[0].page_content == "fallback"
+    assert time.monotonic() - start < 1.0
+
+
+def test_empty_result_counts_as_failure():
+    fetcher = HedgedFetcher([source("empty", result=False), source("fallback")], hedge_delay=10.0)
+    assert fetcher(VIDEO_ID)[0].page_content == "fallback"
+
+
+def test_all_sources_failing_raises():
+    fetcher = HedgedFetcher([source("empty", result=False), source("broken", error=OSError("down"))], hedge_delay=0.0)
+    with pytest.raises(LookupError):
+        fetcher(VIDEO_ID)
+
+
+def test_loader_fetches_once_and_serves_the_cache(tmp_path):
+    calls = []
+    loader = TranscriptLoader(TranscriptCache(str(tmp_path)), HedgedFetcher([source("primary", calls=calls)]))
+    first = loader(f"https://youtu.be/{VIDEO_ID}")
+    second = loader(f"https://www.youtube.com/watch?v={VIDEO_ID}&t=42")
+    assert [d.page_content for d in first] == [d.page_content for d in second] == ["primary"]
+    assert calls == ["primary"]
+
+
+def test_concurrent_cache_writes_leave_a_whole_transcript(tmp_path):
+    cache = TranscriptCache(str(tmp_path))
+    documents = [caption(VIDEO_ID, f"line {i}", i, i + 1) for i in range(200)]
+    threads = [threading.Thread(target=cache.put, args=(VIDEO_ID, documents)) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert len(cache.get(VIDEO_ID)) == 200
+
+
+@pytest.mark.parametrize(
+    "url",
+    [
+        VIDEO_ID,
+        f"https://youtu.be/{VIDEO_ID}",
+        f"https://www.youtube.com/watch?v={VIDEO_ID}&list=x",
+        f"m.youtube.com/watch?v={VIDEO_ID}",
+        f"https://www.youtube.com/embed/{VIDEO_ID}",
+        f"https://www.youtube.com/shorts/{VIDEO_ID}",
+    ],
+)
+def test_canonical_video_id(url):
+    assert canonical_video_id(url) == VIDEO_ID
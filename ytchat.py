@@ -1,31 +1,36 @@
 import streamlit as st
 from streamlit_chat import message
 from streamlit_extras.colored_header import colored_header
-from streamlit_extras.add_vertical_space import add_vertical_space
 
-from langchain.document_loaders import YoutubeLoader
-from langchain.text_splitter import RecursiveCharacterTextSplitter
-from langchain.embeddings.openai import OpenAIEmbeddings
 from langchain.vectorstores import Chroma
-from langchain.chat_models import ChatOpenAI
-from langchain.chains import LLMChain
 from dotenv import find_dotenv, load_dotenv
 from langchain.prompts.chat import (
     ChatPromptTemplate,
     SystemMessagePromptTemplate,
     HumanMessagePromptTemplate,
 )
-import textwrap
 import os
-import youtube_dl
+import sys
+from collections import deque
+
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)), "src"))
+from chat_history import ChatHistoryStore, ChatWindow, new_session_id
+from chunking import stream_chunks
+from config import default_config
+from context import pack_context
+from streaming import StreamlitTokenHandler
+from embedding_cache import cached_openai_embeddings
+from index_cache import IndexCache, IndexKey, embedding_model_name
+from llm_pool import llm_pool
+from transcripts import canonical_video_id, default_transcript_loader
 
 
 load_dotenv(find_dotenv())
 try:
-    embeddings = OpenAIEmbeddings()
+    embeddings = cached_openai_embeddings()
 except Exception as e:
     os.environ['OPENAI_API_KEY'] = st.secrets['OPENAI_API_KEY']
-    embeddings = OpenAIEmbeddings()
+    embeddings = cached_openai_embeddings()
 
 
 
@@ -33,23 +38,32 @@ st.title('🎈 AI YOUTUBE CHAT')
 
 st.write('Wassup AI WORLD!')
 
+@st.cache_resource
+def get_index_cache():
+    return IndexCache(
+        default_config.index_cache_dir,
+        max_disk_bytes=default_config.index_cache_max_bytes,
+        max_open=default_config.index_cache_max_open,
+    )
+
+
 def create_db_from_youtube_video_url(video_url):
-    try:
-        loader = YoutubeLoader.from_youtube_url(video_url)
-    except:
-        loader = YoutubeLoader.from_youtube_url(video_id = video_url.split('youtu.be/')[-1])
-    try:
-        transcript = loader.load()
-    except:
-        youtube_dl_options = {"writesubtitles": True}
+    key = IndexKey(
+        video_id=canonical_video_id(video_url),
+        chunk_size=default_config.chunk_size,
+        chunk_overlap=default_config.chunk_overlap,
+        embedding_model=embedding_model_name(embeddings),
+    )
+    return get_index_cache().get_or_build(
+        key, embeddings, lambda persist_directory: build_db(video_url, persist_directory)
+    )
 
-        with youtube_dl.YoutubeDL(youtube_dl_options) as youtube_dl_client:
-            transcript= youtube_dl_client.download([video_url])
 
-    text_splitter = RecursiveCharacterTextSplitter(chunk_size=500, chunk_overlap=100)
-    docs = text_splitter.split_documents(transcript)
+def build_db(video_url, persist_directory):
+    transcript = default_transcript_loader().stream(video_url)
+    docs = list(stream_chunks(transcript, default_config.chunk_size, default_config.chunk_overlap))
 
-    db = Chroma.from_documents(documents = docs,embedding = embeddings)
+    db = Chroma.from_documents(documents = docs,embedding = embeddings, persist_directory=persist_directory)
     
     if db:
         return db
@@ -57,17 +71,9 @@ def create_db_from_youtube_video_url(video_url):
         return None
 
 
-def get_response_from_query(db, query, k=8):
-    """
-    gpt-3.5-turbo can handle up to 4097 tokens. Setting the chunksize to 500 and k to 8 maximizes
-    the number of tokens to analyze.
-    """
-
-    docs = db.similarity_search(query, k=k)
-    docs_page_content = " ".join([d.page_content for d in docs])
-
-    chat = ChatOpenAI(model_name="gpt-3.5-turbo", temperature=0.3)
-
+@st.cache_resource
+def get_chat_prompt():
+    """Built once per process so the pooled chain for it is reused across reruns"""
     # Template to use for the system message prompt
     template = """
         You are a helpful assistant that that can answer questions about youtube videos 
@@ -87,13 +93,26 @@ def get_response_from_query(db, query, k=8):
     human_template = "Answer the following question: {question}"
     human_message_prompt = HumanMessagePromptTemplate.from_template(human_template)
 
-    chat_prompt = ChatPromptTemplate.from_messages(
+    return ChatPromptTemplate.from_messages(
         [system_message_prompt, human_message_prompt]
     )
 
-    chain = LLMChain(llm=chat, prompt=chat_prompt)
 
-    response = chain.run(question=query, docs=docs_page_content)
+def get_response_from_query(db, query, k=default_config.retrieval_fetch_k, callbacks=None):
+    """
+    Overlapping chunks are merged back together and packed into the context token budget,
+    so the prompt holds as much distinct transcript as fits next to the answer.
+    """
+
+    docs = db.similarity_search(query, k=k)
+    docs_page_content = pack_context(
+        docs, model_name="gpt-3.5-turbo", token_budget=default_config.context_token_budget
+    ).text
+
+    # the client and chain are shared by all questions, only the callbacks are per question
+    chain = llm_pool.chain(get_chat_prompt(), model_name="gpt-3.5-turbo", temperature=0.3, streaming=bool(callbacks))
+
+    response = chain.run(question=query, docs=docs_page_content, callbacks=callbacks)
     response = response.replace("\n", "")
     return response
 
@@ -116,18 +135,41 @@ with st.sidebar:
     ''')
     st.write('Made with ❤️ by [Akash Rakshit](https://www.linkedin.com/in/akash-rakshit-020761175/)')
 
-try:
-    db = create_db_from_youtube_video_url(video_url)
-except Exception as e:
-    st.image('YouTube-Logo.wine.png')
-
-
-## generated stores AI generated responses
-if 'generated' not in st.session_state:
-    st.session_state['generated'] = ["I am AI YOUTUBE CHAT, How may I help you?"]
-## past stores User's questions
-if 'past' not in st.session_state:
-    st.session_state['past'] = ['Hi!']
+db = None
+if video_url:
+    try:
+        db = create_db_from_youtube_video_url(video_url)
+    except Exception as e:
+        st.image('YouTube-Logo.wine.png')
+
+
+@st.cache_resource
+def get_chat_history():
+    return ChatHistoryStore(default_config.chat_history_path)
+
+
+## session_id is kept in the page url so a reload or restart continues the conversation,
+## the ?session= url is the only credential of the persisted chat: whoever opens it reads and continues it
+if 'session_id' not in st.session_state:
+    session_id = st.query_params.get('session')
+    if not session_id:
+        session_id = new_session_id()
+        st.query_params['session'] = session_id
+    st.session_state['session_id'] = session_id
+## chat_window holds the latest turns about the current video, the rest stay in the chat history store
+video_id = canonical_video_id(video_url) if db is not None else ""
+if 'chat_window' not in st.session_state or st.session_state['chat_window'].video_id != video_id:
+    st.session_state['chat_window'] = ChatWindow(
+        get_chat_history(),
+        st.session_state['session_id'],
+        video_id,
+        page_size=default_config.chat_history_page_size,
+        max_turns=default_config.chat_history_max_turns,
+    )
+window = st.session_state['chat_window']
+## timings stores time-to-first-token and generation time of the latest questions
+if 'timings' not in st.session_state:
+    st.session_state['timings'] = deque(maxlen=default_config.chat_history_max_turns)
 
 # Layout of input/response containers
 input_container = st.container()
@@ -146,16 +188,26 @@ with input_container:
 
 ## Conditional display of AI generated responses as a function of user provided prompts
 with response_container:
-    if user_input:
-        db = create_db_from_youtube_video_url(video_url)
-        response = get_response_from_query(db, user_input)
-        st.session_state.past.append(user_input)
-        st.session_state.generated.append(response)
-        
-    if st.session_state['generated']:
-        for i in range(len(st.session_state['generated'])):
-            message(st.session_state['past'][i], is_user=True, key=str(i) + '_user')
-            message(st.session_state["generated"][i], key=str(i))
+    # the input keeps its value across reruns, only a new question or the same one
+    # about another video is answered
+    question_key = (video_id, user_input)
+    if user_input and db is not None and question_key != st.session_state.get('answered_input'):
+        st.session_state['answered_input'] = question_key
+        answer_placeholder = st.empty()
+        token_handler = StreamlitTokenHandler(answer_placeholder)
+        response = get_response_from_query(db, user_input, callbacks=[token_handler])
+        answer_placeholder.empty()
+        window.add(user_input, response)
+        st.session_state.timings.append(token_handler.metrics())
+
+    if window.can_load_older and st.button("Load older messages"):
+        window.load_older()
+    if not window.has_older:
+        message('Hi!', is_user=True, key='greeting_user')
+        message("I am AI YOUTUBE CHAT, How may I help you?", key='greeting')
+    for turn in window.turns:
+        message(turn.question, is_user=True, key=f"{turn.id}_user")
+        message(turn.answer, key=str(turn.id))
                 
 
 # use langchain==0.0.138
\ No newline at end of file